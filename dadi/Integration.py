@@ -5,31 +5,186 @@ Functions for integrating population frequency spectra.
 import logging
 logger = logging.getLogger('Integration')
 
-# Note that these functions have all be written for xx=yy=zz, so the grids are
-# identical in each direction. That's not essential here, though. The reason we
-# do it is because later we'll want to extrapolate, and it's not obvious how to
-# do so if the grids differ.
-#
-# Note that we could do different grids, if we solved a more complex
-# extrapolation polynomial. For example:
-#    val = a + b x + c x^2 + d y + e y^2 + f x y
-# Where x and y denote the injection points for x and y axes.
+# Note that the grids may differ among populations. A population with a small
+# sample size or weak drift can then use a coarser grid than the others. The
+# extrapolation is then over the injection points of each axis, as done by
+# Numerics.multivariate_extrap.
 
 # Also note that we have tested using multiprocessing to split up calls to
 # the C integration methods. This appears to give no speedup (or even cause a
 # slowdown). I suspect this is due to the cost of copying phi back and forth
 # between subprocesses. I tried using shared memory to fix this, but was
 # unsuccessful.
+#
+# Threads don't have that problem, because they share phi. The C methods
+# release the GIL, so we can instead split the independent line solves of a
+# single sweep among threads, using the Mstart/Mend (or Lstart/Lend) ranges
+# of the C methods. See num_threads.
+#
+# The C methods keep no state between calls, and any scratch space is owned
+# by the caller. The caches and the thread pool here and in PhiManip are
+# guarded by locks, and the state of each integration is kept per thread, so
+# whole model evaluations can also run in several threads at once. See
+# last_timesteps and last_equilibrium for what they report then.
 
 #: Controls use of Chang and Cooper's delj trick, which seems to lower accuracy.
 use_delj_trick = False
-
+#: Whether to use exponentially fitted fluxes for drift and selection, rather
+#: than central differences. These weight V*phi at the two ends of each grid
+#: interval by Chang and Cooper's factor, so that equilibria with genic
+#: selection are exact at the grid points, and phi is accurate on coarser
+#: grids. Spectrum.from_phi then by default also samples phi to higher order,
+#: by interpolating x*(1-x)*phi piecewise quadratically. That is smooth where
+#: phi diverges at the boundaries. See its fitted argument. A single grid is then often about as accurate
+#: as the usual extrapolation over three. This overrides use_delj_trick.
+use_fitted_fluxes = False
+
+import collections
+import hashlib
+import threading
 import numpy
 from numpy import newaxis as nuax
+from multiprocessing.pool import ThreadPool
+import scipy.linalg
+import scipy.sparse
+import scipy.sparse.linalg
 
 import Misc, Numerics, tridiag
 import integration_c as int_c
 
+#: Number of threads to split each sweep of the 2D and 3D integrations among.
+#: Each thread solves a contiguous block of the independent tridiagonal
+#: systems. This is most useful for large 3D integrations, for which each
+#: sweep is a lot of work. For small grids, the threading overhead may
+#: outweigh the gain.
+num_threads = 1
+
+#: Whether the constant-parameter integrations should store the operators for
+#: the last axis transposed. The sweep along that axis then works on blocks of
+#: phi transposed so that many lines are solved together, rather than one
+#: contiguous line at a time. This is typically faster and does not change
+#: the results.
+use_transposed_sweeps = True
+
+#: Whether the constant-parameter 2D and 3D integrations without migration
+#: should share one 1D operator among all the lines along each axis. Without
+#: migration, the populations evolve independently, so those lines differ
+#: only in the boundary conditions at the corners of phi. No coefficient
+#: arrays the size of phi are then needed, each sweep reads little beyond phi
+#: itself, and the results do not change. These integrations are always in
+#: double precision.
+use_shared_operators = True
+
+#: Whether the constant-parameter 2D and 3D integrations should store phi and
+#: their operators in single precision. This halves their memory use and the
+#: memory traffic of each sweep, which matters most for large 3D grids. The
+#: sweeps along the last axis are then always transposed.
+use_single_precision = False
+#: Whether single-precision integrations refine each tridiagonal solve with
+#: one step of iterative refinement, computing the residual in double
+#: precision. Each sweep is then accurate to single-precision rounding, and
+#: the final phi typically agrees with double precision to a relative
+#: tolerance of 1e-4. Without refinement, the errors are several times larger.
+single_precision_refinement = True
+
+#: Largest amount of memory, in bytes, that the three_pops integrations with
+#: constant parameters may use for their precomputed operators. Those take
+#: about fifteen arrays the size of phi: the coefficients along each axis,
+#: and their factors. Above this, the coefficients of each line are instead
+#: computed as it is solved, as for parameters that vary in time, so little
+#: memory is needed beyond phi. Each step is then slower. Set to None to
+#: always precompute the operators.
+low_memory_threshold = 2**28
+
+#: Number of arrays each thread keeps in its workspace. See _work_arrays.
+workspace_cache_size = 32
+
+#: Pool of threads used for sweeps, created as needed.
+_thread_pool = None
+_thread_pool_lock = threading.Lock()
+
+#: Per-thread storage for the workspace.
+_workspace = threading.local()
+
+def _work_arrays(name, shape, num=1, zero=False, dtype=numpy.float64):
+    """
+    Return num arrays of the given shape and dtype from this thread's
+    workspace.
+
+    The integrations take their coefficient and scratch arrays from here, so
+    that they are reused from step to step and from call to call, rather than
+    allocated anew each time. The arrays are only valid until the next request
+    with the same name and shape, and their contents are arbitrary unless zero
+    is True.
+    """
+    cache = getattr(_workspace, 'cache', None)
+    if cache is None:
+        cache = _workspace.cache = collections.OrderedDict()
+
+    key = (name, shape, num, dtype)
+    # This is called for every sweep, so hits avoid the slow OrderedDict
+    # methods, and the oldest arrays are released first, not the least
+    # recently used.
+    arrays = cache.get(key)
+    if arrays is None:
+        arrays = cache[key] = [numpy.empty(shape, dtype)
+                               for ii in range(num)]
+        while len(cache) > workspace_cache_size:
+            cache.popitem(last=False)
+
+    if zero:
+        for arr in arrays:
+            arr.fill(0)
+    return arrays
+
+def clear_workspace():
+    """
+    Release the arrays held in this thread's workspace.
+    """
+    _workspace.cache = collections.OrderedDict()
+
+def _sweep(func, phi, num_lines, *args, **kwargs):
+    """
+    Apply the C sweep func to phi, splitting its line solves among threads.
+
+    func: C integration method that modifies phi in place and whose last two
+          arguments specify the range of lines to solve.
+    num_lines: Total number of lines func would solve, which is the length of
+               phi along the axis indexed by func's range arguments.
+    args: Other arguments to pass to func, after phi.
+    work_size: If given, func also takes a scratch array of this length,
+               after args. Each thread takes it from its own workspace.
+    dtype: The dtype of phi that func expects. Defaults to float64.
+    """
+    work_size = kwargs.get('work_size')
+    dtype = kwargs.get('dtype', numpy.float64)
+    num_chunks = min(num_threads, num_lines)
+    if num_chunks <= 1:
+        if work_size is not None:
+            args += tuple(_work_arrays(func, (work_size,)))
+        return func(phi, *args)
+
+    global _thread_pool
+    # The chunks all write into the same array, so it must not be copied
+    # by f2py.
+    if not (phi.flags.c_contiguous and phi.dtype == dtype):
+        phi = numpy.ascontiguousarray(phi, dtype=dtype)
+    bounds = numpy.linspace(0, num_lines, num_chunks+1).astype(int)
+    def solve_chunk(chunk):
+        chunk_args = args
+        if work_size is not None:
+            chunk_args += tuple(_work_arrays(func, (work_size,)))
+        func(phi, *(chunk_args + (bounds[chunk], bounds[chunk+1])))
+    # Sweeps from different threads take turns with the pool, so that it
+    # isn't replaced while in use.
+    with _thread_pool_lock:
+        if _thread_pool is None or _thread_pool._processes != num_threads:
+            if _thread_pool is not None:
+                _thread_pool.close()
+            _thread_pool = ThreadPool(num_threads)
+        _thread_pool.map(solve_chunk, range(num_chunks))
+    return phi
+
 #: Controls timestep for integrations. This is a reasonable default for
 #: gridsizes of ~60. See set_timescale_factor for better control.
 timescale_factor = 1e-3
@@ -117,8 +272,8 @@ def _compute_dt(dx, nu, ms, gamma, h):
     # shown that extrapolation is much more reliable when the same timesteps
     # are used in evaluations at different grid sizes.
     maxVM = max(0.25/nu, sum(ms),\
-                abs(gamma) * 2*max(numpy.abs(h + (1-2*h)*0.5) * 0.5*(1-0.5),
-                                   numpy.abs(h + (1-2*h)*0.25) * 0.25*(1-0.25)))
+                abs(gamma) * 2*max(abs(h + (1-2*h)*0.5) * 0.5*(1-0.5),
+                                   abs(h + (1-2*h)*0.25) * 0.25*(1-0.25)))
     if maxVM > 0:
         dt = timescale_factor / maxVM
     else:
@@ -128,6 +283,564 @@ def _compute_dt(dx, nu, ms, gamma, h):
                          'gamma=%f, h=%f.' % (nu, str(ms), gamma, h))
     return dt
 
+#: Time integration scheme for integrations with constant parameters.
+#: 'euler' is first-order implicit Euler, with the directions swept in turn.
+#: 'cn' is second-order, using Crank-Nicolson sweeps with the directions in
+#: symmetric (Strang) order, e.g. x/2, y, x/2 in two dimensions. It reaches
+#: the same accuracy with larger timesteps, so timescale_factor can be
+#: raised. 'expm' applies the exact solution in time of the spatially
+#: discretized equation, exp(-A T), across the whole integration at once. It
+#: is available for one and two populations, and otherwise acts as 'euler'.
+#: For one population, the exponential is computed densely, so its cost
+#: barely depends on T, which makes long epochs cheap. For two, it is applied
+#: with scipy's expm_multiply, whose cost grows with T, so it is mainly
+#: useful for results free of timestep error. Integrations with parameters
+#: that vary in time always use implicit Euler.
+time_scheme = 'euler'
+
+def _crank_nicolson():
+    """
+    Whether time_scheme selects Crank-Nicolson.
+    """
+    if time_scheme not in ['euler', 'cn', 'expm']:
+        raise ValueError('Unknown time_scheme %s. Should be "euler", "cn", or '
+                         '"expm".' % time_scheme)
+    return time_scheme == 'cn'
+
+def _sparse_operator(coeffs, shape):
+    """
+    Sparse matrix of the operator A, acting on phi flattened, whose implicit
+    steps along each axis solve the tridiagonal systems (a, b + 1/dt, c).
+
+    coeffs: For each axis, the arrays (a, b, c) with the shape of phi, or None
+            if that axis is frozen.
+    """
+    size = int(numpy.prod(shape))
+    A = scipy.sparse.csr_matrix((size, size))
+    for axis, abc in enumerate(coeffs):
+        if abc is None:
+            continue
+        a, b, c = [numpy.asarray(arr, numpy.float64).ravel() for arr in abc]
+        # Neighbors along axis are this far apart in the flattened phi. The
+        # coefficients coupling the ends of neighboring lines are zero.
+        stride = int(numpy.prod(shape[axis+1:]))
+        A = A + scipy.sparse.diags([a[stride:], b, c[:-stride]],
+                                   [-stride, 0, stride], shape=(size, size))
+    return A.tocsr()
+
+def _expm_propagate(phi, A, source, T, dense=False):
+    """
+    Return phi advanced by T under d phi/dt = -A phi + source.
+
+    The affine equation is solved by a single exponential of A augmented with
+    the source, which is computed densely if dense is True, and otherwise
+    applied to phi with expm_multiply.
+    """
+    size = phi.size
+    vec = numpy.append(phi.ravel(), 1)
+    if dense:
+        aug = numpy.zeros((size+1, size+1))
+        aug[:size,:size] = -A.toarray()
+        aug[:size,size] = source.ravel()
+        result = numpy.dot(scipy.linalg.expm(aug*T), vec)
+    else:
+        aug = scipy.sparse.bmat([[-A, source.reshape(-1, 1)],
+                                 [None, scipy.sparse.csr_matrix((1, 1))]])
+        result = scipy.sparse.linalg.expm_multiply(aug.tocsr()*T, vec)
+    return result[:size].reshape(phi.shape)
+
+def _explicit_half_step(phi, a, b, c, dt, axis=0):
+    """
+    Return phi - dt * A phi, where the implicit step of dt with operator A
+    along axis solves the tridiagonal systems (a, b + 1/dt, c).
+
+    Solving those systems with this in place of phi makes the step a
+    Crank-Nicolson step of 2*dt.
+    """
+    phi, a, b, c = [numpy.swapaxes(arr, 0, axis) for arr in (phi, a, b, c)]
+    Aphi = b*phi
+    Aphi[1:] += a[1:]*phi[:-1]
+    Aphi[:-1] += c[:-1]*phi[1:]
+    return numpy.swapaxes(phi - dt*Aphi, 0, axis)
+
+#: Whether to choose timesteps adaptively, by step doubling. Each step is
+#: compared with two steps of half the size, and the step size is doubled or
+#: halved so that the estimated relative error of each step stays below
+#: adaptive_tolerance. Steps are never smaller than those of the standard
+#: method, so this mainly helps when phi changes slowly, such as in long
+#: equilibration epochs.
+#:
+#: Extrapolation relies on the same timesteps being used for every grid
+#: size. So the steps chosen for an integration are cached, keyed by the
+#: integration's parameters, and reused by later integrations with the same
+#: parameters but different grids. For parameters that are functions of time,
+#: the key uses their values at several times.
+use_adaptive_timesteps = False
+#: Tolerance on the estimated relative error of each adaptive step.
+adaptive_tolerance = 1e-3
+#: Maximum number of integrations whose adaptive timesteps are cached.
+adaptive_cache_size = 1000
+_adaptive_schedules = collections.OrderedDict()
+_adaptive_lock = threading.Lock()
+
+#: The timesteps taken by the most recent integration, as a list of
+#: (t, dt) pairs. When integrations run in several threads, this is for the
+#: one that finished last.
+last_timesteps = []
+#: Guards the updates of last_timesteps and last_equilibrium.
+_last_lock = threading.Lock()
+#: Per-thread state of the integration in progress: the time at which it
+#: reached equilibrium, or None. See _finish_integration.
+_integration_state = threading.local()
+
+#: Maximum total size, in bytes, of the results kept by the checkpoint cache.
+#: When an optimizer changes only the parameters of a late epoch, the earlier
+#: epochs of the model are integrated from the same phi with the same
+#: parameters as before, so their results can be reused. Each integration is
+#: keyed by a digest of the phi it starts from, its grids, its parameters, and
+#: its timesteps. The starting phi is itself the result of the preceding
+#: epochs, so a hit means the whole upstream history was identical. The least
+#: recently used results are dropped first. The cache is off by default, as
+#: the stored results hold memory across calls; set this to, e.g., 2**27 to
+#: enable it.
+checkpoint_cache_bytes = 0
+_checkpoints = collections.OrderedDict()
+_checkpoint_lock = threading.Lock()
+
+def clear_checkpoints():
+    """
+    Release the results held in the checkpoint cache.
+    """
+    with _checkpoint_lock:
+        _checkpoints.clear()
+
+def _checkpoint_key(key_params, phi, xx, steps):
+    """
+    Digest identifying the integration of phi on the grids xx through the
+    (t, dt) steps, for the checkpoint cache.
+
+    key_params: As in _integrate_steps. Parameters that are functions of time
+                are represented by their values for each step.
+    """
+    # The options that only change the rounding are included as well, so
+    # that integrations with different options can still be compared.
+    digest = hashlib.sha1()
+    digest.update(repr((use_delj_trick, use_fitted_fluxes, time_scheme,
+                        use_single_precision, single_precision_refinement,
+                        num_threads, use_transposed_sweeps,
+                        equilibrium_shortcut, equilibrium_tolerance,
+                        equilibrium_check_steps, phi.shape, str(phi.dtype))))
+    digest.update(numpy.ascontiguousarray(phi))
+    for grid in Numerics.expand_grids(xx, phi.ndim):
+        digest.update(numpy.ascontiguousarray(grid, dtype=numpy.float64))
+    digest.update(numpy.array(steps, dtype=numpy.float64))
+    for param in key_params:
+        if callable(param):
+            dts, (values,) = _step_values([param], steps)
+            digest.update(values)
+        else:
+            digest.update(repr(param))
+    return digest.hexdigest()
+
+def _checkpointed_steps(take_steps, phi, xx, steps, key_params):
+    """
+    Advance phi through the (t, dt) steps with take_steps, unless the result
+    is in the checkpoint cache.
+
+    The cache also records the time each result reached equilibrium, if any.
+    """
+    if checkpoint_cache_bytes <= 0:
+        return take_steps(phi, steps)
+
+    key = _checkpoint_key(key_params, phi, xx, steps)
+    with _checkpoint_lock:
+        stored = _checkpoints.pop(key, None)
+        if stored is not None:
+            _checkpoints[key] = stored
+            phi, _integration_state.equilibrium = stored
+            return phi.copy()
+
+    phi = take_steps(phi, steps)
+    _store_checkpoint(key, phi)
+    return phi
+
+def _store_checkpoint(key, phi):
+    """
+    Add a copy of phi to the checkpoint cache, dropping the least recently
+    used results to stay within checkpoint_cache_bytes.
+    """
+    if phi.nbytes > checkpoint_cache_bytes:
+        return
+    with _checkpoint_lock:
+        _checkpoints[key] = phi.copy(), _integration_state.equilibrium
+        total = sum(arr.nbytes for arr, t in _checkpoints.values())
+        while total > checkpoint_cache_bytes:
+            key, (arr, t) = _checkpoints.popitem(last=False)
+            total -= arr.nbytes
+
+#: Shortcut for integrations with constant parameters that reach
+#: equilibrium before T, such as long burn-in epochs. If None, all the steps
+#: to T are taken. If 'stop', phi is compared every equilibrium_check_steps
+#: steps, and once the relative change since the last comparison, scaled up
+#: to the time remaining until T, is below equilibrium_tolerance, stepping
+#: stops and phi is returned as the result at T. If 'solve', the stationary
+#: linear system is solved directly, and once phi is within
+#: equilibrium_tolerance of that solution, it is returned as the result at
+#: T. This is only available for one population, and otherwise 'solve' acts
+#: as 'stop'. The differences are measured by the trapezoid rule over the
+#: whole grid. With adaptive timestepping, the shortcut is only taken once
+#: the steps are cached. See last_equilibrium.
+equilibrium_shortcut = None
+#: Relative tolerance for equilibrium_shortcut.
+equilibrium_tolerance = 1e-6
+#: Number of steps between the checks for equilibrium_shortcut.
+equilibrium_check_steps = 100
+
+#: If the most recent integration was cut short by equilibrium_shortcut,
+#: the time at which phi was found to be at equilibrium. Otherwise None. As
+#: for last_timesteps, with several threads this is for the integration that
+#: finished last.
+last_equilibrium = None
+
+def _error_weights(xx, ndim, boundaries=False):
+    """
+    Trapezoid rule weights for measuring differences between phis on the
+    grids xx.
+
+    boundaries: If False, the boundaries of the grid are left out. There the
+                differences between integrations barely shrink with dt.
+    """
+    axis_weights = []
+    for grid in Numerics.expand_grids(xx, ndim):
+        dx = numpy.diff(grid)
+        axis_weights.append(numpy.zeros(len(grid)))
+        axis_weights[-1][1:-1] = (dx[:-1] + dx[1:])/2
+        if boundaries:
+            axis_weights[-1][0], axis_weights[-1][-1] = dx[0]/2, dx[-1]/2
+    return reduce(numpy.multiply.outer, axis_weights)
+
+def _equilibrate_steps(take_steps, phi, xx, steps, steady_state):
+    """
+    Advance phi through the (t, dt) steps with take_steps, stopping early
+    once it is at equilibrium. See equilibrium_shortcut.
+
+    steady_state: If not None, steady_state() returns the stationary phi.
+    """
+    # The boundaries are included, since fixed alleles accumulate there.
+    weights = _error_weights(xx, phi.ndim, boundaries=True)
+    norm = lambda arr: (weights*numpy.abs(arr)).sum()
+    T = steps[-1][0] + steps[-1][1]
+    target = None
+    if equilibrium_shortcut == 'solve' and steady_state is not None:
+        target = steady_state()
+
+    for start in range(0, len(steps), equilibrium_check_steps):
+        chunk = steps[start:start+equilibrium_check_steps]
+        # take_steps may modify phi in place.
+        previous = phi.copy()
+        phi = take_steps(phi, chunk)
+        if start + len(chunk) == len(steps):
+            break
+        end = chunk[-1][0] + chunk[-1][1]
+        if target is not None:
+            distance = norm(phi - target)
+        else:
+            # As phi approaches equilibrium its rate of change falls, so the
+            # change over the remaining time is at most the current rate
+            # times that time.
+            distance = norm(phi - previous) * (T - end)/(end - chunk[0][0])
+        if distance <= equilibrium_tolerance * norm(phi):
+            _integration_state.equilibrium = end
+            logger.info('Integration reached equilibrium at t = %g, before '
+                        'T = %g.' % (end, T))
+            if target is not None:
+                return target.astype(phi.dtype)
+            return phi
+    return phi
+
+def _schedule_key(key_params, initial_t, T):
+    """
+    Hashable key identifying an integration for reuse of adaptive timesteps.
+
+    key_params: Name of the integration function, followed by its parameters.
+    """
+    # The options that change the steps or how they are taken are included,
+    # since the schedule is chosen for them.
+    key = [initial_t, T, adaptive_tolerance, timescale_factor, use_old_timestep,
+           old_timescale_factor, use_delj_trick, use_fitted_fluxes, time_scheme,
+           use_single_precision, single_precision_refinement]
+    times = numpy.linspace(initial_t, T, 5)
+    for param in key_params:
+        if callable(param):
+            key.append(tuple(param(t) for t in times))
+        else:
+            key.append(param)
+    return tuple(key)
+
+def _integrate_steps(step, phi, xx, initial_t, T, dt_func, key_params,
+                     epoch=None, take_steps=None, params_at=None,
+                     steady_state=None):
+    """
+    Integrate phi, defined on the grid xx in each dimension (or on the
+    sequence of grids xx), from initial_t to T.
+
+    step: step(phi, t, dt) returns phi advanced by a single step from t to
+          t+dt. It may modify the phi passed in.
+    dt_func: dt_func(t) returns the standard timestep at time t.
+    key_params: Name of the integration function, followed by its parameters,
+                used to cache the timesteps chosen by adaptive stepping.
+    epoch: If not None, epoch(phi, t, dt, num_steps) returns phi advanced by
+           num_steps steps of length dt from t, as repeated calls to step
+           would. It is used for each run of steps of equal length.
+    take_steps: If not None, take_steps(phi, steps) returns phi advanced
+                through the list of (t, dt) steps. It is used instead of
+                step and epoch when the steps are known in advance.
+    params_at: If not None, params_at(t) returns the population sizes and the
+               other parameters at time t, as passed to _check_params. They
+               are checked as each step is planned, since a population size
+               that falls to zero otherwise makes the steps shrink without
+               end.
+    steady_state: If not None, steady_state() returns the stationary phi for
+                  these parameters. See equilibrium_shortcut.
+    """
+    _integration_state.equilibrium = None
+    if take_steps is None:
+        take_steps = lambda phi, steps: _take_steps(step, epoch, phi, steps)
+    if equilibrium_shortcut is not None\
+       and not any(callable(param) for param in key_params):
+        all_steps = take_steps
+        take_steps = lambda phi, steps: _equilibrate_steps(all_steps, phi, xx,
+                                                           steps, steady_state)
+    steps = []
+    current_t = initial_t
+    if not use_adaptive_timesteps:
+        while current_t < T:
+            if params_at is not None:
+                _check_params(T, *params_at(current_t))
+            this_dt = min(dt_func(current_t), T - current_t)
+            _check_advance(current_t, this_dt)
+            steps.append((current_t, this_dt))
+            current_t += this_dt
+        phi = _checkpointed_steps(take_steps, phi, xx, steps, key_params)
+        _finish_integration(steps)
+        return phi
+
+    key = _schedule_key(key_params, initial_t, T)
+    with _adaptive_lock:
+        cached = _adaptive_schedules.get(key)
+    if cached is not None:
+        steps = cached
+        phi = _checkpointed_steps(take_steps, phi, xx, steps, key_params)
+        _finish_integration(steps)
+        return phi
+    initial_phi = phi
+
+    # Step sizes are powers of two times the standard timestep, so only a few
+    # different step sizes are ever used.
+    level = 0
+    # The error is measured by the integral of the difference between the
+    # two estimates, using the trapezoid rule.
+    weights = _error_weights(xx, phi.ndim)
+    while current_t < T:
+        if params_at is not None:
+            _check_params(T, *params_at(current_t))
+        min_dt = dt_func(current_t)
+        this_dt = min(min_dt * 2**level, T - current_t)
+        full = step(phi.copy(), current_t, this_dt)
+        half = step(phi.copy(), current_t, this_dt/2)
+        half = step(half, current_t + this_dt/2, this_dt/2)
+        error = (weights*numpy.abs(half - full)).sum()\
+                / ((weights*numpy.abs(half)).sum() or 1)
+
+        if error > adaptive_tolerance and this_dt > min_dt:
+            level = max(level - 1, 0)
+            continue
+        _check_advance(current_t, this_dt)
+        # We keep the full step, so that reusing these timesteps costs no
+        # more than the standard method.
+        phi = full
+        steps.append((current_t, this_dt))
+        current_t += this_dt
+        # The error of each step grows as dt**2, so doubling dt increases it
+        # roughly 4-fold.
+        if error < adaptive_tolerance/8:
+            level += 1
+
+    with _adaptive_lock:
+        _adaptive_schedules[key] = steps
+        while len(_adaptive_schedules) > adaptive_cache_size:
+            _adaptive_schedules.popitem(last=False)
+    if checkpoint_cache_bytes > 0:
+        _store_checkpoint(_checkpoint_key(key_params, initial_phi, xx, steps),
+                          phi)
+    _finish_integration(steps)
+    return phi
+
+def _steps_taken(steps):
+    """
+    The (t, dt) steps actually taken, if the integration in progress in this
+    thread stopped early at equilibrium.
+    """
+    end = _integration_state.equilibrium
+    if end is None:
+        return steps
+    return [(t, dt) for t, dt in steps if t < end]
+
+def _finish_integration(steps):
+    """
+    Record which of the planned (t, dt) steps were taken, and when the
+    integration reached equilibrium, in last_timesteps and last_equilibrium.
+    """
+    global last_timesteps, last_equilibrium
+    with _last_lock:
+        last_timesteps = _steps_taken(steps)
+        last_equilibrium = _integration_state.equilibrium
+
+def _take_steps(step, epoch, phi, steps):
+    """
+    Advance phi through the (t, dt) steps, using epoch for runs of steps of
+    equal length. See _integrate_steps.
+    """
+    ii = 0
+    while ii < len(steps):
+        t, this_dt = steps[ii]
+        num_steps = 1
+        if epoch is not None:
+            while ii + num_steps < len(steps)\
+                  and steps[ii + num_steps][1] == this_dt:
+                num_steps += 1
+        if num_steps > 1:
+            phi = epoch(phi, t, this_dt, num_steps)
+        else:
+            phi = step(phi, t, this_dt)
+        ii += num_steps
+    return phi
+
+def _mutation_sources(inject, ndim, dt, *args):
+    """
+    The amounts of new mutations injected by inject(phi, dt, *args) along each
+    axis, for passing to the C integration drivers.
+
+    dt and the arguments may also be arrays of values for successive steps,
+    in which case arrays of amounts are returned.
+    """
+    # inject only adds to the cells next to the origin, so we can read off
+    # the amounts by injecting into a small array of zeros. An extra last
+    # axis holds the amounts for successive steps.
+    phi = inject(numpy.zeros([3]*ndim + list(numpy.shape(dt))), dt, *args)
+    return [phi[tuple(numpy.identity(ndim, int)[ii])] for ii in range(ndim)]
+
+def _values_at(func, times):
+    """
+    Array of the values of the function of time func at the array of times.
+
+    func is called once with the whole array, if it accepts that, and
+    otherwise at each time in turn.
+    """
+    try:
+        values = numpy.asarray(func(times), dtype=float)
+    except (TypeError, ValueError):
+        values = None
+    if values is None or values.shape not in [(), times.shape]:
+        values = numpy.array([func(t) for t in times], dtype=float)
+    result = numpy.empty(times.shape)
+    result[...] = values
+    return result
+
+def _step_values(funcs, steps):
+    """
+    The lengths of the (t, dt) steps, and the values of funcs for each step.
+
+    Because the integration is implicit, each step uses the parameter values
+    at its end.
+    """
+    dts = numpy.array([this_dt for t, this_dt in steps])
+    next_ts = numpy.array([t + this_dt for t, this_dt in steps])
+    return dts, [_values_at(func, next_ts) for func in funcs]
+
+def _check_advance(current_t, this_dt):
+    """
+    Raise a ValueError if a step of length this_dt doesn't advance current_t.
+    """
+    if not current_t + this_dt > current_t:
+        raise ValueError('Timestep %g at time %f does not advance the '
+                         'integration. Has the model been mis-specified?'
+                         % (this_dt, current_t))
+
+def _check_params(T, nus, others):
+    """
+    Raise a ValueError if the parameters of an integration are invalid.
+
+    nus: Population sizes, each a value or an array of values over time
+    others: Migration rates and theta0, likewise
+    """
+    nus = numpy.concatenate([numpy.ravel(nu) for nu in nus])
+    others = numpy.concatenate([numpy.ravel(val) for val in others])
+    if T < 0 or numpy.any(numpy.less(nus, 0))\
+       or numpy.any(numpy.less(others, 0)):
+        raise ValueError('A time, population size, migration rate, or '
+                         'theta0 is < 0. Has the model been mis-specified?')
+    if numpy.any(numpy.equal(nus, 0)):
+        raise ValueError('A population size is 0. Has the model been '
+                         'mis-specified?')
+
+def _constant_runs(keys):
+    """
+    (start, end) ranges of the runs of steps over which all the arrays of
+    per-step values in keys are constant.
+    """
+    keys = numpy.array(keys)
+    changes = numpy.any(keys[:,1:] != keys[:,:-1], axis=0)
+    bounds = [0] + list(numpy.flatnonzero(changes) + 1) + [keys.shape[1]]
+    return zip(bounds[:-1], bounds[1:])
+
+def _cached_factors(cache, this_dt, factor):
+    """
+    Return factor(this_dt), reusing the results cached in the list cache.
+
+    The factors for the two most recently used timesteps are kept, which
+    covers both the final shorter step of fixed stepping and the step
+    doubling of adaptive stepping.
+    """
+    for ii, (cached_dt, factors) in enumerate(cache):
+        if cached_dt == this_dt:
+            cache.append(cache.pop(ii))
+            return factors
+    factors = factor(this_dt)
+    cache[:] = cache[-1:] + [(this_dt, factors)]
+    return factors
+
+def _cached_split(cache, key, build):
+    """
+    Return build(*key), reusing the result cached in the list cache if key
+    is unchanged since the last call.
+    """
+    if not cache or cache[0] != key:
+        cache[:] = [key, build(*key)]
+    return cache[1]
+
+def _coefficient_arrays(name, shape, single):
+    """
+    Three zeroed arrays in which to build the coefficients for the sweeps
+    along one axis.
+
+    For single-precision integrations these are temporary, and only their
+    single-precision copies from _single_precision are kept.
+    """
+    if single:
+        return [numpy.zeros(shape) for ii in range(3)]
+    return _work_arrays(name, shape, 3, zero=True)
+
+def _single_precision(name, *arrays):
+    """
+    Single-precision copies of the arrays, from this thread's workspace.
+    """
+    copies = _work_arrays(name, arrays[0].shape, len(arrays),
+                          dtype=numpy.float32)
+    for copy, arr in zip(copies, arrays):
+        copy[...] = arr
+    return copies
+
 def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0, 
             frozen=False, beta=1):
     """
@@ -176,36 +889,33 @@ def one_pop(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
     theta0_f = Misc.ensure_1arg_func(theta0)
     beta_f = Misc.ensure_1arg_func(beta)
 
-    current_t = initial_t
-    nu, gamma, h = nu_f(current_t), gamma_f(current_t), h_f(current_t)
-    beta = beta_f(current_t)
     dx = numpy.diff(xx)
-    while current_t < T:
-        dt = _compute_dt(dx,nu,[0],gamma,h)
-        this_dt = min(dt, T - current_t)
+    def dt_func(t):
+        return _compute_dt(dx,nu_f(t),[0],gamma_f(t),h_f(t))
 
+    # The parameters for all the steps are evaluated at once, and the steps
+    # are then all taken in C.
+    def take_steps(phi, steps):
         # Because this is an implicit method, I need the *next* time's params.
         # So there's a little inconsistency here, in that I'm estimating dt
         # using the last timepoints nu,gamma,h.
-        next_t = current_t + this_dt
-        nu, gamma, h = nu_f(next_t), gamma_f(next_t), h_f(next_t)
-        beta = beta_f(next_t)
-        theta0 = theta0_f(next_t)
-
-        if numpy.any(numpy.less([T,nu,theta0], 0)):
-            raise ValueError('A time, population size, migration rate, or '
-                             'theta0 is < 0. Has the model been mis-specified?')
-        if numpy.any(numpy.equal([nu], 0)):
-            raise ValueError('A population size is 0. Has the model been '
-                             'mis-specified?')
-
-        _inject_mutations_1D(phi, this_dt, xx, theta0)
-        # Do each step in C, since it will be faster to compute the a,b,c
-        # matrices there.
-        phi = int_c.implicit_1Dx(phi, xx, nu, gamma, h, beta, this_dt, 
-                                 use_delj_trick=use_delj_trick)
-        current_t = next_t
-    return phi
+        dts, (nu, gamma, h, beta, theta0)\
+                = _step_values((nu_f, gamma_f, h_f, beta_f, theta0_f), steps)
+        _check_params(T, [nu], [theta0])
+        inject, = _mutation_sources(_inject_mutations_1D, 1, dts, xx, theta0)
+        # The a,b,c matrices are computed in C, since that is faster.
+        return int_c.integrate_1D(phi, xx, nu, gamma, h, beta, inject, dts,
+                                  _flux_mode())
+
+    def step(phi, current_t, this_dt):
+        return take_steps(phi, [(current_t, this_dt)])
+
+    def params_at(t):
+        return [nu_f(t)], [theta0_f(t)]
+
+    return _integrate_steps(step, phi, xx, initial_t, T, dt_func,
+                            ('one_pop', nu_f, gamma_f, h_f, theta0_f, beta_f),
+                            take_steps=take_steps, params_at=params_at)
 
 def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
              h1=0.5, h2=0.5, theta0=1, initial_t=0, frozen1=False, 
@@ -214,8 +924,8 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
     Integrate a 2-dimensional phi foward.
 
     phi: Initial 2-dimensional phi
-    xx: 1-dimensional grid upon (0,1) overwhich phi is defined. It is assumed
-        that this grid is used in all dimensions.
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids, one for each population.
 
     nu's, gamma's, m's, and theta0 may be functions of time.
     nu1,nu2: Population sizes
@@ -227,10 +937,6 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
     T: Time at which to halt integration
     initial_t: Time at which to start integration. (Note that this only matters
                if one of the demographic parameters is a function of time.)
-
-    Note: Generalizing to different grids in different phi directions is
-          straightforward. The tricky part will be later doing the extrapolation
-          correctly.
     """
     phi = phi.copy()
 
@@ -250,7 +956,7 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
         return _two_pops_const_params(phi, xx, T, nu1, nu2, m12, m21, 
                                       gamma1, gamma2, h1, h2, theta0, initial_t,
                                       frozen1, frozen2)
-    yy = xx
+    xx, yy = Numerics.expand_grids(xx, 2)
 
     nu1_f = Misc.ensure_1arg_func(nu1)
     nu2_f = Misc.ensure_1arg_func(nu2)
@@ -262,42 +968,93 @@ def two_pops(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0, gamma2=0,
     h2_f = Misc.ensure_1arg_func(h2)
     theta0_f = Misc.ensure_1arg_func(theta0)
 
-    current_t = initial_t
-    nu1,nu2 = nu1_f(current_t), nu2_f(current_t)
-    m12,m21 = m12_f(current_t), m21_f(current_t)
-    gamma1,gamma2 = gamma1_f(current_t), gamma2_f(current_t)
-    h1,h2 = h1_f(current_t), h2_f(current_t)
     dx,dy = numpy.diff(xx),numpy.diff(yy)
-    while current_t < T:
-        dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
-                 _compute_dt(dy,nu2,[m21],gamma2,h2))
-        this_dt = min(dt, T - current_t)
+    def dt_func(t):
+        return min(_compute_dt(dx,nu1_f(t),[m12_f(t)],gamma1_f(t),h1_f(t)),
+                   _compute_dt(dy,nu2_f(t),[m21_f(t)],gamma2_f(t),h2_f(t)))
+
+    # The coefficients from selection and migration are only rebuilt when
+    # those parameters change. The y coefficients are built transposed, with
+    # shape (len(yy),len(xx)).
+    xInt, yInt = (xx[:-1]+xx[1:])/2, (yy[:-1]+yy[1:])/2
+    def build_x(m12, gamma1, h1):
+        return _split_abc(xx, _Mfunc2D(xInt[:,nuax], yy[nuax,:],
+                                       m12, gamma1, h1),
+                          _Mfunc2D(xx[0], yy[0], m12, gamma1, h1),
+                          _Mfunc2D(xx[-1], yy[-1], m12, gamma1, h1))
+    def build_y(m21, gamma2, h2):
+        return _split_abc(yy, _Mfunc2D(yInt[:,nuax], xx[nuax,:],
+                                       m21, gamma2, h2),
+                          _Mfunc2D(yy[0], xx[0], m21, gamma2, h2),
+                          _Mfunc2D(yy[-1], xx[-1], m21, gamma2, h2))
+    split_x, split_y = [], []
+
+    # The parameters for all the steps are evaluated at once. Each run of
+    # steps over which the coefficients from selection and migration are
+    # constant is then taken in C, unless the sweeps are split among threads.
+    funcs = (nu1_f, nu2_f, m12_f, m21_f, gamma1_f, gamma2_f, h1_f, h2_f,
+             theta0_f)
+    def take_steps(phi, steps):
+        dts, (nu1, nu2, m12, m21, gamma1, gamma2, h1, h2, theta0)\
+                = _step_values(funcs, steps)
+        _check_params(T, [nu1, nu2], [m12, m21, theta0])
+        inject1, inject2 = _mutation_sources(_inject_mutations_2D, 2, dts,
+                                             xx, yy, theta0, frozen1, frozen2)
+
+        if not (_flux_mode() or num_threads > 1):
+            work, = _work_arrays(int_c.integrate_split_2D,
+                                 (2*len(xx)*len(yy) + len(xx),))
+            for start, end in _constant_runs([m12, gamma1, h1,
+                                              m21, gamma2, h2]):
+                Mx, Vx = _cached_split(split_x, (m12[start], gamma1[start],
+                                                 h1[start]), build_x)
+                My, Vy = _cached_split(split_y, (m21[start], gamma2[start],
+                                                 h2[start]), build_y)
+                run = slice(start, end)
+                phi = int_c.integrate_split_2D(phi, *(Mx + Vx + My + Vy +
+                          (1./nu1[run], 1./nu2[run], inject1[run],
+                           inject2[run], dts[run], frozen1, frozen2, work)))
+            return phi
+
+        for ii, this_dt in enumerate(dts):
+            phi[1,0] += inject1[ii]
+            phi[0,1] += inject2[ii]
+            if _flux_mode():
+                # delj depends on nu, so the coefficients can't be split.
+                if not frozen1: 
+                    phi = _sweep(int_c.implicit_2Dx, phi, len(yy), xx, yy,
+                                 nu1[ii], m12[ii], gamma1[ii], h1[ii],
+                                 this_dt, _flux_mode())
+                if not frozen2: 
+                    phi = _sweep(int_c.implicit_2Dy, phi, len(xx), xx, yy,
+                                 nu2[ii], m21[ii], gamma2[ii], h2[ii],
+                                 this_dt, _flux_mode())
+                continue
+
+            if not frozen1:
+                M_abc, V_abc = _cached_split(split_x, (m12[ii], gamma1[ii],
+                                                       h1[ii]), build_x)
+                phi = _sweep(int_c.implicit_split_2Dx, phi, len(yy), 
+                             *(M_abc + V_abc + (1./nu1[ii], this_dt)),
+                             work_size=len(xx)*len(yy) + len(yy))
+            if not frozen2:
+                M_abc, V_abc = _cached_split(split_y, (m21[ii], gamma2[ii],
+                                                       h2[ii]), build_y)
+                phi = _sweep(int_c.implicit_split_2Dy_transposed, phi, 
+                             len(xx), *(M_abc + V_abc + (1./nu2[ii], this_dt)),
+                             work_size=2*len(xx)*len(yy) + len(xx))
+        return phi
 
-        next_t = current_t + this_dt
-
-        nu1,nu2 = nu1_f(next_t), nu2_f(next_t)
-        m12,m21 = m12_f(next_t), m21_f(next_t)
-        gamma1,gamma2 = gamma1_f(next_t), gamma2_f(next_t)
-        h1,h2 = h1_f(next_t), h2_f(next_t)
-        theta0 = theta0_f(next_t)
-
-        if numpy.any(numpy.less([T,nu1,nu2,m12,m21,theta0], 0)):
-            raise ValueError('A time, population size, migration rate, or '
-                             'theta0 is < 0. Has the model been mis-specified?')
-        if numpy.any(numpy.equal([nu1,nu2], 0)):
-            raise ValueError('A population size is 0. Has the model been '
-                             'mis-specified?')
-
-        _inject_mutations_2D(phi, this_dt, xx, yy, theta0, frozen1, frozen2)
-        if not frozen1: 
-            phi = int_c.implicit_2Dx(phi, xx, yy, nu1, m12, gamma1, h1,
-                                     this_dt, use_delj_trick)
-        if not frozen2: 
-            phi = int_c.implicit_2Dy(phi, xx, yy, nu2, m21, gamma2, h2,
-                                     this_dt, use_delj_trick)
-
-        current_t = next_t
-    return phi
+    def step(phi, current_t, this_dt):
+        return take_steps(phi, [(current_t, this_dt)])
+
+    def params_at(t):
+        return [nu1_f(t), nu2_f(t)], [m12_f(t), m21_f(t), theta0_f(t)]
+
+    return _integrate_steps(step, phi, [xx, yy], initial_t, T, dt_func,
+                            ('two_pops', nu1_f, nu2_f, m12_f, m21_f, gamma1_f,
+                             gamma2_f, h1_f, h2_f, theta0_f, frozen1, frozen2),
+                            take_steps=take_steps, params_at=params_at)
 
 def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
                m12=0, m13=0, m21=0, m23=0, m31=0, m32=0,
@@ -308,8 +1065,8 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
     Integrate a 3-dimensional phi foward.
 
     phi: Initial 3-dimensional phi
-    xx: 1-dimensional grid upon (0,1) overwhich phi is defined. It is assumed
-        that this grid is used in all dimensions.
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids, one for each population.
 
     nu's, gamma's, m's, and theta0 may be functions of time.
     nu1,nu2,nu3: Population sizes
@@ -322,10 +1079,6 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
     T: Time at which to halt integration
     initial_t: Time at which to start integration. (Note that this only matters
                if one of the demographic parameters is a function of time.)
-
-    Note: Generalizing to different grids in different phi directions is
-          straightforward. The tricky part will be later doing the extrapolation
-          correctly.
     """
     phi = phi.copy()
 
@@ -351,7 +1104,7 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
                                         gamma1, gamma2, gamma3, h1, h2, h3,
                                         theta0, initial_t,
                                         frozen1, frozen2, frozen3)
-    zz = yy = xx
+    xx, yy, zz = Numerics.expand_grids(xx, 3)
 
     nu1_f = Misc.ensure_1arg_func(nu1)
     nu2_f = Misc.ensure_1arg_func(nu2)
@@ -370,59 +1123,594 @@ def three_pops(phi, xx, T, nu1=1, nu2=1, nu3=1,
     h3_f = Misc.ensure_1arg_func(h3)
     theta0_f = Misc.ensure_1arg_func(theta0)
 
-    current_t = initial_t
-    nu1,nu2,nu3 = nu1_f(current_t), nu2_f(current_t), nu3_f(current_t)
-    m12,m13 = m12_f(current_t), m13_f(current_t)
-    m21,m23 = m21_f(current_t), m23_f(current_t)
-    m31,m32 = m31_f(current_t), m32_f(current_t)
-    gamma1,gamma2 = gamma1_f(current_t), gamma2_f(current_t)
-    gamma3 = gamma3_f(current_t)
-    h1,h2,h3 = h1_f(current_t), h2_f(current_t), h3_f(current_t)
     dx,dy,dz = numpy.diff(xx),numpy.diff(yy),numpy.diff(zz)
-    dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
-             _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
-             _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
-    steps = 0
+    def dt_func(t):
+        return min(_compute_dt(dx,nu1_f(t),[m12_f(t),m13_f(t)],gamma1_f(t),
+                               h1_f(t)),
+                   _compute_dt(dy,nu2_f(t),[m21_f(t),m23_f(t)],gamma2_f(t),
+                               h2_f(t)),
+                   _compute_dt(dz,nu3_f(t),[m31_f(t),m32_f(t)],gamma3_f(t),
+                               h3_f(t)))
+
+    # As in two_pops, the coefficients from selection and migration are only
+    # rebuilt when those parameters change. They are built with the sweep
+    # axis first, then transposed to the (L,M,N) layout for y and the
+    # (L,N,M) layout for z.
+    xInt, yInt, zInt = [(arr[:-1]+arr[1:])/2 for arr in (xx,yy,zz)]
+    def build_x(m12, m13, gamma1, h1):
+        return _split_abc(xx, _Mfunc3D(xInt[:,nuax,nuax], yy[nuax,:,nuax],
+                                       zz[nuax,nuax,:], m12, m13, gamma1, h1),
+                          _Mfunc3D(xx[0], yy[0], zz[0], m12, m13, gamma1, h1),
+                          _Mfunc3D(xx[-1], yy[-1], zz[-1], m12, m13, gamma1,
+                                   h1))
+    def build_y(m21, m23, gamma2, h2):
+        M_abc, V_abc = _split_abc(yy, _Mfunc3D(yInt[:,nuax,nuax],
+                                               xx[nuax,:,nuax], zz[nuax,nuax,:],
+                                               m21, m23, gamma2, h2),
+                                  _Mfunc3D(yy[0], xx[0], zz[0], m21, m23,
+                                           gamma2, h2),
+                                  _Mfunc3D(yy[-1], xx[-1], zz[-1], m21, m23,
+                                           gamma2, h2))
+        M_abc = tuple(numpy.ascontiguousarray(arr.transpose(1,0,2))
+                      for arr in M_abc)
+        return M_abc, V_abc
+    def build_z(m31, m32, gamma3, h3):
+        M_abc, V_abc = _split_abc(zz, _Mfunc3D(zInt[:,nuax,nuax],
+                                               xx[nuax,:,nuax], yy[nuax,nuax,:],
+                                               m31, m32, gamma3, h3),
+                                  _Mfunc3D(zz[0], xx[0], yy[0], m31, m32,
+                                           gamma3, h3),
+                                  _Mfunc3D(zz[-1], xx[-1], yy[-1], m31, m32,
+                                           gamma3, h3))
+        M_abc = tuple(numpy.ascontiguousarray(arr.transpose(1,0,2))
+                      for arr in M_abc)
+        return M_abc, V_abc
+    split_x, split_y, split_z = [], [], []
+
+    # As in two_pops, the parameters for all the steps are evaluated at once,
+    # and runs of steps are taken in C.
+    funcs = (nu1_f, nu2_f, nu3_f, m12_f, m13_f, m21_f, m23_f, m31_f, m32_f,
+             gamma1_f, gamma2_f, gamma3_f, h1_f, h2_f, h3_f, theta0_f)
+    def take_steps(phi, steps):
+        dts, (nu1, nu2, nu3, m12, m13, m21, m23, m31, m32, gamma1, gamma2,
+              gamma3, h1, h2, h3, theta0) = _step_values(funcs, steps)
+        _check_params(T, [nu1, nu2, nu3],
+                      [m12, m13, m21, m23, m31, m32, theta0])
+        inject1, inject2, inject3\
+                = _mutation_sources(_inject_mutations_3D, 3, dts, xx, yy, zz,
+                                    theta0, frozen1, frozen2, frozen3)
+
+        if not (_flux_mode() or num_threads > 1):
+            work, = _work_arrays(int_c.integrate_split_3D,
+                                 ((len(xx)+1)*len(yy)*len(zz),))
+            for start, end in _constant_runs([m12, m13, gamma1, h1,
+                                              m21, m23, gamma2, h2,
+                                              m31, m32, gamma3, h3]):
+                Mx, Vx = _cached_split(split_x, (m12[start], m13[start],
+                                                 gamma1[start], h1[start]),
+                                       build_x)
+                My, Vy = _cached_split(split_y, (m21[start], m23[start],
+                                                 gamma2[start], h2[start]),
+                                       build_y)
+                Mz, Vz = _cached_split(split_z, (m31[start], m32[start],
+                                                 gamma3[start], h3[start]),
+                                       build_z)
+                run = slice(start, end)
+                phi = int_c.integrate_split_3D(phi, 
+                          *(Mx + Vx + My + Vy + Mz + Vz +
+                            (1./nu1[run], 1./nu2[run], 1./nu3[run],
+                             inject1[run], inject2[run], inject3[run],
+                             dts[run], frozen1, frozen2, frozen3, work)))
+            return phi
+
+        for ii, this_dt in enumerate(dts):
+            phi[1,0,0] += inject1[ii]
+            phi[0,1,0] += inject2[ii]
+            phi[0,0,1] += inject3[ii]
+            if _flux_mode():
+                # As in two_pops, the coefficients can't be split.
+                if not frozen1:
+                    phi = _sweep(int_c.implicit_3Dx, phi, len(yy), xx, yy, zz,
+                                 nu1[ii], m12[ii], m13[ii], gamma1[ii], h1[ii],
+                                 this_dt, _flux_mode())
+                if not frozen2:
+                    phi = _sweep(int_c.implicit_3Dy, phi, len(xx), xx, yy, zz,
+                                 nu2[ii], m21[ii], m23[ii], gamma2[ii], h2[ii],
+                                 this_dt, _flux_mode())
+                if not frozen3:
+                    phi = _sweep(int_c.implicit_3Dz, phi, len(xx), xx, yy, zz,
+                                 nu3[ii], m31[ii], m32[ii], gamma3[ii], h3[ii],
+                                 this_dt, _flux_mode())
+                continue
+
+            if not frozen1:
+                M_abc, V_abc = _cached_split(split_x, (m12[ii], m13[ii],
+                                                       gamma1[ii], h1[ii]),
+                                             build_x)
+                phi = _sweep(int_c.implicit_split_3Dx, phi, len(yy),
+                             *(M_abc + V_abc + (1./nu1[ii], this_dt)),
+                             work_size=(len(xx)+1)*len(yy)*len(zz))
+            if not frozen2:
+                M_abc, V_abc = _cached_split(split_y, (m21[ii], m23[ii],
+                                                       gamma2[ii], h2[ii]),
+                                             build_y)
+                phi = _sweep(int_c.implicit_split_3Dy, phi, len(xx),
+                             *(M_abc + V_abc + (1./nu2[ii], this_dt)),
+                             work_size=(len(yy)+1)*len(zz))
+            if not frozen3:
+                M_abc, V_abc = _cached_split(split_z, (m31[ii], m32[ii],
+                                                       gamma3[ii], h3[ii]),
+                                             build_z)
+                phi = _sweep(int_c.implicit_split_3Dz_transposed, phi,
+                             len(xx), *(M_abc + V_abc + (1./nu3[ii], this_dt)),
+                             work_size=(2*len(zz)+1)*len(yy))
+        return phi
+
+    def step(phi, current_t, this_dt):
+        return take_steps(phi, [(current_t, this_dt)])
+
+    def params_at(t):
+        return ([nu1_f(t), nu2_f(t), nu3_f(t)],
+                [m12_f(t), m13_f(t), m21_f(t), m23_f(t), m31_f(t), m32_f(t),
+                 theta0_f(t)])
+
+    return _integrate_steps(step, phi, [xx, yy, zz], initial_t, T, dt_func,
+                            ('three_pops', nu1_f, nu2_f, nu3_f, m12_f, m13_f,
+                             m21_f, m23_f, m31_f, m32_f, gamma1_f, gamma2_f,
+                             gamma3_f, h1_f, h2_f, h3_f, theta0_f,
+                             frozen1, frozen2, frozen3),
+                            take_steps=take_steps, params_at=params_at)
+
+def four_pops(phi, xx, T, nu1=1, nu2=1, nu3=1, nu4=1,
+              m12=0, m13=0, m14=0, m21=0, m23=0, m24=0,
+              m31=0, m32=0, m34=0, m41=0, m42=0, m43=0,
+              gamma1=0, gamma2=0, gamma3=0, gamma4=0,
+              h1=0.5, h2=0.5, h3=0.5, h4=0.5, theta0=1, initial_t=0,
+              frozen1=False, frozen2=False, frozen3=False, frozen4=False):
+    """
+    Integrate a 4-dimensional phi foward.
+
+    phi: Initial 4-dimensional phi
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids, one for each population.
+
+    nu's, gamma's, m's, and theta0 may be functions of time.
+    nu1,nu2,nu3,nu4: Population sizes
+    gamma1,gamma2,gamma3,gamma4: Selection coefficients on *all* segregating
+                                 alleles
+    h1,h2,h3,h4: Dominance coefficients. h = 0.5 corresponds to genic
+                 selection.
+    m12,m13,m14,m21,m23,m24,m31,m32,m34,m41,m42,m43: Migration rates. Note 
+                             that m12 is the rate *into 1 from 2*.
+    theta0: Propotional to ancestral size. Typically constant.
+    frozen1,...,frozen4: If True, the population is 'frozen' so that it does
+                         not change. Frozen populations are left out of the
+                         boundary conditions at the corners of phi, so one
+                         split off from another leaves the distribution of the
+                         others as it would be without it.
+
+    T: Time at which to halt integration
+    initial_t: Time at which to start integration. (Note that this only matters
+               if one of the demographic parameters is a function of time.)
+
+    The coefficients for each line of phi are computed as it is solved, so
+    beyond phi itself little memory is used. The integration always uses
+    implicit Euler steps in double precision.
+    """
+    ms = [[0, m12, m13, m14],
+          [m21, 0, m23, m24],
+          [m31, m32, 0, m34],
+          [m41, m42, m43, 0]]
+    return _many_pops(phi, xx, T, [nu1, nu2, nu3, nu4], ms,
+                      [gamma1, gamma2, gamma3, gamma4], [h1, h2, h3, h4],
+                      theta0, initial_t, [frozen1, frozen2, frozen3, frozen4],
+                      'four_pops')
+
+def five_pops(phi, xx, T, nu1=1, nu2=1, nu3=1, nu4=1, nu5=1,
+              m12=0, m13=0, m14=0, m15=0, m21=0, m23=0, m24=0, m25=0,
+              m31=0, m32=0, m34=0, m35=0, m41=0, m42=0, m43=0, m45=0,
+              m51=0, m52=0, m53=0, m54=0,
+              gamma1=0, gamma2=0, gamma3=0, gamma4=0, gamma5=0,
+              h1=0.5, h2=0.5, h3=0.5, h4=0.5, h5=0.5, theta0=1, initial_t=0,
+              frozen1=False, frozen2=False, frozen3=False, frozen4=False,
+              frozen5=False):
+    """
+    Integrate a 5-dimensional phi foward.
+
+    phi: Initial 5-dimensional phi
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids, one for each population.
+
+    nu's, gamma's, m's, and theta0 may be functions of time.
+    nu1,nu2,nu3,nu4,nu5: Population sizes
+    gamma1,gamma2,gamma3,gamma4,gamma5: Selection coefficients on *all* 
+                                        segregating alleles
+    h1,h2,h3,h4,h5: Dominance coefficients. h = 0.5 corresponds to genic
+                    selection.
+    m12,m13,...,m54: Migration rates. Note that m12 is the rate 
+                     *into 1 from 2*.
+    theta0: Propotional to ancestral size. Typically constant.
+    frozen1,...,frozen5: If True, the population is 'frozen' so that it does
+                         not change. Frozen populations are left out of the
+                         boundary conditions at the corners of phi, so one
+                         split off from another leaves the distribution of the
+                         others as it would be without it.
+
+    T: Time at which to halt integration
+    initial_t: Time at which to start integration. (Note that this only matters
+               if one of the demographic parameters is a function of time.)
+
+    As in four_pops, the coefficients for each line of phi are computed as
+    it is solved.
+    """
+    ms = [[0, m12, m13, m14, m15],
+          [m21, 0, m23, m24, m25],
+          [m31, m32, 0, m34, m35],
+          [m41, m42, m43, 0, m45],
+          [m51, m52, m53, m54, 0]]
+    return _many_pops(phi, xx, T, [nu1, nu2, nu3, nu4, nu5], ms,
+                      [gamma1, gamma2, gamma3, gamma4, gamma5],
+                      [h1, h2, h3, h4, h5], theta0, initial_t,
+                      [frozen1, frozen2, frozen3, frozen4, frozen5],
+                      'five_pops')
+
+def _inject_mutations_ND(phi, dt, xxs, theta0, frozens):
+    """
+    Inject novel mutations for a timestep, into phi of any dimension.
+
+    xxs: The grid for each population.
+    """
+    ndim = len(frozens)
+    # As in _inject_mutations_3D, normalized by the multi-dimensional
+    # trapezoid rule.
+    for ii, frozen in enumerate(frozens):
+        if not frozen:
+            xx = xxs[ii]
+            others = numpy.prod([yy[1] for jj, yy in enumerate(xxs)
+                                 if jj != ii])
+            phi[tuple(numpy.identity(ndim, int)[ii])] += \
+                    dt/xx[1] * theta0/2 * 2**ndim/((xx[2] - xx[0]) * others)
+    return phi
+
+def _many_pops(phi, xx, T, nus, ms, gammas, hs, theta0, initial_t, frozens,
+               name):
+    """
+    Integrate phi with one axis for each population, for four_pops and
+    five_pops.
+
+    nus, gammas, hs, frozens: Lists with an entry for each population
+    ms: Nested lists of migration rates, with ms[ii][jj] the rate into
+        population ii from population jj. The diagonal is ignored.
+    name: Name of the calling function, used to cache adaptive timesteps.
+    """
+    ndim = len(nus)
+    phi = phi.copy()
+
+    if T - initial_t == 0:
+        return phi
+    elif T - initial_t < 0:
+        raise ValueError('Final integration time T (%f) is less than '
+                         'intial_time (%f). Integration cannot be run '
+                         'backwards.' % (T, initial_t))
+    xxs = Numerics.expand_grids(xx, ndim)
+    if phi.shape != tuple(len(grid) for grid in xxs):
+        raise ValueError('phi must be %i-dimensional, with the grid for each '
+                         'population along its axis.' % ndim)
+
+    others = [(ii, jj) for ii in range(ndim) for jj in range(ndim) if ii != jj]
+    for ii, jj in others:
+        if (frozens[ii] or frozens[jj]) and \
+           (callable(ms[ii][jj]) or ms[ii][jj] != 0):
+            raise ValueError('Population cannot be frozen and have non-zero '
+                             'migration to or from it.')
+
+    nus_f = [Misc.ensure_1arg_func(nu) for nu in nus]
+    ms_f = [Misc.ensure_1arg_func(ms[ii][jj]) for ii, jj in others]
+    gammas_f = [Misc.ensure_1arg_func(gamma) for gamma in gammas]
+    hs_f = [Misc.ensure_1arg_func(h) for h in hs]
+    theta0_f = Misc.ensure_1arg_func(theta0)
+
+    dxs = [numpy.diff(grid) for grid in xxs]
+    def dt_func(t):
+        return min(_compute_dt(dxs[ii], nus_f[ii](t),
+                               [m_f(t) for (jj, kk), m_f in zip(others, ms_f)
+                                if jj == ii],
+                               gammas_f[ii](t), hs_f[ii](t))
+                   for ii in range(ndim))
+
+    # phi is solved as a flattened array, along which the mutations along
+    # each axis are injected at these offsets.
+    origin_offsets = [numpy.prod(phi.shape[ii+1:], dtype=int)
+                      for ii in range(ndim)]
+    grids = numpy.concatenate(xxs)
+    shape_arr = numpy.array(phi.shape, numpy.int32)
+    frozen_arr = numpy.array(frozens, numpy.int32)
+    funcs = nus_f + ms_f + gammas_f + hs_f + [theta0_f]
+    def take_steps(phi, steps):
+        dts, values = _step_values(funcs, steps)
+        nus = values[:ndim]
+        m_values = values[ndim:ndim+len(others)]
+        gammas = values[ndim+len(others):2*ndim+len(others)]
+        hs = values[2*ndim+len(others):-1]
+        theta0 = values[-1]
+        _check_params(T, nus, m_values + [theta0])
+        injects = _mutation_sources(_inject_mutations_ND, ndim, dts, xxs,
+                                    theta0, frozens)
+        # rates[step,ii] holds the rates into population ii.
+        rates = numpy.zeros((len(dts), ndim, ndim))
+        for (ii, jj), m in zip(others, m_values):
+            rates[:,ii,jj] = m
+
+        shape = phi.shape
+        phi = phi.reshape(-1)
+        for step, this_dt in enumerate(dts):
+            for offset, inject in zip(origin_offsets, injects):
+                phi[offset] += inject[step]
+            for ii in range(ndim):
+                if frozens[ii]:
+                    continue
+                phi = _sweep(int_c.implicit_ND, phi, phi.size//len(xxs[ii]),
+                             grids, shape_arr, rates[step,ii], frozen_arr,
+                             nus[ii][step], gammas[ii][step], hs[ii][step],
+                             this_dt, ii, _flux_mode())
+        return phi.reshape(shape)
+
+    def step(phi, current_t, this_dt):
+        return take_steps(phi, [(current_t, this_dt)])
+
+    def params_at(t):
+        return ([nu_f(t) for nu_f in nus_f],
+                [m_f(t) for m_f in ms_f] + [theta0_f(t)])
+
+    return _integrate_steps(step, phi, xxs, initial_t, T, dt_func,
+                            tuple([name] + funcs + frozens),
+                            take_steps=take_steps, params_at=params_at)
+
+def one_pop_batch(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1.0, initial_t=0,
+                  beta=1):
+    """
+    Integrate a batch of 1-dimensional phis forward, each with its own
+    parameters.
+
+    phi: Initial phis, stacked along the first axis
+    xx: Grid upon (0,1) overwhich phi is defined.
+
+    nu, gamma, h, theta0, and beta may be sequences, with one value for each
+    member of the batch, or single values shared by all. They must be
+    constant in time. See one_pop for their meaning.
+
+    T: Time at which to halt integration
+    initial_t: Time at which to start integration.
+
+    This is meant for evaluating a model at many nearby parameter values,
+    such as for finite-difference derivatives. All the members are integrated
+    together with the smallest of their standard timesteps, using implicit
+    Euler steps, so the results agree with those of one_pop to within the
+    accuracy of the integration.
+    """
+    return _batch_pops(phi, xx, T, [nu], [[0]], [gamma], [h], theta0,
+                       initial_t, [False], beta)
+
+def two_pops_batch(phi, xx, T, nu1=1, nu2=1, m12=0, m21=0, gamma1=0,
+                   gamma2=0, h1=0.5, h2=0.5, theta0=1, initial_t=0,
+                   frozen1=False, frozen2=False):
+    """
+    Integrate a batch of 2-dimensional phis forward, each with its own
+    parameters.
+
+    phi: Initial phis, stacked along the first axis
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids for each population.
+
+    The parameters other than T, initial_t, and the frozen flags may be
+    sequences, with one value for each member of the batch, or single values
+    shared by all. They must be constant in time. See two_pops for their
+    meaning, and one_pop_batch for how the batch is integrated.
+    """
+    return _batch_pops(phi, xx, T, [nu1, nu2], [[0, m12], [m21, 0]],
+                       [gamma1, gamma2], [h1, h2], theta0, initial_t,
+                       [frozen1, frozen2])
+
+def three_pops_batch(phi, xx, T, nu1=1, nu2=1, nu3=1,
+                     m12=0, m13=0, m21=0, m23=0, m31=0, m32=0,
+                     gamma1=0, gamma2=0, gamma3=0, h1=0.5, h2=0.5, h3=0.5,
+                     theta0=1, initial_t=0, frozen1=False, frozen2=False,
+                     frozen3=False):
+    """
+    Integrate a batch of 3-dimensional phis forward, each with its own
+    parameters.
+
+    phi: Initial phis, stacked along the first axis
+    xx: 1-dimensional grid upon (0,1) overwhich phi is defined, used in all
+        dimensions, or a sequence of grids for each population.
+
+    The parameters other than T, initial_t, and the frozen flags may be
+    sequences, with one value for each member of the batch, or single values
+    shared by all. They must be constant in time. See three_pops for their
+    meaning, and one_pop_batch for how the batch is integrated.
+    """
+    return _batch_pops(phi, xx, T, [nu1, nu2, nu3],
+                       [[0, m12, m13], [m21, 0, m23], [m31, m32, 0]],
+                       [gamma1, gamma2, gamma3], [h1, h2, h3], theta0,
+                       initial_t, [frozen1, frozen2, frozen3])
+
+def _batch_pops(phi, xx, T, nus, ms, gammas, hs, theta0, initial_t, frozens,
+                beta=1):
+    """
+    Integrate a batch of phis, stacked along the first axis, for the _batch
+    functions.
+
+    nus, gammas, hs, frozens: Lists with an entry for each population
+    ms: Nested lists of migration rates, with ms[ii][jj] the rate into
+        population ii from population jj. The diagonal is ignored.
+    beta: Breeding ratio, for one population.
+
+    Internally the batch is moved to the last axis. The systems of the
+    members of the batch are then interleaved, so each sweep solves them all
+    together in the existing C methods, with the other axes merged into
+    those the methods expect.
+    """
+    ndim = len(nus)
+    if T - initial_t == 0:
+        return phi.copy()
+    elif T - initial_t < 0:
+        raise ValueError('Final integration time T (%f) is less than '
+                         'intial_time (%f). Integration cannot be run '
+                         'backwards.' % (T, initial_t))
+    xxs = Numerics.expand_grids(xx, ndim)
+    if phi.shape[1:] != tuple(len(grid) for grid in xxs):
+        raise ValueError('phi must be %i-dimensional, with the batch along '
+                         'the first axis and the grid for each population '
+                         'along the others.' % (ndim+1))
+
+    num = len(phi)
+    def batch_values(param):
+        if callable(param):
+            raise ValueError('Batched integrations require parameters that '
+                             'are constant in time.')
+        values = numpy.empty(num)
+        try:
+            values[:] = param
+        except ValueError:
+            raise ValueError('Each parameter must be a single value or have '
+                             'one value for each of the %i members of the '
+                             'batch.' % num)
+        return values
+    nus = [batch_values(nu) for nu in nus]
+    ms = [[batch_values(m) for m in row] for row in ms]
+    gammas = [batch_values(gamma) for gamma in gammas]
+    hs = [batch_values(h) for h in hs]
+    theta0, beta = batch_values(theta0), batch_values(beta)
+
+    rates = [ms[ii][jj] for ii in range(ndim) for jj in range(ndim)
+             if ii != jj]
+    if numpy.any(numpy.less(numpy.concatenate([[T]] + nus + rates + [theta0]),
+                            0)):
+        raise ValueError('A time, population size, migration rate, or theta0 '
+                         'is < 0. Has the model been mis-specified?')
+    if numpy.any(numpy.equal(nus, 0)):
+        raise ValueError('A population size is 0. Has the model been '
+                         'mis-specified?')
+    for ii in range(ndim):
+        for jj in range(ndim):
+            if ii != jj and (frozens[ii] or frozens[jj])\
+               and numpy.any(ms[ii][jj] != 0):
+                raise ValueError('Population cannot be frozen and have '
+                                 'non-zero migration to or from it.')
+
+    dt = min(_compute_dt(numpy.diff(xxs[ii]), nus[ii][kk],
+                         [ms[ii][jj][kk] for jj in range(ndim) if jj != ii],
+                         gammas[ii][kk], hs[ii][kk])
+             for ii in range(ndim) for kk in range(num))
+    coeffs = [None if frozens[ii] else
+              _batch_abc(xxs, ii, nus[ii], ms[ii], gammas[ii], hs[ii], beta)
+              for ii in range(ndim)]
+
+    # Along axis ii, the batch-last phi is viewed as an LxMxN array, with the
+    # lines to solve along its second axis. For the first axis, it is viewed
+    # as an LxM array instead, so the lines can be split among threads.
+    phi = numpy.array(numpy.rollaxis(phi, 0, ndim+1), order='C')
+    shapes = [(int(numpy.prod(phi.shape[:ii])), phi.shape[ii],
+               int(numpy.prod(phi.shape[ii+1:]))) for ii in range(ndim)]
+    def factor(this_dt):
+        factors = []
+        for ii, abc in enumerate(coeffs):
+            if abc is None:
+                factors.append(None)
+            elif ii == 0:
+                abc = [arr.reshape(shapes[0][1:]) for arr in abc]
+                factors.append(int_c.factor_precalc_2Dx(*(abc + [this_dt])))
+            else:
+                abc = [arr.reshape(shapes[ii]) for arr in abc]
+                factors.append(int_c.factor_precalc_3Dy(*(abc + [this_dt])))
+        return factors
+    factors = []
+
+    def step(phi, current_t, this_dt):
+        _inject_mutations_ND(phi, this_dt, xxs, theta0, frozens)
+        for ii, factor_ii in enumerate(_cached_factors(factors, this_dt,
+                                                       factor)):
+            if factor_ii is None:
+                continue
+            L, M, N = shapes[ii]
+            if ii == 0:
+                solve = _sweep(int_c.implicit_factored_2Dx,
+                               phi.reshape(M, N), N,
+                               coeffs[ii][0].reshape(M, N), factor_ii[0],
+                               factor_ii[1], this_dt)
+            else:
+                solve = _sweep(int_c.implicit_factored_3Dy,
+                               phi.reshape(L, M, N), L,
+                               coeffs[ii][0].reshape(L, M, N), factor_ii[0],
+                               factor_ii[1], this_dt)
+            phi = solve.reshape(phi.shape)
+        return phi
+
+    steps = []
+    current_t = initial_t
     while current_t < T:
-        dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
-                 _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
-                 _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
         this_dt = min(dt, T - current_t)
+        steps.append((current_t, this_dt))
+        current_t += this_dt
+    phi = _take_steps(step, None, phi, steps)
+    _integration_state.equilibrium = None
+    _finish_integration(steps)
+    return numpy.ascontiguousarray(numpy.rollaxis(phi, ndim))
 
-        next_t = current_t + this_dt
-        steps += 1
-
-        nu1,nu2,nu3 = nu1_f(next_t), nu2_f(next_t), nu3_f(next_t)
-        m12,m13 = m12_f(next_t), m13_f(next_t)
-        m21,m23 = m21_f(next_t), m23_f(next_t)
-        m31,m32 = m31_f(next_t), m32_f(next_t)
-        gamma1,gamma2 = gamma1_f(next_t), gamma2_f(next_t)
-        gamma3 = gamma3_f(next_t)
-        h1,h2,h3 = h1_f(next_t), h2_f(next_t), h3_f(next_t)
-        theta0 = theta0_f(next_t)
-
-        if numpy.any(numpy.less([T,nu1,nu2,nu3,m12,m13,m21,m23,m31,m32,theta0],
-                                0)):
-            raise ValueError('A time, population size, migration rate, or '
-                             'theta0 is < 0. Has the model been mis-specified?')
-        if numpy.any(numpy.equal([nu1,nu2,nu3], 0)):
-            raise ValueError('A population size is 0. Has the model been '
-                             'mis-specified?')
+def _batch_abc(xxs, axis, nu, ms, gamma, h, beta=1):
+    """
+    Tridiagonal coefficients for the sweeps along axis of a batch of phis,
+    with the batch along the last axis.
 
-        _inject_mutations_3D(phi, this_dt, xx, yy, zz, theta0,
-                             frozen1, frozen2, frozen3)
-        if not frozen1:
-            phi = int_c.implicit_3Dx(phi, xx, yy, zz, nu1, m12, m13, 
-                                     gamma1, h1, this_dt, use_delj_trick)
-        if not frozen2:
-            phi = int_c.implicit_3Dy(phi, xx, yy, zz, nu2, m21, m23, 
-                                     gamma2, h2, this_dt, use_delj_trick)
-        if not frozen3:
-            phi = int_c.implicit_3Dz(phi, xx, yy, zz, nu3, m31, m32, 
-                                     gamma3, h3, this_dt, use_delj_trick)
+    xxs: The grid for each population.
+    nu, gamma, h: Arrays of the parameters of the population along axis, with
+                  one value for each member of the batch.
+    ms: Arrays of the migration rates into that population from each
+        population. The entry for axis itself is ignored.
 
-        current_t = next_t
-    return phi
+    Returns a, b, c, with the shape of the batch-last phi.
+    """
+    ndim = len(xxs)
+    others = [dd for dd in range(ndim) if dd != axis]
+    # The coefficients are computed with axis first, and the others in order,
+    # so that the parameters broadcast along the last axis.
+    def along(arr, pos):
+        shape = [1]*(ndim+1)
+        shape[pos] = len(arr)
+        return numpy.reshape(arr, shape)
+
+    xx = xxs[axis]
+    x, xInt = along(xx, 0), along((xx[:-1] + xx[1:])/2, 0)
+    mtot = sum(ms[dd] for dd in others)
+    # The migration term is sum_j m_j*(x_j - x).
+    mig = sum(ms[dd]*along(xxs[dd], pos+1) for pos, dd in enumerate(others))
+    MInt = mig - mtot*xInt + _Mfunc1D(xInt, gamma, h)
+    V = _Vfunc(x, nu, beta)
+    VInt = _Vfunc(xInt, nu, beta)
+
+    dx = along(numpy.diff(xx), 0)
+    dfactor = along(_compute_dfactor(numpy.diff(xx)), 0)
+    MInt, delj = _flux_terms(dx, MInt, VInt, V)
+
+    shape = (len(xx),) + tuple(len(xxs[dd]) for dd in others) + (len(nu),)
+    a, b, c = [numpy.zeros(shape) for ii in range(3)]
+    a[ 1:] += dfactor[ 1:]*(-MInt*delj     - V[:-1]/(2*dx))
+    c[:-1] += dfactor[:-1]*( MInt*(1-delj) - V[ 1:]/(2*dx))
+    b[:-1] += dfactor[:-1]*( MInt*delj     + V[:-1]/(2*dx))
+    b[ 1:] += dfactor[ 1:]*(-MInt*(1-delj) + V[ 1:]/(2*dx))
+
+    # The boundary conditions at the corners, as in _two_pops_const_params.
+    Mfirst = sum(ms[dd]*(xxs[dd][0] - xx[0]) for dd in others)\
+            + _Mfunc1D(xx[0], gamma, h)
+    Mlast = sum(ms[dd]*(xxs[dd][-1] - xx[-1]) for dd in others)\
+            + _Mfunc1D(xx[-1], gamma, h)
+    b[(0,)*ndim] += numpy.where(Mfirst <= 0,
+                                (0.5/nu - Mfirst)*2/dx.flat[0], 0)
+    b[(-1,)*ndim] += numpy.where(Mlast >= 0,
+                                 -(-0.5/nu - Mlast)*2/dx.flat[-1], 0)
+
+    return [numpy.ascontiguousarray(numpy.rollaxis(arr, 0, axis+1))
+            for arr in (a, b, c)]
 
 #
 # Here are the python versions of the population genetic functions.
@@ -449,6 +1737,51 @@ def _compute_dfactor(dx):
     dfactor[-1] = 2/dx[-1]
     return dfactor
 
+def _split_abc(xx, MInt, Mfirst, Mlast):
+    """
+    Tridiagonal coefficients along the first axis, split by source.
+
+    MInt: Mfunc at the midpoints of xx, along the first axis
+    Mfirst, Mlast: Mfunc at the corners of the grid, for the boundary
+                   conditions
+
+    Returns (aM, bM, cM), (aV, bV, cV, Vfirst, Vlast). The first are the
+    coefficients from selection and migration, with the shape of phi. The
+    second are the coefficients from drift for nu = 1, which are scaled by 1/nu
+    in the integration, and the drift parts of the corner boundary conditions.
+    This assumes delj = 0.5.
+    """
+    dx = numpy.diff(xx)
+    dfactor = _compute_dfactor(dx)
+    # upslice broadcasts the 1D arrays against MInt.
+    upslice = [slice(None)] + [nuax]*(MInt.ndim - 1)
+    dfact_up = dfactor[tuple(upslice)]
+
+    shape = (len(xx),) + MInt.shape[1:]
+    aM, bM, cM = [numpy.zeros(shape) for ii in range(3)]
+    aM[ 1:] = -dfact_up[ 1:]*MInt/2
+    cM[:-1] =  dfact_up[:-1]*MInt/2
+    bM[:-1] += dfact_up[:-1]*MInt/2
+    bM[ 1:] += -dfact_up[ 1:]*MInt/2
+
+    V = _Vfunc(xx, 1)
+    aV, bV, cV = [numpy.zeros(len(xx)) for ii in range(3)]
+    aV[ 1:] = -dfactor[ 1:]*V[:-1]/(2*dx)
+    cV[:-1] = -dfactor[:-1]*V[ 1:]/(2*dx)
+    bV[:-1] += dfactor[:-1]*V[:-1]/(2*dx)
+    bV[ 1:] += dfactor[ 1:]*V[ 1:]/(2*dx)
+
+    # The corner boundary conditions, as in _two_pops_const_params.
+    Vfirst = Vlast = 0
+    if Mfirst <= 0:
+        bM.flat[0] += -Mfirst*2/dx[0]
+        Vfirst = 1./dx[0]
+    if Mlast >= 0:
+        bM.flat[-1] += Mlast*2/dx[-1]
+        Vlast = 1./dx[-1]
+
+    return (aM, bM, cM), (aV, bV, cV, Vfirst, Vlast)
+
 def _compute_delj(dx, MInt, VInt, axis=0):
     r"""
     Chang an Cooper's \delta_j term. Typically we set this to 0.5.
@@ -456,13 +1789,16 @@ def _compute_delj(dx, MInt, VInt, axis=0):
     # Chang and Cooper's fancy delta j trick...
     if use_delj_trick:
         # upslice will raise the dimensionality of dx and VInt to be appropriate
-        # for functioning with MInt.
+        # for functioning with MInt. If they already have its dimensionality,
+        # they're used as they are.
         upslice = [nuax for ii in range(MInt.ndim)]
         upslice [axis] = slice(None)
+        if dx.ndim != MInt.ndim:
+            dx, VInt = dx[upslice], VInt[upslice]
 
-        wj = 2 *MInt*dx[upslice]
-        epsj = numpy.exp(wj/VInt[upslice])
-        delj = (-epsj*wj + epsj * VInt[upslice] - VInt[upslice])/(wj - epsj*wj)
+        wj = 2 *MInt*dx
+        epsj = numpy.exp(wj/VInt)
+        delj = (-epsj*wj + epsj * VInt - VInt)/(wj - epsj*wj)
         # These where statements filter out edge case for delj
         delj = numpy.where(numpy.isnan(delj), 0.5, delj)
         delj = numpy.where(numpy.isinf(delj), 0.5, delj)
@@ -470,6 +1806,43 @@ def _compute_delj(dx, MInt, VInt, axis=0):
         delj = 0.5
     return delj
 
+def _flux_mode():
+    """
+    The flux scheme to pass to the C integrations as use_delj_trick.
+    """
+    return 2 if use_fitted_fluxes else int(use_delj_trick)
+
+def _flux_terms(dx, MInt, VInt, V, axis=0):
+    """
+    MInt and delj for building the coefficients along axis.
+
+    V: Vfunc at the grid points along axis
+
+    For fitted fluxes, MInt is rescaled so that the fluxes keep the form of
+    the central ones. See compute_delj in integration_shared.c.
+    """
+    if not use_fitted_fluxes:
+        return MInt, _compute_delj(dx, MInt, VInt, axis)
+
+    Vleft, Vright = V[:-1], V[1:]
+    if dx.ndim != MInt.ndim:
+        upslice = [nuax for ii in range(MInt.ndim)]
+        upslice[axis] = slice(None)
+        upslice = tuple(upslice)
+        dx, VInt = dx[upslice], VInt[upslice]
+        Vleft, Vright = Vleft[upslice], Vright[upslice]
+
+    # Chang and Cooper's factor, with a series near z = 0 to avoid
+    # cancellation.
+    z = 2*MInt*dx/VInt
+    small = numpy.abs(z) < 1e-3
+    zsafe = numpy.where(small, 1, z)
+    with numpy.errstate(over='ignore'):
+        delj = numpy.where(small, 0.5 + z/12. - z**3/720.,
+                           1 + 1/numpy.expm1(zsafe) - 1/zsafe)
+    left, right = delj*Vleft, (1-delj)*Vright
+    return MInt*(left + right)/VInt, left/(left + right)
+
 def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1, 
                           initial_t=0, beta=1):
     """
@@ -493,7 +1866,7 @@ def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1,
 
     dx = numpy.diff(xx)
     dfactor = _compute_dfactor(dx)
-    delj = _compute_delj(dx, MInt, VInt)
+    MInt, delj = _flux_terms(dx, MInt, VInt, V)
 
     a = numpy.zeros(phi.shape)
     a[1:] += dfactor[1:]*(-MInt * delj - V[:-1]/(2*dx))
@@ -511,15 +1884,54 @@ def _one_pop_const_params(phi, xx, T, nu=1, gamma=0, h=0.5, theta0=1,
         b[-1] += -(-0.5/nu - M[-1])*2/dx[-1]
 
     dt = _compute_dt(dx,nu,[0],gamma,h)
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-
-        _inject_mutations_1D(phi, this_dt, xx, theta0)
-        r = phi/this_dt
-        phi = tridiag.tridiag(a, b+1/this_dt, c, r)
-        current_t += this_dt
-    return phi
+    # The operator only changes with this_dt, so it is factored only when
+    # this_dt changes, such as for the final, shorter, step.
+    crank_nicolson = _crank_nicolson()
+    if not crank_nicolson:
+        factor = lambda this_dt: tridiag.tridiag_factor(a, b+1/this_dt, c)
+    else:
+        # A Crank-Nicolson step solves the systems of an implicit step of
+        # half the length.
+        factor = lambda this_dt: tridiag.tridiag_factor(a, b+2./this_dt, c)
+    factors = []
+    def step(phi, current_t, this_dt):
+        gam, ibet = _cached_factors(factors, this_dt, factor)
+        if not crank_nicolson:
+            _inject_mutations_1D(phi, this_dt, xx, theta0)
+            r = phi/this_dt
+            return tridiag.tridiag_factored(a, gam, ibet, r)
+
+        # The new mutations enter the implicit solve as a source. See
+        # _two_pops_const_params.
+        r = _explicit_half_step(phi, a, b, c, this_dt/2.)
+        _inject_mutations_1D(r, this_dt, xx, theta0)
+        return tridiag.tridiag_factored(a, gam, ibet, r/(this_dt/2.))
+
+    # Runs of implicit Euler steps are done entirely in C.
+    def epoch(phi, current_t, this_dt, num_steps):
+        gam, ibet = _cached_factors(factors, this_dt, factor)
+        inject, = _mutation_sources(_inject_mutations_1D, 1, this_dt, xx,
+                                    theta0)
+        return int_c.integrate_factored_1D(phi, a, gam, ibet, inject,
+                                           this_dt, num_steps)
+
+    # At equilibrium, the operator balances the injection of new mutations.
+    source = _inject_mutations_1D(numpy.zeros(phi.shape), 1.0, xx, theta0)
+    steady_state = lambda: tridiag.tridiag(a, b, c, source)
+
+    if time_scheme == 'expm':
+        A = _sparse_operator([(a, b, c)], phi.shape)
+        expm_step = lambda phi, current_t, this_dt:\
+                _expm_propagate(phi, A, source, this_dt, dense=True)
+        return _integrate_steps(expm_step, phi, xx, initial_t, T,
+                                lambda t: T - initial_t,
+                                ('one_pop', nu, gamma, h, theta0, beta),
+                                steady_state=steady_state)
+
+    return _integrate_steps(step, phi, xx, initial_t, T, lambda t: dt,
+                            ('one_pop', nu, gamma, h, theta0, beta),
+                            epoch if not crank_nicolson else None,
+                            steady_state=steady_state)
 
 def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
                            gamma1=0, gamma2=0, h1=0.5, h2=0.5, theta0=1, 
@@ -533,7 +1945,15 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
     if numpy.any(numpy.equal([nu1,nu2], 0)):
         raise ValueError('A population size is 0. Has the model been '
                          'mis-specified?')
-    yy = xx
+    xx, yy = Numerics.expand_grids(xx, 2)
+
+    if use_shared_operators and m12 == m21 == 0 and not _crank_nicolson()\
+       and time_scheme != 'expm':
+        return _shared_const_params(phi, [xx, yy], T, [nu1, nu2],
+                                    [gamma1, gamma2], [h1, h2], theta0,
+                                    initial_t, [frozen1, frozen2],
+                                    ('two_pops', nu1, nu2, m12, m21, gamma1,
+                                     gamma2, h1, h2, theta0, frozen1, frozen2))
 
     # The use of nuax (= numpy.newaxis) here is for memory conservation. We
     # could just create big X and Y arrays which only varied along one axis,
@@ -550,15 +1970,21 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
 
     dx = numpy.diff(xx)
     dfact_x = _compute_dfactor(dx)
-    deljx = _compute_delj(dx, MxInt, VxInt)
+    MxInt, deljx = _flux_terms(dx, MxInt, VxInt, Vx)
 
     dy = numpy.diff(yy)
     dfact_y = _compute_dfactor(dy)
-    deljy = _compute_delj(dy, MyInt, VyInt, axis=1)
+    MyInt, deljy = _flux_terms(dy, MyInt, VyInt, Vy, axis=1)
+
+    # The y coefficients are stored transposed if the y sweeps will be done
+    # transposed. ay, by, and cy are then transposed views of those arrays.
+    # Single-precision y sweeps are always transposed.
+    single = use_single_precision
+    transposed = (use_transposed_sweeps or single) and not frozen2
 
     # The nuax's here broadcast the our various arrays to have the proper shape
     # to fit into ax,bx,cx
-    ax, bx, cx = [numpy.zeros(phi.shape) for ii in range(3)]
+    ax, bx, cx = _coefficient_arrays('x', phi.shape, single)
     ax[ 1:] += dfact_x[ 1:,nuax]*(-MxInt*deljx    - Vx[:-1,nuax]/(2*dx[:,nuax]))
     cx[:-1] += dfact_x[:-1,nuax]*( MxInt*(1-deljx)- Vx[ 1:,nuax]/(2*dx[:,nuax]))
     bx[:-1] += dfact_x[:-1,nuax]*( MxInt*deljx    + Vx[:-1,nuax]/(2*dx[:,nuax]))
@@ -569,7 +1995,11 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
     if Mx[-1,-1] >= 0:
         bx[-1,-1] += -(-0.5/nu1 - Mx[-1,-1])*2/dx[-1]
 
-    ay, by, cy = [numpy.zeros(phi.shape) for ii in range(3)]
+    if transposed:
+        ay, by, cy = [arr.T for arr in _coefficient_arrays('y', phi.shape[::-1],
+                                                           single)]
+    else:
+        ay, by, cy = _coefficient_arrays('y', phi.shape, single)
     ay[:, 1:] += dfact_y[ 1:]*(-MyInt*deljy     - Vy[nuax,:-1]/(2*dy))
     cy[:,:-1] += dfact_y[:-1]*( MyInt*(1-deljy) - Vy[nuax, 1:]/(2*dy))
     by[:,:-1] += dfact_y[:-1]*( MyInt*deljy     + Vy[nuax,:-1]/(2*dy))
@@ -582,17 +2012,148 @@ def _two_pops_const_params(phi, xx, T, nu1=1,nu2=1, m12=0, m21=0,
 
     dt = min(_compute_dt(dx,nu1,[m12],gamma1,h1),
              _compute_dt(dy,nu2,[m21],gamma2,h2))
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-        _inject_mutations_2D(phi, this_dt, xx, yy, theta0, frozen1, frozen2)
+
+    if time_scheme == 'expm':
+        A = _sparse_operator([None if frozen1 else (ax, bx, cx),
+                              None if frozen2 else (ay, by, cy)], phi.shape)
+        source = _inject_mutations_2D(numpy.zeros(phi.shape), 1.0, xx, yy,
+                                      theta0, frozen1, frozen2)
+        expm_step = lambda phi, current_t, this_dt:\
+                _expm_propagate(phi, A, source, this_dt)
+        return _integrate_steps(expm_step, phi, [xx, yy], initial_t, T,
+                                lambda t: T - initial_t,
+                                ('two_pops', nu1, nu2, m12, m21, gamma1,
+                                 gamma2, h1, h2, theta0, frozen1, frozen2))
+
+    if transposed:
+        ay, by, cy = ay.T, by.T, cy.T
+        solve_y = int_c.implicit_factored_2Dy_transposed
+        work_y = phi.size
+    else:
+        solve_y = int_c.implicit_factored_2Dy
+        work_y = None
+
+    # The single-precision sweeps also take b and c, for the refinement, and
+    # their scratch space is as given in integration_c.pyf.
+    solve_x, work_x, factor_x = (int_c.implicit_factored_2Dx, None,
+                                 int_c.factor_precalc_2Dx)
+    x_coeffs, y_coeffs, refine = (ax,), (ay,), ()
+    if single:
+        phi = phi.astype(numpy.float32)
+        ax, bx, cx = _single_precision('x', ax, bx, cx)
+        ay, by, cy = _single_precision('y', ay, by, cy)
+        L, M = phi.shape
+        solve_x, work_x, factor_x = (int_c.implicit_factored_2Dx_fl, 64*L,
+                                     int_c.factor_precalc_2Dx_fl)
+        solve_y = int_c.implicit_factored_2Dy_transposed_fl
+        work_y = 64*M + (M*L+1)//2
+        x_coeffs, y_coeffs = (ax, bx, cx), (ay, by, cy)
+        refine = (single_precision_refinement,)
+
+    # For Crank-Nicolson, each sweep's explicit half step is followed by
+    # injecting that population's new mutations, so they enter the implicit
+    # solve as a source. Injecting them between sweeps instead excites
+    # oscillations in the stiff cells next to the boundaries, which
+    # Crank-Nicolson doesn't damp.
+    crank_nicolson = _crank_nicolson()
+    def sweep_x(phi, ops, inject_dt=None):
+        gamx, ibetx, sweep_dt = ops
+        if crank_nicolson:
+            phi = _explicit_half_step(phi, ax, bx, cx, sweep_dt)
+            _inject_mutations_2D(phi, inject_dt, xx, yy, theta0, False, True)
+        return _sweep(solve_x, phi, len(yy),
+                      *(x_coeffs + (gamx, ibetx, sweep_dt) + refine),
+                      work_size=work_x, dtype=phi.dtype)
+    def sweep_y(phi, ops, inject_dt=None):
+        gamy, ibety, sweep_dt = ops
+        if crank_nicolson and transposed:
+            phi = _explicit_half_step(phi.T, ay, by, cy, sweep_dt).T
+        elif crank_nicolson:
+            phi = _explicit_half_step(phi, ay, by, cy, sweep_dt, axis=1)
+        if crank_nicolson:
+            _inject_mutations_2D(phi, inject_dt, xx, yy, theta0, True, False)
+        return _sweep(solve_y, phi, len(xx),
+                      *(y_coeffs + (gamy, ibety, sweep_dt) + refine),
+                      work_size=work_y, dtype=phi.dtype)
+
+    # The operators are factored only when this_dt changes, such as for the
+    # final, shorter, step. Each step then needs only the substitution sweeps.
+    def factor(this_dt):
+        # A Crank-Nicolson sweep solves the systems of an implicit step of
+        # half its length, and the x sweeps are each half a step long.
+        if crank_nicolson:
+            dtx, dty = this_dt/4., this_dt/2.
+        else:
+            dtx, dty = this_dt, this_dt
+        gamx = ibetx = gamy = ibety = None
+        if not frozen1:
+            gamx, ibetx = factor_x(ax, bx, cx, dtx)
+        if not frozen2 and transposed:
+            # Transposed, the y lines are laid out as the x lines are.
+            gamy, ibety = factor_x(ay, by, cy, dty)
+        elif not frozen2:
+            gamy, ibety = int_c.factor_precalc_2Dy(ay, by, cy, dty)
+        return (gamx, ibetx, dtx), (gamy, ibety, dty)
+    factors = []
+
+    def step(phi, current_t, this_dt):
+        fx, fy = _cached_factors(factors, this_dt, factor)
+        if not crank_nicolson:
+            _inject_mutations_2D(phi, this_dt, xx, yy, theta0,
+                                 frozen1, frozen2)
+            if not frozen1:
+                phi = sweep_x(phi, fx)
+            if not frozen2:
+                phi = sweep_y(phi, fy)
+            return phi
+
+        # Strang splitting, with half the x evolution on either side of the
+        # y evolution.
         if not frozen1:
-            phi = int_c.implicit_precalc_2Dx(phi, ax, bx, cx, this_dt)
+            phi = sweep_x(phi, fx, this_dt/2.)
         if not frozen2:
-            phi = int_c.implicit_precalc_2Dy(phi, ay, by, cy, this_dt)
-        current_t += this_dt
+            phi = sweep_y(phi, fy, this_dt)
+        if not frozen1:
+            phi = sweep_x(phi, fx, this_dt/2.)
+        return phi
 
-    return phi
+    # Runs of implicit Euler steps are done entirely in C, unless the sweeps
+    # are split among threads. The arrays for frozen populations are unused,
+    # so ax stands in for them.
+    def epoch(phi, current_t, this_dt, num_steps):
+        (gamx, ibetx, _), (gamy, ibety, _) = _cached_factors(factors, this_dt,
+                                                             factor)
+        if frozen1:
+            gamx = ibetx = ax
+        if frozen2:
+            gamy = ibety = ax
+        inject1, inject2 = _mutation_sources(_inject_mutations_2D, 2,
+                                             this_dt, xx, yy, theta0,
+                                             frozen1, frozen2)
+        if single:
+            work, = _work_arrays(int_c.integrate_factored_2D_fl,
+                                 (64*(L+M) + (M*L+1)//2,))
+            return int_c.integrate_factored_2D_fl(phi, ax, bx, cx, gamx, ibetx,
+                                                  ay.ravel(), by.ravel(),
+                                                  cy.ravel(), gamy.ravel(),
+                                                  ibety.ravel(), inject1,
+                                                  inject2, this_dt, num_steps,
+                                                  frozen1, frozen2,
+                                                  single_precision_refinement,
+                                                  work)
+        work, = _work_arrays(int_c.integrate_factored_2D, (phi.size,))
+        return int_c.integrate_factored_2D(phi, ax, gamx, ibetx, 
+                                           ay.ravel(), gamy.ravel(),
+                                           ibety.ravel(), inject1, inject2,
+                                           this_dt, num_steps, frozen1,
+                                           frozen2, transposed, work)
+
+    phi = _integrate_steps(step, phi, [xx, yy], initial_t, T, lambda t: dt,
+                           ('two_pops', nu1, nu2, m12, m21, gamma1, gamma2,
+                            h1, h2, theta0, frozen1, frozen2),
+                           epoch if not (crank_nicolson or num_threads > 1)
+                           else None)
+    return numpy.asarray(phi, numpy.float64)
 
 def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1, 
                              m12=0, m13=0, m21=0, m23=0, m31=0, m32=0, 
@@ -608,7 +2169,27 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     if numpy.any(numpy.equal([nu1,nu2,nu3], 0)):
         raise ValueError('A population size is 0. Has the model been '
                          'mis-specified?')
-    zz = yy = xx
+    xx, yy, zz = Numerics.expand_grids(xx, 3)
+
+    if use_shared_operators and m12 == m13 == m21 == m23 == m31 == m32 == 0\
+       and not _crank_nicolson():
+        return _shared_const_params(phi, [xx, yy, zz], T, [nu1, nu2, nu3],
+                                    [gamma1, gamma2, gamma3], [h1, h2, h3],
+                                    theta0, initial_t,
+                                    [frozen1, frozen2, frozen3],
+                                    ('three_pops', nu1, nu2, nu3, m12, m13,
+                                     m21, m23, m31, m32, gamma1, gamma2,
+                                     gamma3, h1, h2, h3, theta0, frozen1,
+                                     frozen2, frozen3))
+
+    itemsize = 4 if use_single_precision else 8
+    if low_memory_threshold is not None\
+       and 15*phi.size*itemsize > low_memory_threshold:
+        return _three_pops_low_memory(phi, xx, yy, zz, T, nu1, nu2, nu3,
+                                      m12, m13, m21, m23, m31, m32,
+                                      gamma1, gamma2, gamma3, h1, h2, h3,
+                                      theta0, initial_t,
+                                      frozen1, frozen2, frozen3)
 
     Vx = _Vfunc(xx, nu1)
     VxInt = _Vfunc((xx[:-1]+xx[1:])/2, nu1)
@@ -619,9 +2200,13 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
 
     dx = numpy.diff(xx)
     dfact_x = _compute_dfactor(dx)
-    deljx = _compute_delj(dx, MxInt, VxInt)
+    MxInt, deljx = _flux_terms(dx, MxInt, VxInt, Vx)
 
-    ax, bx, cx = [numpy.zeros(phi.shape) for ii in range(3)]
+    # For single-precision integrations, each axis's coefficients are copied
+    # to single precision as soon as they are built, so that the double-
+    # precision arrays for only one axis exist at a time.
+    single = use_single_precision
+    ax, bx, cx = _coefficient_arrays('x', phi.shape, single)
     ax[ 1:] += dfact_x[ 1:,nuax,nuax]*(-MxInt*deljx    
                                        - Vx[:-1,nuax,nuax]/(2*dx[:,nuax,nuax]))
     cx[:-1] += dfact_x[:-1,nuax,nuax]*( MxInt*(1-deljx)
@@ -636,6 +2221,9 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     if Mx[-1,-1,-1] >= 0:
         bx[-1,-1,-1] += -(-0.5/nu1 - Mx[-1,-1,-1])*2/dx[-1]
 
+    if single:
+        ax, bx, cx = _single_precision('x', ax, bx, cx)
+
     # Memory consumption can be an issue in 3D, so we delete arrays after we're
     # done with them.
     del Vx,VxInt,Mx,MxInt,deljx
@@ -649,9 +2237,9 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
 
     dy = numpy.diff(yy)
     dfact_y = _compute_dfactor(dy)
-    deljy = _compute_delj(dy, MyInt, VyInt, axis=1)
+    MyInt, deljy = _flux_terms(dy, MyInt, VyInt, Vy, axis=1)
 
-    ay, by, cy = [numpy.zeros(phi.shape) for ii in range(3)]
+    ay, by, cy = _coefficient_arrays('y', phi.shape, single)
     ay[:, 1:] += dfact_y[nuax, 1:,nuax]*(-MyInt*deljy     
                                     - Vy[nuax,:-1,nuax]/(2*dy[nuax,:,nuax]))
     cy[:,:-1] += dfact_y[nuax,:-1,nuax]*( MyInt*(1-deljy) 
@@ -666,6 +2254,9 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     if My[-1,-1,-1] >= 0:
         by[-1,-1,-1] += -(-0.5/nu2 - My[-1,-1,-1])*2/dy[-1]
 
+    if single:
+        ay, by, cy = _single_precision('y', ay, by, cy)
+
     del Vy,VyInt,My,MyInt,deljy
 
     Vz = _Vfunc(zz, nu3)
@@ -677,9 +2268,17 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
 
     dz = numpy.diff(zz)
     dfact_z = _compute_dfactor(dz)
-    deljz = _compute_delj(dz, MzInt, VzInt, axis=2)
-
-    az, bz, cz = [numpy.zeros(phi.shape) for ii in range(3)]
+    MzInt, deljz = _flux_terms(dz, MzInt, VzInt, Vz, axis=2)
+
+    # As in _two_pops_const_params, the z coefficients are stored transposed
+    # if the z sweeps will be.
+    transposed = (use_transposed_sweeps or single) and not frozen3
+    L, M, N = phi.shape
+    if transposed:
+        az, bz, cz = [arr.transpose(0,2,1)
+                      for arr in _coefficient_arrays('z', (L,N,M), single)]
+    else:
+        az, bz, cz = _coefficient_arrays('z', phi.shape, single)
     az[:,:, 1:] += dfact_z[ 1:]*(-MzInt*deljz     - Vz[nuax,nuax,:-1]/(2*dz))
     cz[:,:,:-1] += dfact_z[:-1]*( MzInt*(1-deljz) - Vz[nuax,nuax, 1:]/(2*dz))
     bz[:,:,:-1] += dfact_z[:-1]*( MzInt*deljz     + Vz[nuax,nuax,:-1]/(2*dz))
@@ -693,19 +2292,302 @@ def _three_pops_const_params(phi, xx, T, nu1=1, nu2=1, nu3=1,
     dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
              _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
              _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
+    if transposed:
+        az, bz, cz = [arr.transpose(0,2,1) for arr in (az, bz, cz)]
+        solve_z = int_c.implicit_factored_3Dz_transposed
+        work_z = len(yy)*len(zz)
+    else:
+        solve_z = int_c.implicit_factored_3Dz
+        work_z = None
+
+    # As in _two_pops_const_params, the single-precision sweeps also take b
+    # and c.
+    solve_x, solve_y = int_c.implicit_factored_3Dx, int_c.implicit_factored_3Dy
+    factor_x, factor_y = int_c.factor_precalc_3Dx, int_c.factor_precalc_3Dy
+    work_x = work_y = None
+    x_coeffs, y_coeffs, z_coeffs, refine = (ax,), (ay,), (az,), ()
+    if single:
+        phi = phi.astype(numpy.float32)
+        az, bz, cz = _single_precision('z', az, bz, cz)
+        solve_x = int_c.implicit_factored_3Dx_fl
+        solve_y = int_c.implicit_factored_3Dy_fl
+        solve_z = int_c.implicit_factored_3Dz_transposed_fl
+        factor_x = int_c.factor_precalc_3Dx_fl
+        factor_y = int_c.factor_precalc_3Dy_fl
+        work_x, work_y, work_z = 64*L, 64*M, 64*N + (M*N+1)//2
+        x_coeffs, y_coeffs, z_coeffs = (ax, bx, cx), (ay, by, cy), (az, bz, cz)
+        refine = (single_precision_refinement,)
+
+    # As in _two_pops_const_params, for Crank-Nicolson the new mutations are
+    # injected within the sweeps.
+    crank_nicolson = _crank_nicolson()
+    def sweep_x(phi, ops, inject_dt=None):
+        gamx, ibetx, sweep_dt = ops
+        if crank_nicolson:
+            phi = _explicit_half_step(phi, ax, bx, cx, sweep_dt)
+            _inject_mutations_3D(phi, inject_dt, xx, yy, zz, theta0,
+                                 False, True, True)
+        return _sweep(solve_x, phi, len(yy),
+                      *(x_coeffs + (gamx, ibetx, sweep_dt) + refine),
+                      work_size=work_x, dtype=phi.dtype)
+    def sweep_y(phi, ops, inject_dt=None):
+        gamy, ibety, sweep_dt = ops
+        if crank_nicolson:
+            phi = _explicit_half_step(phi, ay, by, cy, sweep_dt, axis=1)
+            _inject_mutations_3D(phi, inject_dt, xx, yy, zz, theta0,
+                                 True, False, True)
+        return _sweep(solve_y, phi, len(xx),
+                      *(y_coeffs + (gamy, ibety, sweep_dt) + refine),
+                      work_size=work_y, dtype=phi.dtype)
+    def sweep_z(phi, ops, inject_dt=None):
+        gamz, ibetz, sweep_dt = ops
+        if crank_nicolson and transposed:
+            phi = _explicit_half_step(phi.transpose(0,2,1), az, bz, cz,
+                                      sweep_dt, axis=1).transpose(0,2,1)
+        elif crank_nicolson:
+            phi = _explicit_half_step(phi, az, bz, cz, sweep_dt, axis=2)
+        if crank_nicolson:
+            _inject_mutations_3D(phi, inject_dt, xx, yy, zz, theta0,
+                                 True, True, False)
+        return _sweep(solve_z, phi, len(xx),
+                      *(z_coeffs + (gamz, ibetz, sweep_dt) + refine),
+                      work_size=work_z, dtype=phi.dtype)
+
+    # As in _two_pops_const_params, the operators are factored only when
+    # this_dt changes.
+    def factor(this_dt):
+        if crank_nicolson:
+            dtx, dty, dtz = this_dt/4., this_dt/4., this_dt/2.
+        else:
+            dtx, dty, dtz = this_dt, this_dt, this_dt
+        gamx = ibetx = gamy = ibety = gamz = ibetz = None
+        if not frozen1:
+            gamx, ibetx = factor_x(ax, bx, cx, dtx)
+        if not frozen2:
+            gamy, ibety = factor_y(ay, by, cy, dty)
+        if not frozen3 and transposed:
+            # Transposed, the z lines are laid out as the y lines are.
+            gamz, ibetz = factor_y(az, bz, cz, dtz)
+        elif not frozen3:
+            gamz, ibetz = int_c.factor_precalc_3Dz(az, bz, cz, dtz)
+        return (gamx, ibetx, dtx), (gamy, ibety, dty), (gamz, ibetz, dtz)
+    factors = []
+
+    def step(phi, current_t, this_dt):
+        fx, fy, fz = _cached_factors(factors, this_dt, factor)
+        if not crank_nicolson:
+            _inject_mutations_3D(phi, this_dt, xx, yy, zz, theta0,
+                                 frozen1, frozen2, frozen3)
+            if not frozen1:
+                phi = sweep_x(phi, fx)
+            if not frozen2:
+                phi = sweep_y(phi, fy)
+            if not frozen3:
+                phi = sweep_z(phi, fz)
+            return phi
+
+        # Strang splitting, as in _two_pops_const_params, with the z
+        # evolution in the middle.
+        if not frozen1:
+            phi = sweep_x(phi, fx, this_dt/2.)
+        if not frozen2:
+            phi = sweep_y(phi, fy, this_dt/2.)
+        if not frozen3:
+            phi = sweep_z(phi, fz, this_dt)
+        if not frozen2:
+            phi = sweep_y(phi, fy, this_dt/2.)
+        if not frozen1:
+            phi = sweep_x(phi, fx, this_dt/2.)
+        return phi
+
+    # As in _two_pops_const_params, runs of implicit Euler steps are done
+    # entirely in C.
+    def epoch(phi, current_t, this_dt, num_steps):
+        (gamx, ibetx, _), (gamy, ibety, _), (gamz, ibetz, _)\
+                = _cached_factors(factors, this_dt, factor)
+        if frozen1:
+            gamx = ibetx = ax
+        if frozen2:
+            gamy = ibety = ax
+        if frozen3:
+            gamz = ibetz = ax
+        inject1, inject2, inject3 = _mutation_sources(_inject_mutations_3D, 3,
+                                                      this_dt, xx, yy, zz,
+                                                      theta0, frozen1,
+                                                      frozen2, frozen3)
+        if single:
+            work, = _work_arrays(int_c.integrate_factored_3D_fl,
+                                 (64*(L+M+N) + (M*N+1)//2,))
+            return int_c.integrate_factored_3D_fl(phi, ax, bx, cx, gamx, ibetx,
+                                                  ay, by, cy, gamy, ibety,
+                                                  az.ravel(), bz.ravel(),
+                                                  cz.ravel(), gamz.ravel(),
+                                                  ibetz.ravel(), inject1,
+                                                  inject2, inject3, this_dt,
+                                                  num_steps, frozen1, frozen2,
+                                                  frozen3,
+                                                  single_precision_refinement,
+                                                  work)
+        work, = _work_arrays(int_c.integrate_factored_3D, 
+                             (phi.shape[1]*phi.shape[2],))
+        return int_c.integrate_factored_3D(phi, ax, gamx, ibetx, ay, gamy,
+                                           ibety, az.ravel(), gamz.ravel(),
+                                           ibetz.ravel(), inject1, inject2,
+                                           inject3, this_dt, num_steps,
+                                           frozen1, frozen2, frozen3,
+                                           transposed, work)
+
+    phi = _integrate_steps(step, phi, [xx, yy, zz], initial_t, T,
+                           lambda t: dt,
+                           ('three_pops', nu1, nu2, nu3, m12, m13, m21, m23,
+                            m31, m32, gamma1, gamma2, gamma3, h1, h2, h3,
+                            theta0, frozen1, frozen2, frozen3),
+                           epoch if not (crank_nicolson or num_threads > 1)
+                           else None)
+    return numpy.asarray(phi, numpy.float64)
+
+def _three_pops_low_memory(phi, xx, yy, zz, T, nu1, nu2, nu3,
+                           m12, m13, m21, m23, m31, m32,
+                           gamma1, gamma2, gamma3, h1, h2, h3,
+                           theta0, initial_t, frozen1, frozen2, frozen3):
+    """
+    Integrate three populations with constant parameters, without storing
+    any coefficient arrays. See low_memory_threshold.
+
+    The steps always use implicit Euler, in double precision.
+    """
+    dx, dy, dz = numpy.diff(xx), numpy.diff(yy), numpy.diff(zz)
+    dt = min(_compute_dt(dx,nu1,[m12,m13],gamma1,h1),
+             _compute_dt(dy,nu2,[m21,m23],gamma2,h2),
+             _compute_dt(dz,nu3,[m31,m32],gamma3,h3))
+    phi = numpy.asarray(phi, numpy.float64)
+
+    def step(phi, current_t, this_dt):
         _inject_mutations_3D(phi, this_dt, xx, yy, zz, theta0,
                              frozen1, frozen2, frozen3)
         if not frozen1:
-            phi = int_c.implicit_precalc_3Dx(phi, ax, bx, cx, this_dt)
+            phi = _sweep(int_c.implicit_3Dx, phi, len(yy), xx, yy, zz,
+                         nu1, m12, m13, gamma1, h1, this_dt, _flux_mode())
         if not frozen2:
-            phi = int_c.implicit_precalc_3Dy(phi, ay, by, cy, this_dt)
+            phi = _sweep(int_c.implicit_3Dy, phi, len(xx), xx, yy, zz,
+                         nu2, m21, m23, gamma2, h2, this_dt, _flux_mode())
         if not frozen3:
-            phi = int_c.implicit_precalc_3Dz(phi, az, bz, cz, this_dt)
-        current_t += this_dt
-    return phi
+            phi = _sweep(int_c.implicit_3Dz, phi, len(xx), xx, yy, zz,
+                         nu3, m31, m32, gamma3, h3, this_dt, _flux_mode())
+        return phi
+
+    # Runs of steps are done entirely in C, unless the sweeps are split
+    # among threads.
+    def epoch(phi, current_t, this_dt, num_steps):
+        inject1, inject2, inject3\
+                = _mutation_sources(_inject_mutations_3D, 3, this_dt, xx, yy,
+                                    zz, theta0, frozen1, frozen2, frozen3)
+        return int_c.integrate_3D(phi, xx, yy, zz, nu1, nu2, nu3,
+                                  m12, m13, m21, m23, m31, m32,
+                                  gamma1, gamma2, gamma3, h1, h2, h3,
+                                  inject1, inject2, inject3, this_dt,
+                                  num_steps, frozen1, frozen2, frozen3,
+                                  _flux_mode())
+
+    return _integrate_steps(step, phi, [xx, yy, zz], initial_t, T,
+                            lambda t: dt,
+                            ('three_pops_low_memory', nu1, nu2, nu3, m12, m13,
+                             m21, m23, m31, m32, gamma1, gamma2, gamma3,
+                             h1, h2, h3, theta0, frozen1, frozen2, frozen3),
+                            epoch if num_threads <= 1 else None)
+
+def _shared_const_params(phi, xxs, T, nus, gammas, hs, theta0, initial_t,
+                         frozens, key_params):
+    """
+    Integrate populations without migration, with constant parameters. See
+    use_shared_operators.
+
+    The steps are implicit Euler, as in _two_pops_const_params and
+    _three_pops_const_params, with the same coefficients, but each axis
+    stores them only in 1D.
+
+    key_params: Parameters of the calling integration, used for its caches.
+    """
+    ndim = phi.ndim
+    dxs = [numpy.diff(grid) for grid in xxs]
+    dt = min(_compute_dt(dx, nu, [0]*(ndim-1), gamma, h)
+             for dx, nu, gamma, h in zip(dxs, nus, gammas, hs))
+
+    # Without migration, M only depends on the coordinate along the axis. The
+    # first line along the axis touches the corner of phi at 0 and the last
+    # line the corner at 1, so only they carry the boundary conditions.
+    coeffs = []
+    for xx, dx, nu, gamma, h in zip(xxs, dxs, nus, gammas, hs):
+        V = _Vfunc(xx, nu)
+        M = _Mfunc1D(xx, gamma, h)
+        MInt = _Mfunc1D((xx[:-1]+xx[1:])/2, gamma, h)
+        VInt = _Vfunc((xx[:-1]+xx[1:])/2, nu)
+        dfact = _compute_dfactor(dx)
+        MInt, delj = _flux_terms(dx, MInt, VInt, V)
+
+        a, b, c = numpy.zeros((3, len(xx)))
+        a[ 1:] += dfact[ 1:]*(-MInt*delj     - V[:-1]/(2*dx))
+        c[:-1] += dfact[:-1]*( MInt*(1-delj) - V[ 1:]/(2*dx))
+        b[:-1] += dfact[:-1]*( MInt*delj     + V[:-1]/(2*dx))
+        b[ 1:] += dfact[ 1:]*(-MInt*(1-delj) + V[ 1:]/(2*dx))
+
+        b_first, b_last = b.copy(), b.copy()
+        if M[0] <= 0:
+            b_first[0] += (0.5/nu - M[0])*2/dx[0]
+        if M[-1] >= 0:
+            b_last[-1] += -(-0.5/nu - M[-1])*2/dx[-1]
+        coeffs.append((a, (b, b_first, b_last), c))
+    acoeffs = numpy.concatenate([a for a, bs, c in coeffs])
+
+    # The factors for each axis are concatenated as integrate_shared expects,
+    # with zeros standing in for those of frozen populations.
+    def factor(this_dt):
+        gams, ibets = [], []
+        for (a, bs, c), frozen in zip(coeffs, frozens):
+            if frozen:
+                gams.append(numpy.zeros(3*len(a)))
+                ibets.append(numpy.zeros(3*len(a)))
+                continue
+            gam, ibet = zip(*[tridiag.tridiag_factor(a, b+1/this_dt, c)
+                              for b in bs])
+            gams.append(numpy.concatenate(gam))
+            ibets.append(numpy.concatenate(ibet))
+        return numpy.concatenate(gams), numpy.concatenate(ibets)
+    factors = []
+
+    # phi is swept as a flattened array. Along axis ii, each line's
+    # neighboring points are strides[ii] apart.
+    shape = phi.shape
+    strides = [numpy.prod(shape[ii+1:], dtype=int) for ii in range(ndim)]
+    offsets = numpy.cumsum([0] + list(shape))
+    def step(phi, current_t, this_dt):
+        gams, ibets = _cached_factors(factors, this_dt, factor)
+        _inject_mutations_ND(phi, this_dt, xxs, theta0, frozens)
+        phi = phi.reshape(-1)
+        for ii in range(ndim):
+            if frozens[ii]:
+                continue
+            lo, hi = offsets[ii], offsets[ii+1]
+            phi = _sweep(int_c.implicit_shared, phi, phi.size//shape[ii],
+                         acoeffs[lo:hi], gams[3*lo:3*hi], ibets[3*lo:3*hi],
+                         this_dt, strides[ii])
+        return phi.reshape(shape)
+
+    # Runs of steps are done entirely in C, unless the sweeps are split
+    # among threads.
+    def epoch(phi, current_t, this_dt, num_steps):
+        gams, ibets = _cached_factors(factors, this_dt, factor)
+        injects = _mutation_sources(_inject_mutations_ND, ndim, this_dt, xxs,
+                                    theta0, frozens)
+        phi = int_c.integrate_shared(phi.reshape(-1), acoeffs, gams, ibets,
+                                     numpy.array(shape, numpy.int32),
+                                     numpy.array(frozens, numpy.int32),
+                                     injects, this_dt, num_steps)
+        return phi.reshape(shape)
+
+    phi = numpy.asarray(phi, numpy.float64)
+    return _integrate_steps(step, phi, xxs, initial_t, T, lambda t: dt,
+                            key_params, epoch if num_threads <= 1 else None)
 
 def _Vfunc_X(x, nu, beta):
     return 1./nu * x*(1-x) * (2*beta+4.)*(beta+1.)/(9.*beta)
@@ -727,7 +2609,7 @@ def one_pop_X(phi, xx, T, nu=1, gamma=0, h=0.5, beta=1, alpha=1, theta0=1.0,
     phi: Initial 1-dimensional phi
     xx: Grid upon (0,1) overwhich phi is defined.
 
-    nu, gamma, and theta0 may be functions of time.
+    nu, gamma, h, beta, alpha, and theta0 may be functions of time.
     nu: Population size
     gamma: Scaled selection coefficient on *all* segregating alleles
     h: Dominance coefficient. h = 0.5 corresponds to genic selection. 
@@ -762,9 +2644,41 @@ def one_pop_X(phi, xx, T, nu=1, gamma=0, h=0.5, beta=1, alpha=1, theta0=1.0,
     if numpy.all([numpy.isscalar(var) for var in vars_to_check]):
         return _one_pop_const_params_X(phi, xx, T, nu, gamma, h, beta, alpha, 
                                        theta0, initial_t)
-    else:
-        raise NotImplementedError('X chromosome integration currently only '
-                                  'implemented for constant parameters.')
+
+    nu_f = Misc.ensure_1arg_func(nu)
+    gamma_f = Misc.ensure_1arg_func(gamma)
+    h_f = Misc.ensure_1arg_func(h)
+    beta_f = Misc.ensure_1arg_func(beta)
+    alpha_f = Misc.ensure_1arg_func(alpha)
+    theta0_f = Misc.ensure_1arg_func(theta0)
+
+    dx = numpy.diff(xx)
+    def dt_func(t):
+        return _compute_dt(dx,nu_f(t),[0],gamma_f(t),h_f(t))
+
+    # As in one_pop, the parameters for all the steps are evaluated at once,
+    # and the steps are then all taken in C.
+    def take_steps(phi, steps):
+        dts, (nu, gamma, h, beta, alpha, theta0)\
+                = _step_values((nu_f, gamma_f, h_f, beta_f, alpha_f,
+                                theta0_f), steps)
+        # beta is a ratio of population sizes, so it must also be positive.
+        _check_params(T, [nu, beta], [theta0, alpha])
+        inject, = _mutation_sources(_inject_mutations_1D_X, 1, dts, xx,
+                                    theta0, beta, alpha)
+        return int_c.integrate_1D_X(phi, xx, nu, gamma, h, beta, inject, dts,
+                                    _flux_mode())
+
+    def step(phi, current_t, this_dt):
+        return take_steps(phi, [(current_t, this_dt)])
+
+    def params_at(t):
+        return [nu_f(t), beta_f(t)], [theta0_f(t), alpha_f(t)]
+
+    return _integrate_steps(step, phi, xx, initial_t, T, dt_func,
+                            ('one_pop_X', nu_f, gamma_f, h_f, beta_f, alpha_f,
+                             theta0_f),
+                            take_steps=take_steps, params_at=params_at)
 
 def _one_pop_const_params_X(phi, xx, T, nu=1, gamma=0, h=0.5, beta=1, alpha=1, 
                             theta0=1, initial_t=0):
@@ -790,7 +2704,7 @@ def _one_pop_const_params_X(phi, xx, T, nu=1, gamma=0, h=0.5, beta=1, alpha=1,
 
     dx = numpy.diff(xx)
     dfactor = _compute_dfactor(dx)
-    delj = _compute_delj(dx, MInt, VInt)
+    MInt, delj = _flux_terms(dx, MInt, VInt, V)
 
     a = numpy.zeros(phi.shape)
     a[1:] += dfactor[1:]*(-MInt * delj - V[:-1]/(2*dx))
@@ -808,12 +2722,51 @@ def _one_pop_const_params_X(phi, xx, T, nu=1, gamma=0, h=0.5, beta=1, alpha=1,
         b[-1] += -(-0.5/nu - M[-1])*2/dx[-1]
 
     dt = _compute_dt(dx,nu,[0],gamma,h)
-    current_t = initial_t
-    while current_t < T:    
-        this_dt = min(dt, T - current_t)
-
-        _inject_mutations_1D_X(phi, this_dt, xx, theta0, beta, alpha)
-        r = phi/this_dt
-        phi = tridiag.tridiag(a, b+1./this_dt, c, r)
-        current_t += this_dt
-    return phi
+    # The operator only changes with this_dt, so it is factored only when
+    # this_dt changes, such as for the final, shorter, step.
+    crank_nicolson = _crank_nicolson()
+    if not crank_nicolson:
+        factor = lambda this_dt: tridiag.tridiag_factor(a, b+1./this_dt, c)
+    else:
+        # A Crank-Nicolson step solves the systems of an implicit step of
+        # half the length.
+        factor = lambda this_dt: tridiag.tridiag_factor(a, b+2./this_dt, c)
+    factors = []
+    def step(phi, current_t, this_dt):
+        gam, ibet = _cached_factors(factors, this_dt, factor)
+        if not crank_nicolson:
+            _inject_mutations_1D_X(phi, this_dt, xx, theta0, beta, alpha)
+            r = phi/this_dt
+            return tridiag.tridiag_factored(a, gam, ibet, r)
+
+        # The new mutations enter the implicit solve as a source. See
+        # _two_pops_const_params.
+        r = _explicit_half_step(phi, a, b, c, this_dt/2.)
+        _inject_mutations_1D_X(r, this_dt, xx, theta0, beta, alpha)
+        return tridiag.tridiag_factored(a, gam, ibet, r/(this_dt/2.))
+
+    def epoch(phi, current_t, this_dt, num_steps):
+        gam, ibet = _cached_factors(factors, this_dt, factor)
+        inject, = _mutation_sources(_inject_mutations_1D_X, 1, this_dt, xx,
+                                    theta0, beta, alpha)
+        return int_c.integrate_factored_1D(phi, a, gam, ibet, inject,
+                                           this_dt, num_steps)
+
+    source = _inject_mutations_1D_X(numpy.zeros(phi.shape), 1.0, xx, theta0,
+                                    beta, alpha)
+    steady_state = lambda: tridiag.tridiag(a, b, c, source)
+
+    if time_scheme == 'expm':
+        A = _sparse_operator([(a, b, c)], phi.shape)
+        expm_step = lambda phi, current_t, this_dt:\
+                _expm_propagate(phi, A, source, this_dt, dense=True)
+        return _integrate_steps(expm_step, phi, xx, initial_t, T,
+                                lambda t: T - initial_t,
+                                ('one_pop_X', nu, gamma, h, beta, alpha,
+                                 theta0),
+                                steady_state=steady_state)
+
+    return _integrate_steps(step, phi, xx, initial_t, T, lambda t: dt,
+                            ('one_pop_X', nu, gamma, h, beta, alpha, theta0),
+                            epoch if not crank_nicolson else None,
+                            steady_state=steady_state)
@@ -81,8 +81,19 @@ def exponential_grid(pts, crwd=8.):
     beyond this.
 
     This grid was contributed by Simon Gravel.
+
+    pts may also be a sequence of numbers of points, one for each population,
+    in which case a list of grids is returned.
     """
+    if not numpy.isscalar(pts):
+        return [exponential_grid(num_pts, crwd) for num_pts in pts]
     unif = numpy.linspace(-1,1,pts)
+    return _exponential_map(unif, crwd)
+
+def _exponential_map(unif, crwd):
+    """
+    The points of the exponential grid at positions unif on [-1,1].
+    """
     grid = 1./(1. + numpy.exp(-crwd*unif))
 
     # Normalize
@@ -91,6 +102,230 @@ def exponential_grid(pts, crwd=8.):
 
 default_grid = exponential_grid
 
+def phi_grid_density(phi, xxs, ns, mix=0.5):
+    """
+    Relative densities of grid points that suit phi, for each population.
+
+    phi: Population frequency distribution, typically from a coarse pass of
+         the model.
+    xxs: Grids on which phi is defined, which must each be an exponential_grid.
+    ns: Sample sizes for each population.
+    mix: Fraction of the points to keep spaced as in the exponential grid.
+
+    Over an interval of width h, linear interpolation of phi errs by about
+    h**3*|phi''|/12 in the integrals that give the spectrum. The error
+    indicator at each point is |phi''|, integrated over the other
+    populations, times the sum of the sampling probabilities for each entry
+    of the marginal spectrum divided by that entry. It thus measures the
+    relative error of the spectrum. The density of points that minimizes the
+    total error for a given number of points is the cube root of the
+    indicator.
+
+    Returns a list of arrays, one for each population, with the density at
+    each point of its grid relative to that of the exponential grid. These are
+    used by density_grid.
+    """
+    import dadi
+    xxs = expand_grids(xxs, phi.ndim)
+    densities = []
+    for axis, (n, xx) in enumerate(zip(ns, xxs)):
+        # With this population's axis first, the other axes are integrated
+        # over from the last.
+        others = [xxs[dd] for dd in range(phi.ndim) if dd != axis]
+        arr = numpy.rollaxis(phi, axis)
+        dx = numpy.diff(xx)
+        h0 = dx[:-1].reshape((-1,) + (1,)*(phi.ndim-1))
+        h1 = dx[1:].reshape((-1,) + (1,)*(phi.ndim-1))
+        deriv2 = 2*abs(h0*arr[2:] - (h0+h1)*arr[1:-1] + h1*arr[:-2])\
+                / (h0*h1*(h0+h1))
+        marginal = arr
+        for other in reversed(others):
+            deriv2 = trapz(deriv2, other, axis=-1)
+            marginal = trapz(marginal, other, axis=-1)
+        deriv2 = numpy.concatenate(([deriv2[0]], deriv2, [deriv2[-1]]))
+
+        dd = numpy.arange(1, n)[:,numpy.newaxis]
+        sampling = comb(n, dd) * xx**dd * (1-xx)**(n-dd)
+        fs = numpy.dot(dadi.Spectrum._from_phi_weights_analytic(n, xx)[1:-1],
+                       marginal)
+        fs = numpy.maximum(abs(fs), numpy.finfo(float).tiny)
+        weight = numpy.sum(sampling/fs[:,numpy.newaxis], axis=0)
+
+        # The density per point of xx, rather than per unit of x.
+        density = (deriv2*weight)**(1./3) * numpy.gradient(xx)
+        if numpy.any(density > 0):
+            density = mix + (1-mix)*density/numpy.mean(density)
+        else:
+            density = numpy.ones(len(xx))
+        # Smooth, so that the spacing of the resulting grids varies slowly.
+        for ii in range(2):
+            density[1:-1] = (density[:-2] + 2*density[1:-1] + density[2:])/4.
+        densities.append(density)
+    return densities
+
+def density_grid(pts, density, crwd=8.):
+    """
+    An exponential grid with its points redistributed according to density.
+
+    pts: Number of grid points.
+    density: Density of points relative to the exponential grid, at each of
+             the points of an exponential grid, as from phi_grid_density.
+    crwd: Crowding of the exponential grid, as in exponential_grid.
+
+    The points are placed so that each interval holds an equal share of the
+    density. Grids for different pts thus have the same shape, and the first
+    point after 0 scales like that of the exponential grid, so they can be
+    used for extrapolation.
+    """
+    unif = numpy.linspace(-1, 1, len(density))
+    cumul = numpy.concatenate(([0], numpy.cumsum(numpy.diff(unif)
+                                                 * (density[1:]
+                                                    + density[:-1])/2)))
+    unif = numpy.interp(numpy.linspace(0, cumul[-1], pts), cumul, unif)
+    return _exponential_map(unif, crwd)
+
+class AdaptedGrids(object):
+    """
+    Grids adapted to phi, for the models wrapped by make_adapted_grid_func.
+
+    Such a model receives an instance as its 'grids' keyword argument. It
+    gets its grids from grids.grid(pts), in place of default_grid(pts), and
+    samples phi with grids.from_phi, in place of Spectrum.from_phi.
+
+    Each call of the wrapped function uses a new instance. Until adapt is
+    called, the grids are exponential grids, and from_phi records each phi
+    it samples. Afterwards, the grids follow the densities that adapt
+    computes from those phis.
+    """
+    def __init__(self, crwd=8.):
+        """
+        crwd: Crowding of the exponential grids, as in exponential_grid.
+        """
+        self.crwd = crwd
+        self.records = []
+        self.densities = None
+
+    def grid(self, pts):
+        """
+        Grid of pts points, or a list of grids if pts is a sequence of
+        numbers of points, one for each population.
+
+        If pts is a single number, the adapted densities are averaged over
+        the populations. With a grid for each population, those from the phis
+        with that many populations are used.
+        """
+        if self.densities is None:
+            return exponential_grid(pts, self.crwd)
+        overall = numpy.mean([dens for record in self.densities
+                              for dens in record], axis=0)
+        if numpy.isscalar(pts):
+            return density_grid(pts, overall, self.crwd)
+        matching = [record for record in self.densities
+                    if len(record) == len(pts)]
+        if not matching:
+            matching = [[overall]*len(pts)]
+        return [density_grid(num_pts, numpy.mean([record[ii] for record
+                                                  in matching], axis=0),
+                             self.crwd)
+                for ii, num_pts in enumerate(pts)]
+
+    def from_phi(self, phi, ns, xxs, *args, **kwargs):
+        """
+        Spectrum.from_phi, recording phi until adapt is called.
+        """
+        import dadi
+        if self.densities is None:
+            self.records.append((phi, xxs, ns))
+        return dadi.Spectrum.from_phi(phi, ns, xxs, *args, **kwargs)
+
+    def adapt(self, mix=0.5):
+        """
+        Adapt the grids to the phis recorded so far, from phi_grid_density.
+
+        mix: Fraction of the points to keep spaced as in the exponential grid.
+        """
+        if not self.records:
+            raise ValueError('No phi has been sampled with from_phi to adapt '
+                             'the grids to.')
+        self.densities = [phi_grid_density(phi, xxs, ns, mix)
+                          for phi, xxs, ns in self.records]
+        self.records = []
+
+def make_adapted_grid_func(func, coarse_pts, mix=0.5, crwd=8.):
+    """
+    Generate a version of func that integrates on grids adapted to phi.
+
+    func: A function whose last non-keyword argument is 'pts', as for
+          make_extrap_func. It must take an AdaptedGrids as its 'grids'
+          keyword argument, get its grids from grids.grid, and sample phi
+          with grids.from_phi. It may itself be the result of
+          make_extrap_func, which passes the keyword argument on.
+    coarse_pts: Number of grid points for the coarse pass.
+    mix: Fraction of the points to keep spaced as in the exponential grid,
+         as in phi_grid_density.
+    crwd: Crowding of the exponential grids, as in exponential_grid.
+
+    On each call, func is first run with coarse_pts. The phi it samples then
+    give the densities of the grids, from phi_grid_density. func is then run
+    with the given pts, on grids of those densities. For points near 0 or 1
+    after strong growth, the same accuracy then typically needs fewer points.
+    This works for any number of populations. However, each grid is along a
+    single population, so structure along a diagonal, as after a recent
+    split, is only resolved through its projections.
+    """
+    def adapted_func(*args, **kwargs):
+        # Separate pts from arguments, as in make_extrap_func
+        if 'pts' not in kwargs:
+            other_args, pts = args[:-1], args[-1]
+        else:
+            other_args = args
+            pts = kwargs['pts']
+            del kwargs['pts']
+
+        grids = AdaptedGrids(crwd)
+        func(*(other_args + (coarse_pts,)), grids=grids, **kwargs)
+        grids.adapt(mix)
+        return func(*(other_args + (pts,)), grids=grids, **kwargs)
+
+    adapted_func.func_name = func.func_name
+    adapted_func.func_doc = func.func_doc
+
+    return adapted_func
+
+def coarse_pts(pts, fraction=0.5):
+    """
+    Number of points for a coarse grid, for the early epochs of a model.
+
+    pts: Number of points of the fine grid, or a sequence of numbers of
+         points, one for each population.
+    fraction: Ratio of the spacings of the fine and coarse grids.
+
+    Extrapolation assumes that the error shrinks with the spacing of the
+    grid sampled by Spectrum.from_phi. That holds if the coarse grid refines
+    along with the fine one, with a fixed ratio of spacings, as here. The
+    ratio is exact when fraction*(pts-1) is an integer for every pts, such
+    as for pts_l = [41,51,61] with the default fraction.
+
+    See PhiManip.phi_regrid for moving phi between the grids.
+    """
+    if not numpy.isscalar(pts):
+        return tuple(coarse_pts(num_pts, fraction) for num_pts in pts)
+    return max(int(round(fraction*(pts-1))) + 1, 3)
+
+def expand_grids(xx, ndim):
+    """
+    List of the grids for each of ndim populations.
+
+    xx: Either a single grid, used for every population, or a sequence of
+        ndim grids, one for each population.
+    """
+    if numpy.ndim(xx[0]) == 0:
+        return [xx]*ndim
+    if len(xx) != ndim:
+        raise ValueError('%i grids given for %i populations.'
+                         % (len(xx), ndim))
+    return list(xx)
+
 def end_point_first_derivs(xx):
     """
     Coefficients for a 5-point one-sided approximation of the first derivative.
@@ -193,13 +428,16 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
 
     func: A function that returns a single scalar or array and whose last
         non-keyword argument is 'pts': the number of default_grid points to use
-        in calculation.  
+        in calculation.  pts may also be a tuple with the number of points for
+        each population.
     extrap_x_l: An explict list of x values to use for extrapolation. If not 
         provided, the extrapolation routine will look for '.extrap_x'
         attributes on the results of func. The method Spectrum.from_phi will
         add an extrap_x attribute to resulting Spectra, equal to the x-value
         of the first non-zero grid point. An explicit list is useful if you
-        want to override this behavior for testing.
+        want to override this behavior for testing. If the grids differ
+        among populations, each x value is a tuple with the x value for each
+        population, and the extrapolation is by multivariate_extrap.
     fail_mag:  Simon Gravel noted that there can be numerical instabilities in
         extrapolation when working with large spectra that have very small
         entires (of order 1e-24). To avoid these instabilities, we ignore the 
@@ -208,8 +446,9 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
         from the smallest x input result.
 
     Returns a new function whose last argument is a list of numbers of grid
-    points and that returns a result extrapolated to infinitely many grid
-    points.
+    points (or of tuples of numbers of grid points, one for each population)
+    and that returns a result extrapolated to infinitely many grid points. A
+    single tuple must be passed inside a list, as in [(20,40)].
     """
     x_l_from_results = (extrap_x_l is None)
 
@@ -273,9 +512,20 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
         if extrap_log:
             result_l = [numpy.log(r) for r in result_l]
 
+        # With the same x for every population, the usual extrapolation
+        # applies.
+        x_l = [x if numpy.isscalar(x) or len(set(x)) > 1 else x[0]
+               for x in x_l]
+        multivariate = not all(numpy.isscalar(x) for x in x_l)
+        if multivariate:
+            ndim = max(len(x) for x in x_l if not numpy.isscalar(x))
+            x_l = [x if not numpy.isscalar(x) else (x,)*ndim for x in x_l]
+
         # Extrapolate
         if len(pts_l) == 1:
             ex_result = result_l[0]
+        elif multivariate:
+            ex_result = multivariate_extrap(result_l, x_l)
         elif len(pts_l) == 2:
             ex_result = linear_extrap(result_l, x_l)
         elif len(pts_l) == 3:
@@ -300,7 +550,8 @@ def make_extrap_func(func, extrap_x_l=None, extrap_log=False, fail_mag=10):
         # if it is too different from the input values.
         if len(pts_l) > 1:
             # Assume the best input value comes from the smallest grid.
-            best_result = result_l[numpy.argmin(x_l)]
+            best_result = result_l[numpy.argmin([numpy.prod(x)
+                                                 for x in x_l])]
             if extrap_log:
                 best_result = numpy.exp(best_result)
 
@@ -341,8 +592,8 @@ def make_extrap_log_func(func, extrap_x_l=None):
          want to override this behavior for testing.
 
     Returns a new function whose last argument is a list of numbers of grid
-    points and that returns a result extrapolated to infinitely many grid
-    points.
+    points (or of tuples of numbers of grid points, one for each population)
+    and that returns a result extrapolated to infinitely many grid points.
     """
     return make_extrap_func(func, extrap_x_l=extrap_x_l, extrap_log=True)
 
@@ -542,3 +793,76 @@ def quintic_extrap((y1,y2,y3,y4,y5,y6), (x1,x2,x3,x4,x5,x6)):
     # This horrid implementation came from using CForm in Mathematica.
     Power = numpy.power
     return (-(x1*(x1 - x3)*x3*(x1 - x4)*(x3 - x4)*x4*(x1 - x5)* (x3 - x5)*(x4 - x5)*x5*(x1 - x6)*(x3 - x6)* (x4 - x6)*(x5 - x6)*x6*y2) + Power(x2,5)*(-(x1*(x1 - x4)*x4*(x1 - x5)* (x4 - x5)*x5*(x1 - x6)*(x4 - x6)*(x5 - x6)* x6*y3) + Power(x3,4)* (-(x1*(x1 - x5)*x5*(x1 - x6)*(x5 - x6)*x6* y4) + Power(x4,3)* (x1*x6*(-x1 + x6)*y5 + Power(x5,2)*(x6*y1 - x1*y6) + x5*(-(Power(x6,2)*y1) + Power(x1,2)*y6)) + Power(x4,2)* (x1*x6*(Power(x1,2) - Power(x6,2))*y5 + Power(x5,3)*(-(x6*y1) + x1*y6) + x5*(Power(x6,3)*y1 - Power(x1,3)*y6)) + x4*(Power(x1,2)*Power(x6,2)*(-x1 + x6)* y5 + Power(x5,3)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,3)*y1) + Power(x1,3)*y6))) + Power(x3,3)* (x1*x5*x6*(Power(x1,3)*(x5 - x6) + x5*x6*(Power(x5,2) - Power(x6,2)) + x1*(-Power(x5,3) + Power(x6,3)))*y4 + Power(x4,4)* (x1*(x1 - x6)*x6*y5 + Power(x5,2)*(-(x6*y1) + x1*y6) + x5*(Power(x6,2)*y1 - Power(x1,2)*y6)) + x4*(Power(x1,2)*Power(x6,2)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,4)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,2)* (x1*x6*(-Power(x1,3) + Power(x6,3))*y5 + Power(x5,4)*(x6*y1 - x1*y6) + x5*(-(Power(x6,4)*y1) + Power(x1,4)*y6))) + x3*(Power(x1,2)*(x1 - x5)*Power(x5,2)* (x1 - x6)*(x5 - x6)*Power(x6,2)*y4 + Power(x4,4)* (Power(x1,2)*(x1 - x6)*Power(x6,2)*y5 + Power(x5,3)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,3)*y1 - Power(x1,3)*y6)) + Power(x4,2)* (Power(x1,3)*(x1 - x6)*Power(x6,3)*y5 + Power(x5,4)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,3)* (Power(x1,2)*Power(x6,2)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,4)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,4)*y1) + Power(x1,4)*y6))) + Power(x3,2)* (x1*x5*x6*(Power(x5,2)*Power(x6,2)* (-x5 + x6) + Power(x1,3)* (-Power(x5,2) + Power(x6,2)) + Power(x1,2)*(Power(x5,3) - Power(x6,3))) *y4 + Power(x4,4)* (x1*x6*(-Power(x1,2) + Power(x6,2))*y5 + Power(x5,3)*(x6*y1 - x1*y6) + x5*(-(Power(x6,3)*y1) + Power(x1,3)*y6)) + Power(x4,3)* (x1*x6*(Power(x1,3) - Power(x6,3))*y5 + Power(x5,4)*(-(x6*y1) + x1*y6) + x5*(Power(x6,4)*y1 - Power(x1,4)*y6)) + x4*(Power(x1,3)*Power(x6,3)*(-x1 + x6)* y5 + Power(x5,4)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,4)*y1) + Power(x1,4)*y6)))) + Power(x2,4)*(x1*(x1 - x4)*x4*(x1 - x5)* (x4 - x5)*x5*(x1 - x6)*(x4 - x6)*(x5 - x6)* x6*(x1 + x4 + x5 + x6)*y3 + Power(x3,5)*(x1*(x1 - x5)*x5*(x1 - x6)* (x5 - x6)*x6*y4 + Power(x4,3)* (x1*(x1 - x6)*x6*y5 + Power(x5,2)*(-(x6*y1) + x1*y6) + x5*(Power(x6,2)*y1 - Power(x1,2)*y6)) + x4*(Power(x1,2)*(x1 - x6)*Power(x6,2)*y5 + Power(x5,3)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,3)*y1 - Power(x1,3)*y6)) + Power(x4,2)* (x1*x6*(-Power(x1,2) + Power(x6,2))*y5 + Power(x5,3)*(x6*y1 - x1*y6) + x5*(-(Power(x6,3)*y1) + Power(x1,3)*y6))) + Power(x3,2)* (x1*x5*(Power(x1,2) - Power(x5,2))*x6* (Power(x1,2) - Power(x6,2))* (Power(x5,2) - Power(x6,2))*y4 + Power(x4,5)* (x1*x6*(Power(x1,2) - Power(x6,2))*y5 + Power(x5,3)*(-(x6*y1) + x1*y6) + x5*(Power(x6,3)*y1 - Power(x1,3)*y6)) + x4*(Power(x1,3)*Power(x6,3)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,5)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,3)* (x1*x6*(-Power(x1,4) + Power(x6,4))*y5 + Power(x5,5)*(x6*y1 - x1*y6) + x5*(-(Power(x6,5)*y1) + Power(x1,5)*y6))) + Power(x3,3)* (x1*x5*x6*(-(Power(x5,4)*x6) + x5*Power(x6,4) + Power(x1,4)*(-x5 + x6) + x1*(Power(x5,4) - Power(x6,4)))*y4 + Power(x4,5)* (x1*x6*(-x1 + x6)*y5 + Power(x5,2)*(x6*y1 - x1*y6) + x5*(-(Power(x6,2)*y1) + Power(x1,2)*y6)) + Power(x4,2)* (x1*x6*(Power(x1,4) - Power(x6,4))*y5 + Power(x5,5)*(-(x6*y1) + x1*y6) + x5*(Power(x6,5)*y1 - Power(x1,5)*y6)) + x4*(Power(x1,2)*Power(x6,2)* (-Power(x1,3) + Power(x6,3))*y5 + Power(x5,5)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,5)*y1) + Power(x1,5)*y6))) + x3*(Power(x1,2)*Power(x5,2)*Power(x6,2)* (-(Power(x5,3)*x6) + x5*Power(x6,3) + Power(x1,3)*(-x5 + x6) + x1*(Power(x5,3) - Power(x6,3)))*y4 + Power(x4,5)* (Power(x1,2)*Power(x6,2)*(-x1 + x6)*y5 + Power(x5,3)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,3)*y1) + Power(x1,3)*y6)) + Power(x4,3)* (Power(x1,2)*Power(x6,2)* (Power(x1,3) - Power(x6,3))*y5 + Power(x5,5)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,2)* (Power(x1,3)*Power(x6,3)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,5)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,5)*y1) + Power(x1,5)*y6)))) + Power(x2,3)*(-(x1*(x1 - x4)*x4*(x1 - x5)* (x4 - x5)*x5*(x1 - x6)*(x4 - x6)*(x5 - x6)* x6*(x5*x6 + x4*(x5 + x6) + x1*(x4 + x5 + x6))*y3) + Power(x3,5)*(x1*x5*x6* (-(Power(x5,3)*x6) + x5*Power(x6,3) + Power(x1,3)*(-x5 + x6) + x1*(Power(x5,3) - Power(x6,3)))*y4 + Power(x4,4)* (x1*x6*(-x1 + x6)*y5 + Power(x5,2)*(x6*y1 - x1*y6) + x5*(-(Power(x6,2)*y1) + Power(x1,2)*y6)) + Power(x4,2)* (x1*x6*(Power(x1,3) - Power(x6,3))*y5 + Power(x5,4)*(-(x6*y1) + x1*y6) + x5*(Power(x6,4)*y1 - Power(x1,4)*y6)) + x4*(Power(x1,2)*Power(x6,2)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,4)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,4)*y1) + Power(x1,4)*y6))) + Power(x3,4)* (x1*x5*x6*(Power(x1,4)*(x5 - x6) + x5*x6*(Power(x5,3) - Power(x6,3)) + x1*(-Power(x5,4) + Power(x6,4)))*y4 + Power(x4,5)* (x1*(x1 - x6)*x6*y5 + Power(x5,2)*(-(x6*y1) + x1*y6) + x5*(Power(x6,2)*y1 - Power(x1,2)*y6)) + x4*(Power(x1,2)*Power(x6,2)* (Power(x1,3) - Power(x6,3))*y5 + Power(x5,5)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,2)* (x1*x6*(-Power(x1,4) + Power(x6,4))*y5 + Power(x5,5)*(x6*y1 - x1*y6) + x5*(-(Power(x6,5)*y1) + Power(x1,5)*y6))) + x3*(Power(x1,2)*Power(x5,2)* Power(x6,2)* (Power(x5,2)*(x5 - x6)*Power(x6,2) + Power(x1,3)* (Power(x5,2) - Power(x6,2)) + Power(x1,2)*(-Power(x5,3) + Power(x6,3)))*y4 + Power(x4,5)* (Power(x1,2)*Power(x6,2)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,4)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,2)* (Power(x1,4)*(x1 - x6)*Power(x6,4)*y5 + Power(x5,5)* (-(Power(x6,4)*y1) + Power(x1,4)*y6) + Power(x5,4)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,4)* (Power(x1,2)*Power(x6,2)* (-Power(x1,3) + Power(x6,3))*y5 + Power(x5,5)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,5)*y1) + Power(x1,5)*y6))) + Power(x3,2)* (x1*x5*x6*(Power(x5,3)*Power(x6,3)* (-x5 + x6) + Power(x1,4)* (-Power(x5,3) + Power(x6,3)) + Power(x1,3)*(Power(x5,4) - Power(x6,4))) *y4 + Power(x4,5)* (x1*x6*(-Power(x1,3) + Power(x6,3))*y5 + Power(x5,4)*(x6*y1 - x1*y6) + x5*(-(Power(x6,4)*y1) + Power(x1,4)*y6)) + Power(x4,4)* (x1*x6*(Power(x1,4) - Power(x6,4))*y5 + Power(x5,5)*(-(x6*y1) + x1*y6) + x5*(Power(x6,5)*y1 - Power(x1,5)*y6)) + x4*(Power(x1,4)*Power(x6,4)*(-x1 + x6)* y5 + Power(x5,5)* (Power(x6,4)*y1 - Power(x1,4)*y6) + Power(x5,4)* (-(Power(x6,5)*y1) + Power(x1,5)*y6)))) + x2*(-(Power(x1,2)*(x1 - x4)*Power(x4,2)* (x1 - x5)*(x4 - x5)*Power(x5,2)*(x1 - x6)* (x4 - x6)*(x5 - x6)*Power(x6,2)*y3) + Power(x3,5)*(-(Power(x1,2)*(x1 - x5)* Power(x5,2)*(x1 - x6)*(x5 - x6)* Power(x6,2)*y4) + Power(x4,4)* (Power(x1,2)*Power(x6,2)*(-x1 + x6)*y5 + Power(x5,3)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,3)*y1) + Power(x1,3)*y6)) + Power(x4,3)* (Power(x1,2)*Power(x6,2)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,4)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,2)* (Power(x1,3)*Power(x6,3)*(-x1 + x6)*y5 + Power(x5,4)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,4)*y1) + Power(x1,4)*y6))) + Power(x3,4)* (Power(x1,2)*Power(x5,2)*Power(x6,2)* (Power(x1,3)*(x5 - x6) + x5*x6*(Power(x5,2) - Power(x6,2)) + x1*(-Power(x5,3) + Power(x6,3)))*y4 + Power(x4,5)* (Power(x1,2)*(x1 - x6)*Power(x6,2)*y5 + Power(x5,3)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,3)*y1 - Power(x1,3)*y6)) + Power(x4,2)* (Power(x1,3)*Power(x6,3)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,5)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,3)* (Power(x1,2)*Power(x6,2)* (-Power(x1,3) + Power(x6,3))*y5 + Power(x5,5)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,5)*y1) + Power(x1,5)*y6))) + Power(x3,2)* (Power(x1,3)*(x1 - x5)*Power(x5,3)*(x1 - x6)* (x5 - x6)*Power(x6,3)*y4 + Power(x4,5)* (Power(x1,3)*(x1 - x6)*Power(x6,3)*y5 + Power(x5,4)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,3)* (Power(x1,4)*(x1 - x6)*Power(x6,4)*y5 + Power(x5,5)* (-(Power(x6,4)*y1) + Power(x1,4)*y6) + Power(x5,4)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,4)* (Power(x1,3)*Power(x6,3)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,5)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,5)*y1) + Power(x1,5)*y6))) + Power(x3,3)* (Power(x1,2)*Power(x5,2)*Power(x6,2)* (Power(x5,2)*Power(x6,2)*(-x5 + x6) + Power(x1,3)* (-Power(x5,2) + Power(x6,2)) + Power(x1,2)*(Power(x5,3) - Power(x6,3))) *y4 + Power(x4,5)* (Power(x1,2)*Power(x6,2)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,4)* (Power(x6,2)*y1 - Power(x1,2)*y6) + Power(x5,2)* (-(Power(x6,4)*y1) + Power(x1,4)*y6)) + Power(x4,4)* (Power(x1,2)*Power(x6,2)* (Power(x1,3) - Power(x6,3))*y5 + Power(x5,5)* (-(Power(x6,2)*y1) + Power(x1,2)*y6) + Power(x5,2)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,2)* (Power(x1,4)*Power(x6,4)*(-x1 + x6)*y5 + Power(x5,5)* (Power(x6,4)*y1 - Power(x1,4)*y6) + Power(x5,4)* (-(Power(x6,5)*y1) + Power(x1,5)*y6)))) + Power(x2,2)*(x1*(x1 - x4)*x4*(x1 - x5)* (x4 - x5)*x5*(x1 - x6)*(x4 - x6)*(x5 - x6)* x6*(x4*x5*x6 + x1*(x5*x6 + x4*(x5 + x6)))*y3 + Power(x3,5)* (x1*x5*x6*(Power(x5,2)*(x5 - x6)* Power(x6,2) + Power(x1,3)* (Power(x5,2) - Power(x6,2)) + Power(x1,2)*(-Power(x5,3) + Power(x6,3)))*y4 + Power(x4,4)* (x1*x6*(Power(x1,2) - Power(x6,2))*y5 + Power(x5,3)*(-(x6*y1) + x1*y6) + x5*(Power(x6,3)*y1 - Power(x1,3)*y6)) + x4*(Power(x1,3)*(x1 - x6)*Power(x6,3)*y5 + Power(x5,4)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,4)*y1 - Power(x1,4)*y6)) + Power(x4,3)* (x1*x6*(-Power(x1,3) + Power(x6,3))*y5 + Power(x5,4)*(x6*y1 - x1*y6) + x5*(-(Power(x6,4)*y1) + Power(x1,4)*y6))) + Power(x3,3)* (x1*x5*x6*(Power(x5,3)*(x5 - x6)* Power(x6,3) + Power(x1,4)* (Power(x5,3) - Power(x6,3)) + Power(x1,3)*(-Power(x5,4) + Power(x6,4)))*y4 + Power(x4,5)* (x1*x6*(Power(x1,3) - Power(x6,3))*y5 + Power(x5,4)*(-(x6*y1) + x1*y6) + x5*(Power(x6,4)*y1 - Power(x1,4)*y6)) + x4*(Power(x1,4)*(x1 - x6)*Power(x6,4)*y5 + Power(x5,5)* (-(Power(x6,4)*y1) + Power(x1,4)*y6) + Power(x5,4)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,4)* (x1*x6*(-Power(x1,4) + Power(x6,4))*y5 + Power(x5,5)*(x6*y1 - x1*y6) + x5*(-(Power(x6,5)*y1) + Power(x1,5)*y6))) + Power(x3,4)* (-(x1*x5*(Power(x1,2) - Power(x5,2))*x6* (Power(x1,2) - Power(x6,2))* (Power(x5,2) - Power(x6,2))*y4) + Power(x4,5)* (x1*x6*(-Power(x1,2) + Power(x6,2))*y5 + Power(x5,3)*(x6*y1 - x1*y6) + x5*(-(Power(x6,3)*y1) + Power(x1,3)*y6)) + Power(x4,3)* (x1*x6*(Power(x1,4) - Power(x6,4))*y5 + Power(x5,5)*(-(x6*y1) + x1*y6) + x5*(Power(x6,5)*y1 - Power(x1,5)*y6)) + x4*(Power(x1,3)*Power(x6,3)* (-Power(x1,2) + Power(x6,2))*y5 + Power(x5,5)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,5)*y1) + Power(x1,5)*y6))) + x3*(-(Power(x1,3)*(x1 - x5)*Power(x5,3)* (x1 - x6)*(x5 - x6)*Power(x6,3)*y4) + Power(x4,5)* (Power(x1,3)*Power(x6,3)*(-x1 + x6)*y5 + Power(x5,4)* (Power(x6,3)*y1 - Power(x1,3)*y6) + Power(x5,3)* (-(Power(x6,4)*y1) + Power(x1,4)*y6)) + Power(x4,4)* (Power(x1,3)*Power(x6,3)* (Power(x1,2) - Power(x6,2))*y5 + Power(x5,5)* (-(Power(x6,3)*y1) + Power(x1,3)*y6) + Power(x5,3)* (Power(x6,5)*y1 - Power(x1,5)*y6)) + Power(x4,3)* (Power(x1,4)*Power(x6,4)*(-x1 + x6)*y5 + Power(x5,5)* (Power(x6,4)*y1 - Power(x1,4)*y6) + Power(x5,4)* (-(Power(x6,5)*y1) + Power(x1,5)*y6)))))/((x1 - x2)*(x1 - x3)*(-x2 + x3)*(x1 - x4)* (-x2 + x4)*(-x3 + x4)*(x1 - x5)*(x2 - x5)* (x3 - x5)*(x4 - x5)*(x1 - x6)*(x2 - x6)* (x3 - x6)*(x4 - x6)*(x5 - x6))
+
+def multivariate_extrap(ys, xs, tol=0.1):
+    """
+    Extrapolate to x = 0 from results with a separate x for each population.
+
+    ys: y values. Note that these can be arrays of values.
+    xs: Sequence of x tuples, one for each y value, holding the x value for
+        each population.
+    tol: Spacings that are nearly collinear across the results, as they are
+         when the grid shapes are scaled together, can't be separated by a fit.
+         Spacings whose normalized residual against the constant and the
+         previous spacings is less than tol are taken to depend on them.
+
+    If only one independent spacing remains, the results form a one-parameter
+    family, and the extrapolation is by a polynomial through all the results
+    in the geometric mean of the spacings, as for a single grid. Otherwise the
+    results are fit by monomials in the independent spacings of increasing
+    degree, with the extrapolation as the constant term.
+
+    Returns extrapolated y at x=0.
+    """
+    xs = numpy.asarray(xs, dtype=float)
+    nres, ndim = xs.shape
+
+    # Gram-Schmidt on the normalized spacings, to find the independent ones.
+    basis = [numpy.ones(nres)/numpy.sqrt(nres)]
+    indep = []
+    for dd in range(ndim):
+        col = xs[:,dd]/numpy.sqrt(numpy.sum(xs[:,dd]**2))
+        resid = col - sum(numpy.dot(col, vec)*vec for vec in basis)
+        norm = numpy.sqrt(numpy.sum(resid**2))
+        if norm > tol:
+            basis.append(resid/norm)
+            indep.append(dd)
+    if not indep:
+        raise ValueError('Extrapolation requires results with differing '
+                         'grid spacings.')
+
+    if len(indep) == 1:
+        xx = numpy.exp(numpy.mean(numpy.log(xs), axis=1))
+        # Lagrange basis polynomials evaluated at x = 0.
+        weights = [numpy.prod([xx[jj]/(xx[jj]-xx[kk]) for jj in range(nres)
+                               if jj != kk])
+                   for kk in range(nres)]
+    else:
+        hh = xs[:,indep]/xs[:,indep].max(axis=0)
+        terms = [numpy.ones(nres)]
+        degree = 0
+        while len(terms) < nres and degree < nres:
+            degree += 1
+            for powers in _monomial_powers(len(indep), degree):
+                if len(terms) == nres:
+                    break
+                col = numpy.prod(hh**powers, axis=1)
+                # Skip monomials that are degenerate on these results.
+                A = numpy.transpose(terms)
+                coeffs = numpy.linalg.lstsq(A, col)[0]
+                resid = col - numpy.dot(A, coeffs)
+                if numpy.sqrt(numpy.sum(resid**2)) \
+                   > 1e-8*numpy.sqrt(numpy.sum(col**2)):
+                    terms.append(col)
+        weights = numpy.linalg.pinv(numpy.transpose(terms))[0]
+
+    return sum(w*y for w, y in zip(weights, ys))
+
+def _monomial_powers(nvars, degree):
+    """
+    All tuples of nvars non-negative powers that sum to degree.
+    """
+    if nvars == 1:
+        return [(degree,)]
+    return [(first,) + rest for first in range(degree, -1, -1)
+            for rest in _monomial_powers(nvars-1, degree-first)]
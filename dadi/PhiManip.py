@@ -2,12 +2,72 @@
 Manipulating population frequency spectra phi. e.g. population splittings and
 admixture
 """
+import collections
+import threading
+
 import numpy
 from numpy import newaxis as nuax
-import scipy.integrate
 
 from dadi import Numerics
 
+#: Number of equilibrium profiles with dominance cached by phi_1D and
+#: phi_1D_X. See _dominance_profile.
+dominance_cache_size = 100
+_dominance_profiles = collections.OrderedDict()
+_dominance_lock = threading.Lock()
+
+def _dominance_profile(xx, a, b):
+    """
+    Profile of the equilibrium phi with dominance, and its normalization.
+
+    Returns exp(a*x + b*x**2) * I(x)/I(0) for each x in xx, where I(x) is the
+    integral of exp(-a*xi - b*xi**2) from x to 1, along with log(I(0)).
+
+    The integrals are computed together for all x, by Gauss-Legendre
+    quadrature on the intervals of the grid, subdivided so that the integrand
+    changes by a bounded factor over each. They are then summed from the
+    right in logs, so that they can't overflow. Results are cached, keyed on
+    xx, a, and b.
+    """
+    xx = numpy.asarray(xx, dtype=float)
+    key = (xx.tostring(), a, b)
+    with _dominance_lock:
+        cached = _dominance_profiles.get(key)
+    if cached is not None:
+        return cached
+
+    g = lambda x: a*x + b*x**2
+    edges = numpy.unique(numpy.concatenate(([0.], xx, [1.])))
+    widths = numpy.diff(edges)
+    # Over each piece, g changes by at most 16, for which 16-point
+    # Gauss-Legendre quadrature is accurate to well below double precision.
+    rate = abs(a) + 2*abs(b)
+    pieces = numpy.maximum(numpy.ceil(rate*widths/16.), 1).astype(int)
+    first = numpy.cumsum(pieces) - pieces
+    lengths = numpy.repeat(widths/pieces, pieces)
+    lefts = numpy.repeat(edges[:-1], pieces)\
+            + (numpy.arange(pieces.sum()) - numpy.repeat(first, pieces))*lengths
+
+    nodes, weights = numpy.polynomial.legendre.leggauss(16)
+    xi = lefts[:,nuax] + lengths[:,nuax]*(nodes[nuax,:]+1)/2
+    # Integrals over each piece, scaled by exp(g) at its left end.
+    pieces_int = lengths/2 * numpy.dot(numpy.exp(g(lefts)[:,nuax] - g(xi)),
+                                       weights)
+    log_ints = numpy.logaddexp.accumulate((numpy.log(pieces_int)
+                                           - g(lefts))[::-1])[::-1]
+    # The integral from 1 is zero.
+    log_ints = numpy.concatenate((log_ints[first], [-numpy.inf]))
+    log_int0 = log_ints[0]
+
+    log_ints = log_ints[numpy.searchsorted(edges, xx)]
+    profile = numpy.exp(g(xx) + log_ints - log_int0)
+
+    with _dominance_lock:
+        _dominance_profiles[key] = profile, log_int0
+        while len(_dominance_profiles) > dominance_cache_size:
+            _dominance_profiles.popitem(last=False)
+    return profile, log_int0
+
 def phi_1D(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, theta=None, beta=1):
     """
     One-dimensional phi for a constant-sized population with genic selection.
@@ -43,16 +103,10 @@ def phi_1D(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, theta=None, beta=1):
     # and rescaling the final phi.
     gamma = gamma * 4.*beta/(beta+1.)**2
 
-    # First we evaluate the relevant integrals.
-    ints = numpy.empty(len(xx))
-    integrand = lambda xi: numpy.exp(-4*gamma*h*xi - 2*gamma*(1-2*h)*xi**2)
-    val, eps = scipy.integrate.quad(integrand, 0, 1)
-    int0 = val
-    for ii,q in enumerate(xx):
-        val, eps = scipy.integrate.quad(integrand, q, 1)
-        ints[ii] = val
-
-    phi = numpy.exp(4*gamma*h*xx + 2*gamma*(1-2*h)*xx**2)*ints/int0
+    # The integrand of the relevant integrals is
+    # exp(-4*gamma*h*xi - 2*gamma*(1-2*h)*xi**2).
+    profile, log_int0 = _dominance_profile(xx, 4*gamma*h, 2*gamma*(1-2*h))
+    phi = profile.copy()
     # Protect from division by zero errors
     if xx[0] == 0 and xx[-1] == 1:
         phi[1:-1] *= 1./(xx[1:-1]*(1-xx[1:-1]))
@@ -65,7 +119,7 @@ def phi_1D(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, theta=None, beta=1):
         phi[0] = phi[1]
     if xx[-1] == 1:
         # I used Mathematica to check that this was the proper limit.
-        phi[-1] = 1./int0
+        phi[-1] = numpy.exp(-log_int0)
     return phi * nu*theta0 * 4.*beta/(beta+1.)**2
 
 def phi_1D_genic(xx, nu=1.0, theta0=1.0, gamma=0, theta=None, beta=1):
@@ -161,12 +215,23 @@ def phi_1D_to_2D(xx, phi_1D):
     """
     Implement a one-to-two population split.
 
-    xx: one-dimensional grid of frequencies upon which phi is defined
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of the grids for the two new populations, the first of which
+        phi1D is defined upon.
     phi1D: initial probability density
 
     Returns a new two-dimensional phi array.
     """
+    xx, yy = Numerics.expand_grids(xx, 2)
     check_xx(xx)
+    check_xx(yy)
+
+    if len(yy) != len(xx) or numpy.any(yy != xx):
+        # Each point maps onto the points of yy bracketing it, as in an
+        # admixture. As below, the boundaries of xx get nothing.
+        phi_2D = _phi_split_admix(phi_1D, [], [xx], yy)
+        phi_2D[0] = phi_2D[-1] = 0
+        return phi_2D
 
     pts = len(xx)
     phi_2D = numpy.zeros((pts, pts))
@@ -178,27 +243,33 @@ def phi_2D_to_3D_split_2(xx, phi_2D):
     """
     Split population 2 into populations 2 and 3.
 
-    xx: one-dimensional grid of frequencies upon which phi is defined
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
     phi2D: initial probability density
 
     Returns a new three-dimensional phi array.
     """
-    check_xx(xx)
+    grids = Numerics.expand_grids(xx, 3)
+    for grid in grids:
+        check_xx(grid)
 
-    return phi_2D_to_3D_admix(phi_2D,0,xx,xx,xx)
+    return phi_2D_to_3D_admix(phi_2D,0,*grids)
 
 def phi_2D_to_3D_split_1(xx, phi_2D):
     """
     Split population 1 into populations 1 and 3.
 
-    xx: one-dimensional grid of frequencies upon which phi is defined
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
     phi2D: initial probability density
 
     Returns a new three-dimensional phi array.
     """
-    check_xx(xx)
+    grids = Numerics.expand_grids(xx, 3)
+    for grid in grids:
+        check_xx(grid)
 
-    return phi_2D_to_3D_admix(phi_2D,1,xx,xx,xx)
+    return phi_2D_to_3D_admix(phi_2D,1,*grids)
 
 def _admixture_intermediates(phi, ad_z, zz):
     # Find where those z values map to in the zz array.
@@ -448,6 +519,245 @@ def phi_3D_admix_2_and_3_into_1(phi, f2,f3, xx,yy,zz):
 
     return phi
 
+def _many_pop_admixture_intermediates(phi, fs, xxs, ww):
+    """
+    Intermediate results used when splitting a new population out from phi of
+    any dimension.
+
+    fs: Fractions of the new population derived from each population in phi.
+        A fraction 1-sum(fs) is derived from the last population, so fs has
+        one fewer entry than phi has dimensions.
+    xxs: Frequency mappings for the populations in phi.
+    ww: frequency mapping for the new population.
+    """
+    if sum(fs) > 1:
+        raise ValueError('Admixture proportions (%s) are non-sensible.'
+                         % ', '.join('%f' % f for f in fs))
+    fs = list(fs) + [1-sum(fs)]
+    # For each point in phi, this is the corresponding frequency w that SNPs
+    # with those frequencies in the existing populations would map to.
+    ad_w = numpy.zeros(phi.shape)
+    for axis, (f, xx) in enumerate(zip(fs, xxs)):
+        shape = [1]*phi.ndim
+        shape[axis] = len(xx)
+        ad_w += f*numpy.reshape(xx, shape)
+
+    return _admixture_intermediates(phi, ad_w, ww)
+
+def _phi_split_admix(phi, fs, xxs, ww):
+    """
+    Add a new last axis to phi, for a population admixed from those in phi.
+
+    fs, xxs, ww: As in _many_pop_admixture_intermediates.
+    """
+    lower_w_index, upper_w_index, frac_lower, frac_upper, norm \
+            = _many_pop_admixture_intermediates(phi, fs, xxs, ww)
+
+    # As in phi_2D_to_3D_admix, this uses fancy indexing, now with one index
+    # array for each of the existing axes.
+    idx = numpy.ix_(*[numpy.arange(length) for length in phi.shape])
+    new_phi = numpy.zeros(phi.shape + (len(ww),))
+    new_phi[idx + (lower_w_index,)] = frac_lower*norm
+    new_phi[idx + (upper_w_index,)] += frac_upper*norm
+
+    return new_phi
+
+def phi_3D_to_4D_admix(phi, f1,f2, xx,yy,zz,aa):
+    """
+    Create population 4 admixed from populations 1, 2, and 3.
+
+    Returns a 4D sfs of shape (len(xx),len(yy),len(zz),len(aa))
+
+    phi:      phi corresponding to original 3 populations
+    f1:       Fraction of population 4 derived from population 1.
+    f2:       Fraction of population 4 derived from population 2. A fraction
+              1-f1-f2 will be derived from population 3.
+    xx,yy,zz: Mapping of points in phi to frequencies in populations 1,2 and 3.
+    aa:       Frequency mapping that will be used along population 4 axis.
+    """
+    return _phi_split_admix(phi, [f1,f2], [xx,yy,zz], aa)
+
+def phi_3D_to_4D_split_1(xx, phi_3D):
+    """
+    Split population 1 into populations 1 and 4.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi3D: initial probability density
+
+    Returns a new four-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 4)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_3D_to_4D_admix(phi_3D,1,0,*grids)
+
+def phi_3D_to_4D_split_2(xx, phi_3D):
+    """
+    Split population 2 into populations 2 and 4.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi3D: initial probability density
+
+    Returns a new four-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 4)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_3D_to_4D_admix(phi_3D,0,1,*grids)
+
+def phi_3D_to_4D_split_3(xx, phi_3D):
+    """
+    Split population 3 into populations 3 and 4.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi3D: initial probability density
+
+    Returns a new four-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 4)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_3D_to_4D_admix(phi_3D,0,0,*grids)
+
+def phi_4D_to_5D_admix(phi, f1,f2,f3, xx,yy,zz,aa,bb):
+    """
+    Create population 5 admixed from populations 1, 2, 3, and 4.
+
+    Returns a 5D sfs of shape (len(xx),len(yy),len(zz),len(aa),len(bb))
+
+    phi:         phi corresponding to original 4 populations
+    f1:          Fraction of population 5 derived from population 1.
+    f2:          Fraction of population 5 derived from population 2.
+    f3:          Fraction of population 5 derived from population 3. A 
+                 fraction 1-f1-f2-f3 will be derived from population 4.
+    xx,yy,zz,aa: Mapping of points in phi to frequencies in populations 1,2,3
+                 and 4.
+    bb:          Frequency mapping that will be used along population 5 axis.
+    """
+    return _phi_split_admix(phi, [f1,f2,f3], [xx,yy,zz,aa], bb)
+
+def phi_4D_to_5D_split_1(xx, phi_4D):
+    """
+    Split population 1 into populations 1 and 5.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi4D: initial probability density
+
+    Returns a new five-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 5)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_4D_to_5D_admix(phi_4D,1,0,0,*grids)
+
+def phi_4D_to_5D_split_2(xx, phi_4D):
+    """
+    Split population 2 into populations 2 and 5.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi4D: initial probability density
+
+    Returns a new five-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 5)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_4D_to_5D_admix(phi_4D,0,1,0,*grids)
+
+def phi_4D_to_5D_split_3(xx, phi_4D):
+    """
+    Split population 3 into populations 3 and 5.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi4D: initial probability density
+
+    Returns a new five-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 5)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_4D_to_5D_admix(phi_4D,0,0,1,*grids)
+
+def phi_4D_to_5D_split_4(xx, phi_4D):
+    """
+    Split population 4 into populations 4 and 5.
+
+    xx: one-dimensional grid of frequencies upon which phi is defined, or a
+        sequence of grids, one for each population after the split.
+    phi4D: initial probability density
+
+    Returns a new five-dimensional phi array.
+    """
+    grids = Numerics.expand_grids(xx, 5)
+    for grid in grids:
+        check_xx(grid)
+
+    return phi_4D_to_5D_admix(phi_4D,0,0,0,*grids)
+
+def phi_admix_into(phi, popnum, fs, xxs):
+    """
+    Admix the other populations into population popnum, for phi of any 
+    dimension.
+
+    Alters phi in place and returns the new version.
+
+    phi:    phi corresponding to original populations.
+    popnum: Population number to admix into, numbering from 1.
+    fs:     Fractions of the updated population popnum to be derived from each
+            population. The entry for popnum itself is ignored, and a 
+            fraction 1-sum(others) will be derived from the original 
+            population popnum.
+    xxs:    Mapping of points in phi to frequencies in each population.
+    """
+    axis = popnum-1
+    # The fractions are rearranged to put population popnum last, as
+    # _many_pop_admixture_intermediates expects.
+    others = [ii for ii in range(phi.ndim) if ii != axis]
+    order = others + [axis]
+    phi_T = numpy.transpose(phi, order)
+    ww = xxs[axis]
+    lower_w_index, upper_w_index, frac_lower, frac_upper, norm \
+            = _many_pop_admixture_intermediates(phi_T,
+                                                [fs[ii] for ii in others],
+                                                [xxs[ii] for ii in order], ww)
+
+    # As in phi_3D_admix_1_and_2_into_3, this is a split into a new
+    # population, followed by integrating out the original population with
+    # the trapezoid rule. Rather than building each slice of the split, the
+    # contributions are weighted by the trapezoid rule and summed directly
+    # into their destinations.
+    weights = numpy.zeros(len(ww))
+    weights[:-1] += numpy.diff(ww)/2
+    weights[1:] += numpy.diff(ww)/2
+
+    # Flat indices into phi_T of each point, and of the points it is
+    # assigned to along the last axis.
+    n = len(ww)
+    flat = numpy.arange(phi_T.size).reshape(phi_T.shape)
+    start = flat - numpy.arange(n)
+    new_phi = numpy.bincount((start + lower_w_index).ravel(),
+                             (weights*frac_lower*norm).ravel(),
+                             minlength=phi_T.size)
+    new_phi += numpy.bincount((start + upper_w_index).ravel(),
+                              (weights*frac_upper*norm).ravel(),
+                              minlength=phi_T.size)
+
+    phi[...] = numpy.transpose(new_phi.reshape(phi_T.shape),
+                               numpy.argsort(order))
+    return phi
+
 def remove_pop(phi, xx, popnum):
     """
     Remove a population from phi.
@@ -460,6 +770,69 @@ def remove_pop(phi, xx, popnum):
     """
     return Numerics.trapz(phi, xx, axis=popnum-1)
 
+def phi_regrid(xx, phi, new_xx):
+    """
+    Interpolate phi onto new grids, such as finer grids for later epochs.
+
+    xx: Grid phi is defined upon, or a sequence of grids, one for each
+        population.
+    phi: Population frequency distribution.
+    new_xx: Grid to interpolate phi onto, or a sequence of grids, one for
+            each population. These must also be from 0 to 1.
+
+    Returns a new phi array.
+
+    Along each population, phi diverges like 1/x near x=0, so
+    q = x*(1-x)*phi is interpolated instead, linearly. At the boundaries, q
+    is extrapolated from the neighboring points. Each line of the result is
+    then scaled to keep its integral of q, the mass of polymorphic sites
+    weighted by their heterozygosity. The total of phi itself is not kept,
+    because the trapezoid rule approximates the divergence differently on
+    each grid. The values of phi at 0 and 1 along a population hold the sites
+    lost or fixed in it, as densities over the other populations. Along the
+    other populations they are interpolated like any line. Along this one
+    they are scaled by the ratio of the old and new spacings at that
+    boundary, which keeps the mass the trapezoid rule gives them. Along
+    populations whose grid is unchanged, phi is left as it is.
+
+    Early epochs of a model can thus be integrated on a coarse grid, with
+    the fine grid used only for the recent epochs. It is best to regrid
+    before splits, or well after them, rather than just after, when phi is
+    concentrated along the diagonal. For extrapolation, the coarse grid must
+    refine along with the fine one, as from Numerics.coarse_pts.
+    """
+    grids = Numerics.expand_grids(xx, phi.ndim)
+    new_grids = Numerics.expand_grids(new_xx, phi.ndim)
+    for grid in grids + new_grids:
+        check_xx(grid)
+
+    for axis, (xx, new_xx) in enumerate(zip(grids, new_grids)):
+        if numpy.array_equal(xx, new_xx):
+            continue
+        # With this population's axis first, the lines of phi along it are
+        # interpolated at once.
+        arr = numpy.rollaxis(phi, axis)
+        upslice = (slice(None),) + (nuax,)*(phi.ndim-1)
+        q = (xx*(1-xx))[upslice] * arr
+        mass = Numerics.trapz(q, xx, axis=0)
+        q[0] = q[1] + (q[1]-q[2])*(xx[1]-xx[0])/(xx[2]-xx[1])
+        q[-1] = q[-2] + (q[-2]-q[-3])*(xx[-1]-xx[-2])/(xx[-2]-xx[-3])
+
+        interp = numpy.array([numpy.interp(new_xx, xx, col)
+                              for col in numpy.eye(len(xx))]).T
+        new_q = numpy.tensordot(interp, q, axes=([1],[0]))
+        new_q[0] = new_q[-1] = 0
+        new_mass = Numerics.trapz(new_q, new_xx, axis=0)
+        new_q *= numpy.where(new_mass > 0, mass, 1)\
+                / numpy.where(new_mass > 0, new_mass, 1)
+
+        new_arr = numpy.empty(new_q.shape)
+        new_arr[1:-1] = new_q[1:-1]/(new_xx*(1-new_xx))[1:-1][upslice]
+        new_arr[0] = arr[0] * (xx[1]-xx[0])/(new_xx[1]-new_xx[0])
+        new_arr[-1] = arr[-1] * (xx[-1]-xx[-2])/(new_xx[-1]-new_xx[-2])
+        phi = numpy.rollaxis(new_arr, 0, axis+1)
+    return phi
+
 def phi_1D_X(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, beta=1, alpha=1):
     """
     One-dimensional phi for a constant-sized population with genic selection.
@@ -483,16 +856,9 @@ def phi_1D_X(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, beta=1, alpha=1):
     g1 = Km1/Kv
     g2 = Km2/Kv
 
-    # First we evaluate the relevant integrals.
-    ints = numpy.empty(len(xx))
-    integrand = lambda xi: numpy.exp(-2*g1*xi - g2*xi**2)
-    val, eps = scipy.integrate.quad(integrand, 0, 1)
-    int0 = val
-    for ii,q in enumerate(xx):
-        val, eps = scipy.integrate.quad(integrand, q, 1)
-        ints[ii] = val
-
-    phi = numpy.exp(2*g1*xx + g2*xx**2)*ints/int0
+    # The integrand of the relevant integrals is exp(-2*g1*xi - g2*xi**2).
+    profile, log_int0 = _dominance_profile(xx, 2*g1, g2)
+    phi = profile.copy()
     # Protect from division by zero errors
     if xx[0] == 0 and xx[-1] == 1:
         phi[1:-1] *= 1./(xx[1:-1]*(1-xx[1:-1]))
@@ -505,5 +871,5 @@ def phi_1D_X(xx, nu=1.0, theta0=1.0, gamma=0, h=0.5, beta=1, alpha=1):
         phi[0] = phi[1]
     if xx[-1] == 1:
         # I used Mathematica to check that this was the proper limit.
-        phi[-1] = 1./int0
+        phi[-1] = numpy.exp(-log_int0)
     return phi * nu*theta0 * 1./Kv * 2./(1.+2.*beta)*(1./(1.+alpha) + beta)
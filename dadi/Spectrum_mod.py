@@ -16,7 +16,7 @@ try:
 except ImportError:
     from scipy import comb
 from scipy.integrate import trapz
-from scipy.special import betainc
+from scipy.special import betainc, betaln
 
 import dadi.Numerics
 from dadi.Numerics import reverse_array, _cached_projection, _lncomb
@@ -51,7 +51,8 @@ class Spectrum(numpy.ma.masked_array):
                        Spectrum. If they are not, a warning will be printed.
         pop_ids: Optional list of strings containing the population labels.
         extrap_x: Optional floating point value specifying x value to use
-                  for extrapolation.
+                  for extrapolation, or a tuple of x values, one for each
+                  population.
     """
     def __new__(subtype, data, mask=numpy.ma.nomask, mask_corners=True, 
                 data_folded=None, check_folding=True, dtype=float, copy=True, 
@@ -1171,7 +1172,7 @@ class Spectrum(numpy.ma.masked_array):
             factorx = comb(nx, ii) * xx**ii * (1-xx)**(nx-ii)
             if het_ascertained == 'xx':
                 factorx *= xx*(1-xx)
-                factorx_cache[nx,ii] = factorx
+            factorx_cache[nx,ii] = factorx
 
         dx, dy = numpy.diff(xx), numpy.diff(yy)
         for jj in range(0,ny+1):
@@ -1409,11 +1410,150 @@ class Spectrum(numpy.ma.masked_array):
         fs = dadi.Spectrum(data, mask_corners=mask_corners)
         return fs
 
+    @staticmethod
+    def _from_phi_weights_analytic(n, xx):
+        """
+        Matrix of weights that maps phi along the grid xx to sample counts.
+
+        Entry [d,i] is the weight of phi[i] in the integral for d derived
+        alleles, using the analytic integration over a piecewise-linear
+        phi of _from_phi_1D_analytic.
+        """
+        xx = numpy.minimum(numpy.maximum(xx, 0), 1.0)
+        dd = numpy.arange(n+1)[:,nuax]
+        del1 = numpy.diff(betainc(dd+1,n-dd+1,xx[nuax,:]), axis=1)
+        del2 = numpy.diff(betainc(dd+2,n-dd+1,xx[nuax,:]), axis=1)
+        # Over each interval, c1 and c2 of _from_phi_1D_analytic are linear
+        # in the values of phi at its ends. The slope s contributes g/dx
+        # times the difference of those values.
+        g = ((dd+1)*del2/((n+1)*(n+2)) - xx[nuax,:-1]*del1/(n+1))\
+                / numpy.diff(xx)[nuax,:]
+        weights = numpy.zeros((n+1, len(xx)))
+        weights[:,:-1] += del1/(n+1) - g
+        weights[:,1:] += g
+        return weights
+
+    @staticmethod
+    def _from_phi_weights_fitted(n, xx):
+        """
+        Matrix of weights that maps phi along the grid xx to sample counts,
+        for phi from integrations with Integration.use_fitted_fluxes.
+
+        For the polymorphic entries, q = x*(1-x)*phi is interpolated rather
+        than phi. q is smooth where phi diverges, at the boundaries, so the
+        interpolation is piecewise quadratic: linear over each interval plus
+        (x-x_i)*(x-x_{i+1}) times the average of the second divided
+        differences of q at the ends of the interval. The values of q at the
+        boundaries are extrapolated linearly from the neighboring points. The
+        monomorphic entries use _from_phi_weights_analytic.
+        """
+        xx = numpy.minimum(numpy.maximum(xx, 0), 1.0)
+        weights = Spectrum._from_phi_weights_analytic(n, xx)
+        if n < 2 or len(xx) < 3:
+            return weights
+        dx = numpy.diff(xx)
+
+        # The moments of x**k times the sampling weight of d derived alleles,
+        # over each interval, with the sampling weight divided by x*(1-x).
+        dd = numpy.arange(1, n)[:,nuax]
+        moments = []
+        for k in range(3):
+            scale = numpy.exp(_lncomb(n, dd) + betaln(dd+k, n-dd))
+            moments.append(scale*numpy.diff(betainc(dd+k, n-dd,
+                                                    xx[nuax,:]), axis=1))
+        I0, I1, I2 = moments
+
+        # Weights of the values of q, from the linear part...
+        wq = numpy.zeros((n-1, len(xx)))
+        wq[:,:-1] += (xx[1:]*I0 - I1)/dx
+        wq[:,1:] += (I1 - xx[:-1]*I0)/dx
+        # ... and from the quadratic part. The end intervals only have one
+        # interior point, so they take its second difference alone.
+        J = I2 - (xx[:-1] + xx[1:])*I1 + xx[:-1]*xx[1:]*I0
+        J[:,1:-1] *= 0.5
+        K = J[:,:-1] + J[:,1:]
+        h0, h1 = dx[:-1], dx[1:]
+        wq[:,:-2] += K/(h0*(h0+h1))
+        wq[:,1:-1] -= K/(h0*h1)
+        wq[:,2:] += K/(h1*(h0+h1))
+
+        # Map the values of q to phi, including the extrapolation to the
+        # boundaries.
+        qq = xx*(1-xx)
+        w = wq*qq
+        w[:,1] += wq[:,0]*qq[1]*(xx[2]-xx[0])/(xx[2]-xx[1])
+        w[:,2] -= wq[:,0]*qq[2]*(xx[1]-xx[0])/(xx[2]-xx[1])
+        w[:,-2] += wq[:,-1]*qq[-2]*(xx[-1]-xx[-3])/(xx[-2]-xx[-3])
+        w[:,-3] -= wq[:,-1]*qq[-3]*(xx[-1]-xx[-2])/(xx[-2]-xx[-3])
+        weights[1:-1] = w
+        return weights
+
+    @staticmethod
+    def _from_phi_weights_direct(n, xx, het_ascertained=False):
+        """
+        Matrix of weights that maps phi along the grid xx to sample counts,
+        using the trapezoid rule as in _from_phi_1D_direct.
+
+        het_ascertained: If True, the SNPs were ascertained by heterozygosity
+                         in this population.
+        """
+        dd = numpy.arange(n+1)[:,nuax]
+        factors = comb(n,dd) * xx[nuax,:]**dd * (1-xx[nuax,:])**(n-dd)
+        if het_ascertained:
+            factors *= xx*(1-xx)
+        dx = numpy.diff(xx)
+        trapz_weights = numpy.zeros(len(xx))
+        trapz_weights[:-1] += dx/2
+        trapz_weights[1:] += dx/2
+        return factors*trapz_weights
+
+    @staticmethod
+    def _from_phi_ND(ns, xxs, phi, mask_corners=True, het_ascertained=None,
+                     force_direct=False, fitted=False):
+        """
+        Compute sample Spectrum from population frequency distribution phi of
+        any dimension.
+
+        Sampling is independent between populations, so the integral is a
+        sequence of contractions of phi with the weight matrix of each
+        population in turn. Only the partial results are stored, never
+        weights over the whole grid.
+
+        See from_phi for explanation of arguments.
+        """
+        data = Spectrum._from_phi_contract(ns, xxs, phi, het_ascertained,
+                                           force_direct, fitted)
+        return Spectrum(data, mask_corners=mask_corners)
+
+    @staticmethod
+    def _from_phi_contract(ns, xxs, phi, het_ascertained=None,
+                           force_direct=False, fitted=False):
+        """
+        Array of the sample counts from phi, whose last len(ns) axes are the
+        population axes.
+
+        Any leading axes of phi, such as a batch axis, are kept in front.
+        """
+        het_axes = {'xx':0, 'yy':1, 'zz':2}
+        first = phi.ndim - len(ns)
+        data = phi
+        for axis, (n, xx) in enumerate(zip(ns, xxs)):
+            if het_ascertained or force_direct:
+                weights = Spectrum._from_phi_weights_direct(
+                        n, xx, het_axes.get(het_ascertained) == axis)
+            elif fitted:
+                weights = Spectrum._from_phi_weights_fitted(n, xx)
+            else:
+                weights = Spectrum._from_phi_weights_analytic(n, xx)
+            # Each contraction removes the first population axis and appends
+            # its sample axis, so the original order is restored at the end.
+            data = numpy.tensordot(data, weights, axes=([first],[1]))
+        return data
 
     @staticmethod
     def from_phi(phi, ns, xxs, mask_corners=True, 
                  pop_ids=None, admix_props=None, het_ascertained=None, 
-                 force_direct=False):
+                 force_direct=False, fitted=None):
         """
         Compute sample Spectrum from population frequency distribution phi.
 
@@ -1447,6 +1587,10 @@ class Spectrum(numpy.ma.masked_array):
         force_direct: Forces integration to use older direct integration method,
                       rather than using analytic integration of sampling 
                       formula.
+        fitted: If True, phi is sampled to higher order, to match the
+                accuracy of integrations with fitted fluxes. If None, this
+                follows dadi.Integration.use_fitted_fluxes. This does not
+                apply with admix_props, het_ascertained, or force_direct.
         """
         if admix_props and not numpy.allclose(numpy.sum(admix_props, axis=1),1):
             raise ValueError('Admixture proportions {0} must sum to 1 for all '
@@ -1466,7 +1610,13 @@ class Spectrum(numpy.ma.masked_array):
             both options simultaneously in the future."""
             raise NotImplementedError(error)
 
-        if phi.ndim == 1:
+        if fitted is None:
+            fitted = dadi.Integration.use_fitted_fluxes
+        fitted = fitted and not het_ascertained and not admix_props\
+                and not force_direct
+        if fitted:
+            fs = Spectrum._from_phi_ND(ns, xxs, phi, mask_corners, fitted=True)
+        elif phi.ndim == 1:
             if not het_ascertained and not force_direct:
                 fs = Spectrum._from_phi_1D_analytic(ns[0], xxs[0], phi,
                                                     mask_corners)
@@ -1502,19 +1652,56 @@ class Spectrum(numpy.ma.masked_array):
                                                        xxs[0], xxs[1], xxs[2], 
                                                        phi, mask_corners, 
                                                        admix_props)
+        elif not admix_props:
+            fs = Spectrum._from_phi_ND(ns, xxs, phi, mask_corners,
+                                       het_ascertained, force_direct)
         else:
-            raise ValueError('Only implemented for dimensions 1,2 or 3.')
+            raise NotImplementedError('admix_props is only implemented for '
+                                      'dimensions 2 or 3.')
         fs.pop_ids = pop_ids
         # Record value to use for extrapolation. This is the first grid point,
-        # which is where new mutations are introduced. Note that extrapolation
-        # will likely fail if grids differ between dimensions.
+        # which is where new mutations are introduced. If the grids differ
+        # between dimensions, the first grid point of each is recorded, for
+        # extrapolation with Numerics.multivariate_extrap.
         fs.extrap_x = xxs[0][1]
-        for xx in xxs[1:]:
-            if not xx[1] == fs.extrap_x:
-                logger.warn('Spectrum calculated from phi different grids for '
-                            'different dimensions. Extrapolation may fail.')
+        if any(xx[1] != fs.extrap_x for xx in xxs[1:]):
+            fs.extrap_x = tuple(xx[1] for xx in xxs)
         return fs
 
+    @staticmethod
+    def from_phi_batch(phis, ns, xxs, mask_corners=True, pop_ids=None,
+                       het_ascertained=None, force_direct=False, fitted=None):
+        """
+        Compute sample Spectra from a batch of population frequency
+        distributions, such as those from Integration.two_pops_batch.
+
+        phis: Population frequency distributions, stacked along the first
+              axis.
+
+        The sampling weights are computed once for the whole batch, and each
+        population's axis is contracted for all the members at once. This is
+        equivalent to calling from_phi on each member. See from_phi for
+        explanation of the other arguments. admix_props is not supported.
+
+        Returns a list of Spectra, one for each member of the batch.
+        """
+        if not phis.ndim - 1 == len(ns) == len(xxs):
+            raise ValueError('Dimensionality of phis, less the batch axis, '
+                             'and lengths of ns and xxs do not all agree.')
+        if het_ascertained and not het_ascertained in ['xx','yy','zz']:
+            raise ValueError("If used, het_ascertained must be 'xx', 'yy', or "
+                             "'zz'.")
+
+        if fitted is None:
+            fitted = dadi.Integration.use_fitted_fluxes
+        data = Spectrum._from_phi_contract(ns, xxs, phis, het_ascertained,
+                                           force_direct, fitted)
+        extrap_x = xxs[0][1]
+        if any(xx[1] != extrap_x for xx in xxs[1:]):
+            extrap_x = tuple(xx[1] for xx in xxs)
+        return [Spectrum(member, mask_corners=mask_corners, pop_ids=pop_ids,
+                         extrap_x=extrap_x) for member in data]
+
     def scramble_pop_ids(self, mask_corners=True):
         """
         Spectrum corresponding to scrambling individuals among populations.
@@ -4,19 +4,18 @@
 #include <stdio.h>
 #include <stdlib.h>
 
-void implicit_1Dx(double *phi, double *xx,
-        double nu, double gamma, double h, double beta, double dt, int L, 
-        int use_delj_trick){
+static void implicit_1D_MV(double *phi, double *xx, double nu, double dt,
+        int L, int use_delj_trick, double Mfirst, double Mlast, double *MInt,
+        double *V, double *VInt){
+    /*
+    Implicit step for phi, given the values of M and V on the grid xx. Mfirst
+    and Mlast are M at the ends of the grid, MInt and VInt its values
+    between grid points.
+    */
     int ii;
     
     double *dx = malloc((L-1) * sizeof(*dx));
     double *dfactor = malloc(L * sizeof(*dfactor));
-    double *xInt = malloc((L-1) * sizeof(*xInt));
-
-    double Mfirst, Mlast;
-    double *MInt = malloc((L-1) * sizeof(*MInt));
-    double *V = malloc(L * sizeof(*V));
-    double *VInt = malloc((L-1) * sizeof(*VInt));
 
     double *delj = malloc((L-1) * sizeof(*delj));
 
@@ -27,18 +26,8 @@ void implicit_1Dx(double *phi, double *xx,
 
     compute_dx(xx, L, dx);
     compute_dfactor(dx, L, dfactor);
-    compute_xInt(xx, L, xInt);
 
-    Mfirst = Mfunc1D(xx[0], gamma, h);
-    Mlast = Mfunc1D(xx[L-1], gamma, h);
-    for(ii=0; ii < L; ii++)
-        V[ii] = Vfunc_beta(xx[ii], nu, beta);
-    for(ii=0; ii < L-1; ii++){
-        MInt[ii] = Mfunc1D(xInt[ii], gamma, h);
-        VInt[ii] = Vfunc_beta(xInt[ii], nu, beta);
-    }
-
-    compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
+    compute_delj(dx, MInt, VInt, V, L, delj, use_delj_trick);
 
     compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
     for(ii = 0; ii < L; ii++)
@@ -54,13 +43,121 @@ void implicit_1Dx(double *phi, double *xx,
 
     free(dx);
     free(dfactor);
-    free(xInt);
-    free(MInt);
-    free(V);
-    free(VInt);
     free(delj);
     free(a);
     free(b);
     free(c);
     free(r);
 }
+
+void implicit_1Dx(double *phi, double *xx,
+        double nu, double gamma, double h, double beta, double dt, int L, 
+        int use_delj_trick){
+    int ii;
+    
+    double *xInt = malloc((L-1) * sizeof(*xInt));
+
+    double Mfirst, Mlast;
+    double *MInt = malloc((L-1) * sizeof(*MInt));
+    double *V = malloc(L * sizeof(*V));
+    double *VInt = malloc((L-1) * sizeof(*VInt));
+
+    compute_xInt(xx, L, xInt);
+
+    Mfirst = Mfunc1D(xx[0], gamma, h);
+    Mlast = Mfunc1D(xx[L-1], gamma, h);
+    for(ii=0; ii < L; ii++)
+        V[ii] = Vfunc_beta(xx[ii], nu, beta);
+    for(ii=0; ii < L-1; ii++){
+        MInt[ii] = Mfunc1D(xInt[ii], gamma, h);
+        VInt[ii] = Vfunc_beta(xInt[ii], nu, beta);
+    }
+
+    implicit_1D_MV(phi, xx, nu, dt, L, use_delj_trick, Mfirst, Mlast, MInt,
+            V, VInt);
+
+    free(xInt);
+    free(MInt);
+    free(V);
+    free(VInt);
+}
+
+void implicit_1Dx_X(double *phi, double *xx,
+        double nu, double gamma, double h, double beta, double dt, int L, 
+        int use_delj_trick){
+    /*
+    As implicit_1Dx, for an X chromosome.
+    */
+    int ii;
+    
+    double *xInt = malloc((L-1) * sizeof(*xInt));
+
+    double Mfirst, Mlast;
+    double *MInt = malloc((L-1) * sizeof(*MInt));
+    double *V = malloc(L * sizeof(*V));
+    double *VInt = malloc((L-1) * sizeof(*VInt));
+
+    compute_xInt(xx, L, xInt);
+
+    Mfirst = Mfunc1D_X(xx[0], gamma, h);
+    Mlast = Mfunc1D_X(xx[L-1], gamma, h);
+    for(ii=0; ii < L; ii++)
+        V[ii] = Vfunc_X(xx[ii], nu, beta);
+    for(ii=0; ii < L-1; ii++){
+        MInt[ii] = Mfunc1D_X(xInt[ii], gamma, h);
+        VInt[ii] = Vfunc_X(xInt[ii], nu, beta);
+    }
+
+    implicit_1D_MV(phi, xx, nu, dt, L, use_delj_trick, Mfirst, Mlast, MInt,
+            V, VInt);
+
+    free(xInt);
+    free(MInt);
+    free(V);
+    free(VInt);
+}
+
+/* Integrate phi for nsteps implicit steps of length dt, with the operator
+ * factored by tridiag_factor for that dt. inject is the amount of new
+ * mutations added to phi[1] each step. Doing the whole loop here avoids the
+ * per-step overhead of calling in from Python.
+ */
+void integrate_factored_1D(double *phi, double *a, double *gam, double *ibet,
+        double inject, double dt, int nsteps, int L){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[1] += inject;
+        tridiag_factored_batch(a, gam, ibet, phi, 1/dt, phi, L, 1, 1);
+    }
+}
+
+/* Integrate phi for nsteps implicit steps of lengths dt, with parameters that
+ * change from step to step. nu, gamma, h, and beta are the parameter values
+ * for each step, and inject is the amount of new mutations added to phi[1]
+ * each step.
+ */
+void integrate_1D(double *phi, double *xx, double *nu, double *gamma,
+        double *h, double *beta, double *inject, double *dt, int nsteps,
+        int L, int use_delj_trick){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[1] += inject[step];
+        implicit_1Dx(phi, xx, nu[step], gamma[step], h[step], beta[step],
+                dt[step], L, use_delj_trick);
+    }
+}
+
+/* As integrate_1D, for an X chromosome. */
+void integrate_1D_X(double *phi, double *xx, double *nu, double *gamma,
+        double *h, double *beta, double *inject, double *dt, int nsteps,
+        int L, int use_delj_trick){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[1] += inject[step];
+        implicit_1Dx_X(phi, xx, nu[step], gamma[step], h[step], beta[step],
+                dt[step], L, use_delj_trick);
+    }
+}
@@ -20,6 +20,7 @@ void implicit_2Dx(double *phi, double *xx, double *yy,
         double nu1, double m12, double gamma1, double h1,
         double dt, int L, int M, int use_delj_trick,
         int Mstart, int Mend){
+    double *gam;
     int ii, jj;
 
     double *dx = malloc((L-1) * sizeof(*dx));
@@ -50,7 +51,7 @@ void implicit_2Dx(double *phi, double *xx, double *yy,
     for(ii=0; ii < L-1; ii++)
         VInt[ii] = Vfunc(xInt[ii], nu1);
 
-    tridiag_malloc(L);
+    gam = malloc(L * sizeof(*gam));
     for(jj=Mstart; jj < Mend; jj++){
         y = yy[jj];
 
@@ -59,7 +60,7 @@ void implicit_2Dx(double *phi, double *xx, double *yy,
         for(ii=0; ii < L-1; ii++)
             MInt[ii] = Mfunc2D(xInt[ii], y, m12, gamma1, h1);
 
-        compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
+        compute_delj(dx, MInt, VInt, V, L, delj, use_delj_trick);
         compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
         for(ii = 0; ii < L; ii++)
             r[ii] = phi[ii*M + jj]/dt;
@@ -69,11 +70,11 @@ void implicit_2Dx(double *phi, double *xx, double *yy,
         if((yy[jj]==1) && (Mlast >= 0))
             b[L-1] += -(-0.5/nu1 - Mlast)*2./dx[L-2];
 
-        tridiag_premalloc(a, b, c, r, temp, L);
+        tridiag_premalloc(a, b, c, r, temp, gam, L);
         for(ii = 0; ii < L; ii++)
             phi[ii*M + jj] = temp[ii];
     }
-    tridiag_free();
+    free(gam);
 
     free(dx);
     free(dfactor);
@@ -93,6 +94,7 @@ void implicit_2Dy(double *phi, double *xx, double *yy,
         double nu2, double m21, double gamma2, double h2,
         double dt, int L, int M, int use_delj_trick, 
         int Lstart, int Lend){
+    double *gam;
     int ii, jj;
 
     double *dy = malloc((M-1) * sizeof(*dy));
@@ -123,7 +125,7 @@ void implicit_2Dy(double *phi, double *xx, double *yy,
     for(jj=0; jj < M-1; jj++)
         VInt[jj] = Vfunc(yInt[jj], nu2);
 
-    tridiag_malloc(M);
+    gam = malloc(M * sizeof(*gam));
     for(ii=Lstart; ii < Lend; ii++){
         x = xx[ii];
 
@@ -132,7 +134,7 @@ void implicit_2Dy(double *phi, double *xx, double *yy,
         for(jj=0; jj < M-1; jj++)
             MInt[jj] = Mfunc2D(yInt[jj], x, m21, gamma2, h2);
 
-        compute_delj(dy, MInt, VInt, M, delj, use_delj_trick);
+        compute_delj(dy, MInt, VInt, V, M, delj, use_delj_trick);
         compute_abc_nobc(dy, dfactor, delj, MInt, V, dt, M, a, b, c);
         for(jj = 0; jj < M; jj++)
             r[jj] = phi[ii*M + jj]/dt;
@@ -142,9 +144,9 @@ void implicit_2Dy(double *phi, double *xx, double *yy,
         if((xx[ii]==1) && (Mlast >= 0))
             b[M-1] += -(-0.5/nu2 - Mlast)*2./dy[M-2];
 
-        tridiag_premalloc(a, b, c, r, &phi[ii*M], M);
+        tridiag_premalloc(a, b, c, r, &phi[ii*M], gam, M);
     }
-    tridiag_free();
+    free(gam);
 
     free(dy);
     free(dfactor);
@@ -166,52 +168,282 @@ void implicit_precalc_2Dx(double *phi, double *ax, double *bx, double *cx,
      */
     int ii, jj;
 
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *temp = malloc(L * sizeof(*temp));
+    /* The columns Mstart to Mend are solved together as one batch. That way
+     * the solver works along the rows of phi, which are contiguous in
+     * memory, rather than down each column in turn.
+     */
+    double *b = malloc(L*M * sizeof(*b));
+    double *r = malloc(L*M * sizeof(*r));
+    double *gam = malloc(L*M * sizeof(*gam));
+    double *bet = malloc(M * sizeof(*bet));
 
-    tridiag_malloc(L);
-    for(jj=Mstart; jj < Mend; jj++){
+    if(Mend > Mstart){
         for(ii = 0; ii < L; ii++){
-            a[ii] = ax[ii*M + jj];
-            b[ii] = bx[ii*M + jj] + 1/dt;
-            c[ii] = cx[ii*M + jj];
-            r[ii] = 1/dt * phi[ii*M + jj];
+            for(jj = Mstart; jj < Mend; jj++){
+                b[ii*M + jj] = bx[ii*M + jj] + 1/dt;
+                r[ii*M + jj] = 1/dt * phi[ii*M + jj];
+            }
         }
 
-        tridiag_premalloc(a, b, c, r, temp, L);
-        for(ii = 0; ii < L; ii++)
-            phi[ii*M + jj] = temp[ii];
+        tridiag_batch_premalloc(&ax[Mstart], &b[Mstart], &cx[Mstart],
+                &r[Mstart], &phi[Mstart], gam, bet, L, Mend-Mstart, M);
     }
-    tridiag_free();
 
-    free(a);
     free(b);
-    free(c);
     free(r);
-    free(temp);
+    free(gam);
+    free(bet);
 }
 
 void implicit_precalc_2Dy(double *phi, double *ay, double *by, double *cy,
         double dt, int L, int M, int Lstart, int Lend){
+    double *gam;
     int ii, jj;
 
     double *b = malloc(M * sizeof(*b));
     double *r = malloc(M * sizeof(*r));
 
-    tridiag_malloc(M);
+    gam = malloc(M * sizeof(*gam));
     for(ii = Lstart; ii < Lend; ii++){
         for(jj = 0; jj < M; jj++){
             b[jj] = by[ii*M + jj] + 1/dt;
             r[jj] = 1/dt * phi[ii*M + jj];
         }
 
-        tridiag_premalloc(&ay[ii*M], b, &cy[ii*M], r, &phi[ii*M], M);
+        tridiag_premalloc(&ay[ii*M], b, &cy[ii*M], r, &phi[ii*M], gam, M);
     }
-    tridiag_free();
+    free(gam);
 
     free(b);
     free(r);
 }
+
+/* The 'factored' integration functions are for epochs in which the a,b,c
+ * arrays are constant. The factor_ functions factor each line's operator for
+ * a given dt once, and the implicit_factored_ functions then take steps of
+ * that dt using only the cheap substitution sweeps.
+ *
+ * As for the precalc functions, the bx passed in here should *not* include
+ * the 1/dt contribution.
+ */
+void factor_precalc_2Dx(double *ax, double *bx, double *cx, double dt,
+        double *gamx, double *ibetx, int L, int M){
+    tridiag_factor_batch(ax, bx, cx, 1/dt, gamx, ibetx, L, M, M);
+}
+
+void factor_precalc_2Dy(double *ay, double *by, double *cy, double dt,
+        double *gamy, double *ibety, int L, int M){
+    int ii;
+
+    for(ii = 0; ii < L; ii++)
+        tridiag_factor_batch(&ay[ii*M], &by[ii*M], &cy[ii*M], 1/dt,
+                &gamy[ii*M], &ibety[ii*M], M, 1, 1);
+}
+
+void implicit_factored_2Dx(double *phi, double *ax, double *gamx,
+        double *ibetx, double dt, int L, int M, int Mstart, int Mend){
+    if(Mend > Mstart)
+        tridiag_factored_batch(&ax[Mstart], &gamx[Mstart], &ibetx[Mstart],
+                &phi[Mstart], 1/dt, &phi[Mstart], L, Mend-Mstart, M);
+}
+
+void implicit_factored_2Dy(double *phi, double *ay, double *gamy,
+        double *ibety, double dt, int L, int M, int Lstart, int Lend){
+    int ii;
+
+    for(ii = Lstart; ii < Lend; ii++)
+        tridiag_factored_batch(&ay[ii*M], &gamy[ii*M], &ibety[ii*M],
+                &phi[ii*M], 1/dt, &phi[ii*M], M, 1, 1);
+}
+
+void implicit_factored_2Dy_transposed(double *phi, double *ayT, double *gamyT,
+        double *ibetyT, double dt, double *work, int L, int M,
+        int Lstart, int Lend){
+    /* Here the coefficients and factors are stored transposed, with shape
+     * (M,L). The rows Lstart to Lend of phi are transposed into that layout,
+     * solved together as one batch, and transposed back. This avoids the
+     * long chain of dependent operations that solving each contiguous line
+     * in turn involves. work is scratch space for the transposed rows, of
+     * length M*L.
+     */
+    double *r;
+
+    if(Lend <= Lstart)
+        return;
+
+    r = work;
+    transpose_tiled(&phi[Lstart*M], &r[Lstart], Lend-Lstart, M, M, L);
+    tridiag_factored_batch(&ayT[Lstart], &gamyT[Lstart], &ibetyT[Lstart],
+            &r[Lstart], 1/dt, &r[Lstart], M, Lend-Lstart, L);
+    transpose_tiled(&r[Lstart], &phi[Lstart*M], M, Lend-Lstart, L, M);
+}
+
+/* The 'split' integration functions are for time-dependent parameters. The
+ * coefficients from selection and migration (aM, bM, cM) are computed in
+ * Python and only recomputed when those parameters change. The coefficients
+ * from drift (aV, bV, cV) are those for nu=1, and are scaled by inv_nu = 1/nu
+ * on the fly. Vfirst and Vlast are the drift parts of the boundary
+ * conditions at the corners, for nu=1.
+ *
+ * work is scratch space provided by the caller, so that it can be reused
+ * from step to step. Its required length is given in integration_c.pyf.
+ */
+void implicit_split_2Dx(double *phi, double *aM, double *bM, double *cM,
+        double *aV, double *bV, double *cV, double Vfirst, double Vlast,
+        double inv_nu, double dt, double *work,
+        int L, int M, int Mstart, int Mend){
+    double bfirst = (Mstart == 0) ? inv_nu*Vfirst : 0;
+    double blast = (Mend == M) ? inv_nu*Vlast : 0;
+
+    double *gam = work;
+    double *bet = &work[L*M];
+
+    if(Mend > Mstart)
+        tridiag_split_batch(&aM[Mstart], &bM[Mstart], &cM[Mstart],
+                aV, bV, cV, inv_nu, 1/dt, bfirst, blast,
+                &phi[Mstart], 1/dt, &phi[Mstart], &gam[Mstart], bet,
+                L, Mend-Mstart, M);
+}
+
+void implicit_split_2Dy_transposed(double *phi, double *aMT, double *bMT,
+        double *cMT, double *aV, double *bV, double *cV, double Vfirst,
+        double Vlast, double inv_nu, double dt, double *work, int L, int M,
+        int Lstart, int Lend){
+    /* As for implicit_factored_2Dy_transposed, aMT, bMT, and cMT have shape
+     * (M,L), and the rows of phi are transposed to match.
+     */
+    double bfirst = (Lstart == 0) ? inv_nu*Vfirst : 0;
+    double blast = (Lend == L) ? inv_nu*Vlast : 0;
+    double *r, *gam, *bet;
+
+    if(Lend <= Lstart)
+        return;
+
+    r = work;
+    gam = &work[M*L];
+    bet = &work[2*M*L];
+
+    transpose_tiled(&phi[Lstart*M], &r[Lstart], Lend-Lstart, M, M, L);
+    tridiag_split_batch(&aMT[Lstart], &bMT[Lstart], &cMT[Lstart],
+            aV, bV, cV, inv_nu, 1/dt, bfirst, blast,
+            &r[Lstart], 1/dt, &r[Lstart], &gam[Lstart], bet,
+            M, Lend-Lstart, L);
+    transpose_tiled(&r[Lstart], &phi[Lstart*M], M, Lend-Lstart, L, M);
+}
+
+/* Integrate phi for nsteps implicit steps of length dt, as the
+ * implicit_factored functions do one sweep. If transposed, ay, gamy, and
+ * ibety are stored transposed, as for implicit_factored_2Dy_transposed, and
+ * work is its scratch space. inject1 and inject2 are the amounts of new
+ * mutations added to phi[1,0] and phi[0,1] each step. The sweeps for frozen
+ * populations are skipped, and their arrays are not used.
+ */
+void integrate_factored_2D(double *phi, double *ax, double *gamx,
+        double *ibetx, double *ay, double *gamy, double *ibety,
+        double inject1, double inject2, double dt, int nsteps,
+        int frozen1, int frozen2, int transposed, double *work,
+        int L, int M){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M] += inject1;
+        phi[1] += inject2;
+        if(!frozen1)
+            implicit_factored_2Dx(phi, ax, gamx, ibetx, dt, L, M, 0, M);
+        if(!frozen2 && transposed)
+            implicit_factored_2Dy_transposed(phi, ay, gamy, ibety, dt, work,
+                    L, M, 0, L);
+        else if(!frozen2)
+            implicit_factored_2Dy(phi, ay, gamy, ibety, dt, L, M, 0, L);
+    }
+}
+
+/* Integrate phi for nsteps implicit steps of lengths dt, using the split
+ * coefficients for parameters that change from step to step. The
+ * coefficients from selection and migration must be the same for all the
+ * steps. inv_nu1 and inv_nu2 are 1/nu for each step, and inject1 and inject2
+ * the amounts of new mutations added to phi[1,0] and phi[0,1] each step.
+ * work must have length 2*L*M + L.
+ */
+void integrate_split_2D(double *phi,
+        double *aMx, double *bMx, double *cMx, double *aVx, double *bVx,
+        double *cVx, double Vfirstx, double Vlastx,
+        double *aMyT, double *bMyT, double *cMyT, double *aVy, double *bVy,
+        double *cVy, double Vfirsty, double Vlasty,
+        double *inv_nu1, double *inv_nu2, double *inject1, double *inject2,
+        double *dt, int nsteps, int frozen1, int frozen2, double *work,
+        int L, int M){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M] += inject1[step];
+        phi[1] += inject2[step];
+        if(!frozen1)
+            implicit_split_2Dx(phi, aMx, bMx, cMx, aVx, bVx, cVx,
+                    Vfirstx, Vlastx, inv_nu1[step], dt[step], work,
+                    L, M, 0, M);
+        if(!frozen2)
+            implicit_split_2Dy_transposed(phi, aMyT, bMyT, cMyT, aVy, bVy,
+                    cVy, Vfirsty, Vlasty, inv_nu2[step], dt[step], work,
+                    L, M, 0, L);
+    }
+}
+
+/* Single-precision versions of the factored functions, for
+ * Integration.use_single_precision. phi and the coefficients are floats. If
+ * refine is nonzero, each solve is refined in double precision, which needs
+ * bx and cx as well as the factors. The y coefficients and factors are always
+ * stored transposed, so the y factors are computed by factor_precalc_2Dx_fl.
+ *
+ * The work lengths are given in integration_c.pyf. For the transposed
+ * sweeps, work holds the refinement scratch space followed by the transposed
+ * rows, stored as floats.
+ */
+void factor_precalc_2Dx_fl(float *ax, float *bx, float *cx, double dt,
+        float *gamx, float *ibetx, int L, int M){
+    tridiag_factor_batch_fl(ax, bx, cx, 1/dt, gamx, ibetx, L, M, M);
+}
+
+void implicit_factored_2Dx_fl(float *phi, float *ax, float *bx, float *cx,
+        float *gamx, float *ibetx, double dt, int refine, double *work,
+        int L, int M, int Mstart, int Mend){
+    if(Mend > Mstart)
+        tridiag_factored_batch_fl(&ax[Mstart], &bx[Mstart], &cx[Mstart],
+                &gamx[Mstart], &ibetx[Mstart], 1/dt, &phi[Mstart], 1/dt,
+                &phi[Mstart], refine, work, L, Mend-Mstart, M);
+}
+
+void implicit_factored_2Dy_transposed_fl(float *phi, float *ayT, float *byT,
+        float *cyT, float *gamyT, float *ibetyT, double dt, int refine,
+        double *work, int L, int M, int Lstart, int Lend){
+    float *r = (float *)&work[2*M*REFINE_BLOCK];
+
+    if(Lend <= Lstart)
+        return;
+
+    transpose_tiled_fl(&phi[Lstart*M], &r[Lstart], Lend-Lstart, M, M, L);
+    tridiag_factored_batch_fl(&ayT[Lstart], &byT[Lstart], &cyT[Lstart],
+            &gamyT[Lstart], &ibetyT[Lstart], 1/dt, &r[Lstart], 1/dt,
+            &r[Lstart], refine, work, M, Lend-Lstart, L);
+    transpose_tiled_fl(&r[Lstart], &phi[Lstart*M], M, Lend-Lstart, L, M);
+}
+
+/* Single-precision version of integrate_factored_2D. */
+void integrate_factored_2D_fl(float *phi, float *ax, float *bx, float *cx,
+        float *gamx, float *ibetx, float *ayT, float *byT, float *cyT,
+        float *gamyT, float *ibetyT, double inject1, double inject2,
+        double dt, int nsteps, int frozen1, int frozen2, int refine,
+        double *work, int L, int M){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M] += inject1;
+        phi[1] += inject2;
+        if(!frozen1)
+            implicit_factored_2Dx_fl(phi, ax, bx, cx, gamx, ibetx, dt,
+                    refine, work, L, M, 0, M);
+        if(!frozen2)
+            implicit_factored_2Dy_transposed_fl(phi, ayT, byT, cyT, gamyT,
+                    ibetyT, dt, refine, work, L, M, 0, L);
+    }
+}
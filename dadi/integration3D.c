@@ -14,6 +14,7 @@ void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
         double nu1, double m12, double m13, double gamma1, double h1,
         double dt, int L, int M, int N, int use_delj_trick,
         int Mstart, int Mend){
+    double *gam;
     int ii,jj,kk;
 
     double *dx = malloc((L-1) * sizeof(*dx));
@@ -44,7 +45,7 @@ void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
     for(ii=0; ii < L-1; ii++)
         VInt[ii] = Vfunc(xInt[ii], nu1);
 
-    tridiag_malloc(L);
+    gam = malloc(L * sizeof(*gam));
     for(jj = Mstart; jj < Mend; jj++){
         for(kk = 0; kk < N; kk++){
             y = yy[jj];
@@ -55,7 +56,7 @@ void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
             for(ii=0; ii < L-1; ii++)
                 MInt[ii] = Mfunc3D(xInt[ii], y, z, m12, m13, gamma1, h1);
 
-            compute_delj(dx, MInt, VInt, L, delj, use_delj_trick);
+            compute_delj(dx, MInt, VInt, V, L, delj, use_delj_trick);
             compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, L, a, b, c);
             for(ii = 0; ii < L; ii++)
                 r[ii] = phi[ii*M*N + jj*N + kk]/dt;
@@ -65,12 +66,12 @@ void implicit_3Dx(double *phi, double *xx, double *yy, double *zz,
             if((yy[jj]==1) && (zz[kk]==1) && (Mlast >= 0))
                 b[L-1] += -(-0.5/nu1 - Mlast)*2./dx[L-2];
 
-            tridiag_premalloc(a, b, c, r, temp, L);
+            tridiag_premalloc(a, b, c, r, temp, gam, L);
             for(ii = 0; ii < L; ii++)
                 phi[ii*M*N + jj*N + kk] = temp[ii];
         }
     }
-    tridiag_free();
+    free(gam);
 
     free(dx);
     free(dfactor);
@@ -90,6 +91,7 @@ void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
         double nu2, double m21, double m23, double gamma2, double h2,
         double dt, int L, int M, int N, int use_delj_trick,
         int Lstart, int Lend){
+    double *gam;
     int ii,jj,kk;
 
     double *dy = malloc((M-1) * sizeof(*dy));
@@ -121,7 +123,7 @@ void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
     for(jj=0; jj < M-1; jj++)
         VInt[jj] = Vfunc(yInt[jj], nu2);
 
-    tridiag_malloc(M);
+    gam = malloc(M * sizeof(*gam));
     for(ii = Lstart; ii < Lend; ii++){
         for(kk = 0; kk < N; kk++){
             x = xx[ii];
@@ -132,7 +134,7 @@ void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
             for(jj=0; jj < M-1; jj++)
                 MInt[jj] = Mfunc3D(yInt[jj], x, z, m21, m23, gamma2, h2);
 
-            compute_delj(dy, MInt, VInt, M, delj, use_delj_trick);
+            compute_delj(dy, MInt, VInt, V, M, delj, use_delj_trick);
             compute_abc_nobc(dy, dfactor, delj, MInt, V, dt, M, a, b, c);
             for(jj = 0; jj < M; jj++)
                 r[jj] = phi[ii*M*N + jj*N + kk]/dt;
@@ -142,12 +144,12 @@ void implicit_3Dy(double *phi, double *xx, double *yy, double *zz,
             if((xx[ii]==1) && (zz[kk]==1) && (Mlast >= 0))
                 b[M-1] += -(-0.5/nu2 - Mlast)*2./dy[M-2];
 
-            tridiag_premalloc(a, b, c, r, temp, M);
+            tridiag_premalloc(a, b, c, r, temp, gam, M);
             for(jj = 0; jj < M; jj++)
                 phi[ii*M*N + jj*N + kk] = temp[jj];
         }
     }
-    tridiag_free();
+    free(gam);
 
     free(dy);
     free(dfactor);
@@ -167,6 +169,7 @@ void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
         double nu3, double m31, double m32, double gamma3, double h3,
         double dt, int L, int M, int N, int use_delj_trick,
         int Lstart, int Lend){
+    double *gam;
     int ii,jj,kk;
 
     double *dz = malloc((N-1) * sizeof(*dz));
@@ -198,7 +201,7 @@ void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
     for(kk=0; kk < N-1; kk++)
         VInt[kk] = Vfunc(zInt[kk], nu3);
 
-    tridiag_malloc(N);
+    gam = malloc(N * sizeof(*gam));
     for(ii = Lstart; ii < Lend; ii++){
         for(jj = 0; jj < M; jj++){
             x = xx[ii];
@@ -209,7 +212,7 @@ void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
             for(kk=0; kk < N-1; kk++)
                 MInt[kk] = Mfunc3D(zInt[kk], x, y, m31, m32, gamma3, h3);
 
-            compute_delj(dz, MInt, VInt, N, delj, use_delj_trick);
+            compute_delj(dz, MInt, VInt, V, N, delj, use_delj_trick);
             compute_abc_nobc(dz, dfactor, delj, MInt, V, dt, N, a, b, c);
             for(kk = 0; kk < N; kk++)
                 r[kk] = phi[ii*M*N + jj*N + kk]/dt;
@@ -219,10 +222,10 @@ void implicit_3Dz(double *phi, double *xx, double *yy, double *zz,
             if((xx[ii]==1) && (yy[jj]==1) && (Mlast >= 0))
                 b[N-1] += -(-0.5/nu3 - Mlast)*2./dz[N-2];
 
-            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], N);
+            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], gam, N);
         }
     }
-    tridiag_free();
+    free(gam);
 
     free(dz);
     free(dfactor);
@@ -243,35 +246,39 @@ void implicit_precalc_3Dx(double *phi, double *ax, double *bx, double *cx,
     int ii,jj,kk;
     int index;
 
-    double *a = malloc(L * sizeof(*a));
-    double *b = malloc(L * sizeof(*b));
-    double *c = malloc(L * sizeof(*c));
-    double *r = malloc(L * sizeof(*r));
-    double *new_row = malloc(L * sizeof(*new_row));
+    /* For each jj, the N lines along x are gathered into contiguous LxN
+     * blocks and solved together as one batch.
+     */
+    double *a = malloc(L*N * sizeof(*a));
+    double *b = malloc(L*N * sizeof(*b));
+    double *c = malloc(L*N * sizeof(*c));
+    double *r = malloc(L*N * sizeof(*r));
+    double *gam = malloc(L*N * sizeof(*gam));
+    double *bet = malloc(N * sizeof(*bet));
 
-    tridiag_malloc(L);
     for(jj = Mstart; jj < Mend; jj++){
-        for(kk = 0; kk < N; kk++){
-            for(ii = 0; ii < L; ii++){
+        for(ii = 0; ii < L; ii++){
+            for(kk = 0; kk < N; kk++){
                 index = ii*M*N + jj*N + kk;
-                a[ii] = ax[index];
-                b[ii] = bx[index] + 1/dt;
-                c[ii] = cx[index];
-                r[ii] = 1/dt * phi[index];
+                a[ii*N + kk] = ax[index];
+                b[ii*N + kk] = bx[index] + 1/dt;
+                c[ii*N + kk] = cx[index];
+                r[ii*N + kk] = 1/dt * phi[index];
             }
-
-            tridiag_premalloc(a, b, c, r, new_row, L);
-            for(ii = 0; ii < L; ii++)
-                phi[ii*M*N + jj*N + kk] = new_row[ii];
         }
+
+        tridiag_batch_premalloc(a, b, c, r, r, gam, bet, L, N, N);
+        for(ii = 0; ii < L; ii++)
+            for(kk = 0; kk < N; kk++)
+                phi[ii*M*N + jj*N + kk] = r[ii*N + kk];
     }
-    tridiag_free();
 
     free(a);
     free(b);
     free(c);
     free(r);
-    free(new_row);
+    free(gam);
+    free(bet);
 }
 
 void implicit_precalc_3Dy(double *phi, double *ay, double *by, double *cy,
@@ -279,39 +286,37 @@ void implicit_precalc_3Dy(double *phi, double *ay, double *by, double *cy,
     int ii,jj,kk;
     int index;
 
-    double *a = malloc(M * sizeof(*a));
-    double *b = malloc(M * sizeof(*b));
-    double *c = malloc(M * sizeof(*c));
-    double *r = malloc(M * sizeof(*r));
-    double *new_row = malloc(M * sizeof(*new_row));
+    /* For each ii, the N lines along y are solved together as one batch.
+     * Here the coefficients are already laid out as the batch solver
+     * expects, so only b and r need to be assembled.
+     */
+    double *b = malloc(M*N * sizeof(*b));
+    double *r = malloc(M*N * sizeof(*r));
+    double *gam = malloc(M*N * sizeof(*gam));
+    double *bet = malloc(N * sizeof(*bet));
 
-    tridiag_malloc(M);
     for(ii = Lstart; ii < Lend; ii++){
-        for(kk = 0; kk < N; kk++){
-            for(jj = 0; jj < M; jj++){
+        for(jj = 0; jj < M; jj++){
+            for(kk = 0; kk < N; kk++){
                 index = ii*M*N + jj*N + kk;
-                a[jj] = ay[index];
-                b[jj] = by[index] + 1/dt;
-                c[jj] = cy[index];
-                r[jj] = 1/dt * phi[index];
+                b[jj*N + kk] = by[index] + 1/dt;
+                r[jj*N + kk] = 1/dt * phi[index];
             }
-
-            tridiag_premalloc(a, b, c, r, new_row, M);
-            for(jj = 0; jj < M; jj++)
-                phi[ii*M*N + jj*N + kk] = new_row[jj];
         }
+
+        tridiag_batch_premalloc(&ay[ii*M*N], b, &cy[ii*M*N], r, &phi[ii*M*N],
+                gam, bet, M, N, N);
     }
-    tridiag_free();
 
-    free(a);
     free(b);
-    free(c);
     free(r);
-    free(new_row);
+    free(gam);
+    free(bet);
 }
 
 void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
         double dt, int L, int M, int N, int Lstart, int Lend){
+    double *gam;
     int ii,jj,kk;
     int index;
 
@@ -321,7 +326,7 @@ void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
     double *r = malloc(N * sizeof(*r));
     double *new_row = malloc(N * sizeof(*new_row));
 
-    tridiag_malloc(N);
+    gam = malloc(N * sizeof(*gam));
     for(ii = Lstart; ii < Lend; ii++){
         for(jj = 0; jj < M; jj++){
             for(kk = 0; kk < N; kk++){
@@ -332,10 +337,10 @@ void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
                 r[kk] = 1/dt * phi[index];
             }
 
-            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], N);
+            tridiag_premalloc(a, b, c, r, &phi[ii*M*N + jj*N], gam, N);
         }
     }
-    tridiag_free();
+    free(gam);
 
     free(a);
     free(b);
@@ -343,3 +348,349 @@ void implicit_precalc_3Dz(double *phi, double *az, double *bz, double *cz,
     free(r);
     free(new_row);
 }
+
+/* Factored versions of the precalc functions. See the comments in
+ * integration2D.c.
+ *
+ * The factors are stored in the same layout as phi, so the lines can be
+ * solved in place, with no gathering into temporary arrays.
+ */
+void factor_precalc_3Dx(double *ax, double *bx, double *cx, double dt,
+        double *gamx, double *ibetx, int L, int M, int N){
+    tridiag_factor_batch(ax, bx, cx, 1/dt, gamx, ibetx, L, M*N, M*N);
+}
+
+void factor_precalc_3Dy(double *ay, double *by, double *cy, double dt,
+        double *gamy, double *ibety, int L, int M, int N){
+    int ii;
+
+    for(ii = 0; ii < L; ii++)
+        tridiag_factor_batch(&ay[ii*M*N], &by[ii*M*N], &cy[ii*M*N], 1/dt,
+                &gamy[ii*M*N], &ibety[ii*M*N], M, N, N);
+}
+
+void factor_precalc_3Dz(double *az, double *bz, double *cz, double dt,
+        double *gamz, double *ibetz, int L, int M, int N){
+    int ii, jj;
+    int index;
+
+    for(ii = 0; ii < L; ii++){
+        for(jj = 0; jj < M; jj++){
+            index = ii*M*N + jj*N;
+            tridiag_factor_batch(&az[index], &bz[index], &cz[index], 1/dt,
+                    &gamz[index], &ibetz[index], N, 1, 1);
+        }
+    }
+}
+
+void implicit_factored_3Dx(double *phi, double *ax, double *gamx,
+        double *ibetx, double dt, int L, int M, int N, int Mstart, int Mend){
+    int start = Mstart*N;
+
+    /* For fixed x, the lines for jj from Mstart to Mend are adjacent in
+     * memory, so they are all solved together as one batch.
+     */
+    if(Mend > Mstart)
+        tridiag_factored_batch(&ax[start], &gamx[start], &ibetx[start],
+                &phi[start], 1/dt, &phi[start], L, (Mend-Mstart)*N, M*N);
+}
+
+void implicit_factored_3Dy(double *phi, double *ay, double *gamy,
+        double *ibety, double dt, int L, int M, int N, int Lstart, int Lend){
+    int ii;
+    int index;
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        tridiag_factored_batch(&ay[index], &gamy[index], &ibety[index],
+                &phi[index], 1/dt, &phi[index], M, N, N);
+    }
+}
+
+void implicit_factored_3Dz(double *phi, double *az, double *gamz,
+        double *ibetz, double dt, int L, int M, int N, int Lstart, int Lend){
+    int ii, jj;
+    int index;
+
+    for(ii = Lstart; ii < Lend; ii++){
+        for(jj = 0; jj < M; jj++){
+            index = ii*M*N + jj*N;
+            tridiag_factored_batch(&az[index], &gamz[index], &ibetz[index],
+                    &phi[index], 1/dt, &phi[index], N, 1, 1);
+        }
+    }
+}
+
+void implicit_factored_3Dz_transposed(double *phi, double *azT, double *gamzT,
+        double *ibetzT, double dt, double *work,
+        int L, int M, int N, int Lstart, int Lend){
+    /* Here the coefficients and factors are stored with the last two axes
+     * transposed, shape (L,N,M). For each ii, the MxN block of phi is
+     * transposed into that layout, the M lines are solved as one batch,
+     * and the block is transposed back. work is scratch space for the block,
+     * of length N*M.
+     */
+    int ii;
+    int index;
+
+    double *r = work;
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        transpose_tiled(&phi[index], r, M, N, N, M);
+        tridiag_factored_batch(&azT[index], &gamzT[index], &ibetzT[index],
+                r, 1/dt, r, N, M, M);
+        transpose_tiled(r, &phi[index], N, M, M, N);
+    }
+}
+
+/* Split versions of the integration functions, for time-dependent
+ * parameters. See the comments in integration2D.c.
+ */
+void implicit_split_3Dx(double *phi, double *aM, double *bM, double *cM,
+        double *aV, double *bV, double *cV, double Vfirst, double Vlast,
+        double inv_nu, double dt, double *work,
+        int L, int M, int N, int Mstart, int Mend){
+    int start = Mstart*N;
+    double bfirst = (Mstart == 0) ? inv_nu*Vfirst : 0;
+    double blast = (Mend == M) ? inv_nu*Vlast : 0;
+
+    double *gam = work;
+    double *bet = &work[L*M*N];
+
+    if(Mend > Mstart)
+        tridiag_split_batch(&aM[start], &bM[start], &cM[start],
+                aV, bV, cV, inv_nu, 1/dt, bfirst, blast,
+                &phi[start], 1/dt, &phi[start], &gam[start], bet,
+                L, (Mend-Mstart)*N, M*N);
+}
+
+void implicit_split_3Dy(double *phi, double *aM, double *bM, double *cM,
+        double *aV, double *bV, double *cV, double Vfirst, double Vlast,
+        double inv_nu, double dt, double *work,
+        int L, int M, int N, int Lstart, int Lend){
+    int ii;
+    int index;
+    double bfirst, blast;
+
+    double *gam = work;
+    double *bet = &work[M*N];
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        bfirst = (ii == 0) ? inv_nu*Vfirst : 0;
+        blast = (ii == L-1) ? inv_nu*Vlast : 0;
+        tridiag_split_batch(&aM[index], &bM[index], &cM[index],
+                aV, bV, cV, inv_nu, 1/dt, bfirst, blast,
+                &phi[index], 1/dt, &phi[index], gam, bet, M, N, N);
+    }
+}
+
+void implicit_split_3Dz_transposed(double *phi, double *aMT, double *bMT,
+        double *cMT, double *aV, double *bV, double *cV, double Vfirst,
+        double Vlast, double inv_nu, double dt, double *work,
+        int L, int M, int N, int Lstart, int Lend){
+    /* As for implicit_factored_3Dz_transposed, aMT, bMT, and cMT have shape
+     * (L,N,M).
+     */
+    int ii;
+    int index;
+    double bfirst, blast;
+
+    double *r = work;
+    double *gam = &work[N*M];
+    double *bet = &work[2*N*M];
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        bfirst = (ii == 0) ? inv_nu*Vfirst : 0;
+        blast = (ii == L-1) ? inv_nu*Vlast : 0;
+        transpose_tiled(&phi[index], r, M, N, N, M);
+        tridiag_split_batch(&aMT[index], &bMT[index], &cMT[index],
+                aV, bV, cV, inv_nu, 1/dt, bfirst, blast,
+                r, 1/dt, r, gam, bet, N, M, M);
+        transpose_tiled(r, &phi[index], N, M, M, N);
+    }
+}
+
+/* Integrate phi for nsteps implicit steps of length dt. See
+ * integrate_factored_2D in integration2D.c. If transposed, az, gamz, and
+ * ibetz are stored as for implicit_factored_3Dz_transposed.
+ */
+void integrate_factored_3D(double *phi, double *ax, double *gamx,
+        double *ibetx, double *ay, double *gamy, double *ibety,
+        double *az, double *gamz, double *ibetz,
+        double inject1, double inject2, double inject3, double dt, int nsteps,
+        int frozen1, int frozen2, int frozen3, int transposed, double *work,
+        int L, int M, int N){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M*N] += inject1;
+        phi[N] += inject2;
+        phi[1] += inject3;
+        if(!frozen1)
+            implicit_factored_3Dx(phi, ax, gamx, ibetx, dt, L, M, N, 0, M);
+        if(!frozen2)
+            implicit_factored_3Dy(phi, ay, gamy, ibety, dt, L, M, N, 0, L);
+        if(!frozen3 && transposed)
+            implicit_factored_3Dz_transposed(phi, az, gamz, ibetz, dt, work,
+                    L, M, N, 0, L);
+        else if(!frozen3)
+            implicit_factored_3Dz(phi, az, gamz, ibetz, dt, L, M, N, 0, L);
+    }
+}
+
+/* Integrate phi for nsteps implicit steps of length dt with constant
+ * parameters, without any coefficient arrays. As in implicit_3Dx,
+ * implicit_3Dy, and implicit_3Dz, the coefficients for each line are
+ * computed as it is solved, so the only memory needed beyond phi is a few
+ * arrays the length of a line.
+ */
+void integrate_3D(double *phi, double *xx, double *yy, double *zz,
+        double nu1, double nu2, double nu3, double m12, double m13,
+        double m21, double m23, double m31, double m32,
+        double gamma1, double gamma2, double gamma3,
+        double h1, double h2, double h3,
+        double inject1, double inject2, double inject3, double dt, int nsteps,
+        int frozen1, int frozen2, int frozen3, int L, int M, int N,
+        int use_delj_trick){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M*N] += inject1;
+        phi[N] += inject2;
+        phi[1] += inject3;
+        if(!frozen1)
+            implicit_3Dx(phi, xx, yy, zz, nu1, m12, m13, gamma1, h1, dt,
+                    L, M, N, use_delj_trick, 0, M);
+        if(!frozen2)
+            implicit_3Dy(phi, xx, yy, zz, nu2, m21, m23, gamma2, h2, dt,
+                    L, M, N, use_delj_trick, 0, L);
+        if(!frozen3)
+            implicit_3Dz(phi, xx, yy, zz, nu3, m31, m32, gamma3, h3, dt,
+                    L, M, N, use_delj_trick, 0, L);
+    }
+}
+
+/* Integrate phi for nsteps implicit steps of lengths dt, using the split
+ * coefficients. See integrate_split_2D in integration2D.c. work must have
+ * length L*M*N + M*N.
+ */
+void integrate_split_3D(double *phi,
+        double *aMx, double *bMx, double *cMx, double *aVx, double *bVx,
+        double *cVx, double Vfirstx, double Vlastx,
+        double *aMy, double *bMy, double *cMy, double *aVy, double *bVy,
+        double *cVy, double Vfirsty, double Vlasty,
+        double *aMzT, double *bMzT, double *cMzT, double *aVz, double *bVz,
+        double *cVz, double Vfirstz, double Vlastz,
+        double *inv_nu1, double *inv_nu2, double *inv_nu3,
+        double *inject1, double *inject2, double *inject3,
+        double *dt, int nsteps, int frozen1, int frozen2, int frozen3,
+        double *work, int L, int M, int N){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M*N] += inject1[step];
+        phi[N] += inject2[step];
+        phi[1] += inject3[step];
+        if(!frozen1)
+            implicit_split_3Dx(phi, aMx, bMx, cMx, aVx, bVx, cVx,
+                    Vfirstx, Vlastx, inv_nu1[step], dt[step], work,
+                    L, M, N, 0, M);
+        if(!frozen2)
+            implicit_split_3Dy(phi, aMy, bMy, cMy, aVy, bVy, cVy,
+                    Vfirsty, Vlasty, inv_nu2[step], dt[step], work,
+                    L, M, N, 0, L);
+        if(!frozen3)
+            implicit_split_3Dz_transposed(phi, aMzT, bMzT, cMzT, aVz, bVz,
+                    cVz, Vfirstz, Vlastz, inv_nu3[step], dt[step], work,
+                    L, M, N, 0, L);
+    }
+}
+
+/* Single-precision versions of the factored functions. See the comments in
+ * integration2D.c. The z coefficients and factors are always stored
+ * transposed, so the z factors are computed by factor_precalc_3Dy_fl.
+ */
+void factor_precalc_3Dx_fl(float *ax, float *bx, float *cx, double dt,
+        float *gamx, float *ibetx, int L, int M, int N){
+    tridiag_factor_batch_fl(ax, bx, cx, 1/dt, gamx, ibetx, L, M*N, M*N);
+}
+
+void factor_precalc_3Dy_fl(float *ay, float *by, float *cy, double dt,
+        float *gamy, float *ibety, int L, int M, int N){
+    int ii;
+
+    for(ii = 0; ii < L; ii++)
+        tridiag_factor_batch_fl(&ay[ii*M*N], &by[ii*M*N], &cy[ii*M*N], 1/dt,
+                &gamy[ii*M*N], &ibety[ii*M*N], M, N, N);
+}
+
+void implicit_factored_3Dx_fl(float *phi, float *ax, float *bx, float *cx,
+        float *gamx, float *ibetx, double dt, int refine, double *work,
+        int L, int M, int N, int Mstart, int Mend){
+    int start = Mstart*N;
+
+    if(Mend > Mstart)
+        tridiag_factored_batch_fl(&ax[start], &bx[start], &cx[start],
+                &gamx[start], &ibetx[start], 1/dt, &phi[start], 1/dt,
+                &phi[start], refine, work, L, (Mend-Mstart)*N, M*N);
+}
+
+void implicit_factored_3Dy_fl(float *phi, float *ay, float *by, float *cy,
+        float *gamy, float *ibety, double dt, int refine, double *work,
+        int L, int M, int N, int Lstart, int Lend){
+    int ii;
+    int index;
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        tridiag_factored_batch_fl(&ay[index], &by[index], &cy[index],
+                &gamy[index], &ibety[index], 1/dt, &phi[index], 1/dt,
+                &phi[index], refine, work, M, N, N);
+    }
+}
+
+void implicit_factored_3Dz_transposed_fl(float *phi, float *azT, float *bzT,
+        float *czT, float *gamzT, float *ibetzT, double dt, int refine,
+        double *work, int L, int M, int N, int Lstart, int Lend){
+    int ii;
+    int index;
+
+    float *r = (float *)&work[2*N*REFINE_BLOCK];
+
+    for(ii = Lstart; ii < Lend; ii++){
+        index = ii*M*N;
+        transpose_tiled_fl(&phi[index], r, M, N, N, M);
+        tridiag_factored_batch_fl(&azT[index], &bzT[index], &czT[index],
+                &gamzT[index], &ibetzT[index], 1/dt, r, 1/dt, r, refine,
+                work, N, M, M);
+        transpose_tiled_fl(r, &phi[index], N, M, M, N);
+    }
+}
+
+/* Single-precision version of integrate_factored_3D. */
+void integrate_factored_3D_fl(float *phi, float *ax, float *bx, float *cx,
+        float *gamx, float *ibetx, float *ay, float *by, float *cy,
+        float *gamy, float *ibety, float *azT, float *bzT, float *czT,
+        float *gamzT, float *ibetzT, double inject1, double inject2,
+        double inject3, double dt, int nsteps, int frozen1, int frozen2,
+        int frozen3, int refine, double *work, int L, int M, int N){
+    int step;
+
+    for(step = 0; step < nsteps; step++){
+        phi[M*N] += inject1;
+        phi[N] += inject2;
+        phi[1] += inject3;
+        if(!frozen1)
+            implicit_factored_3Dx_fl(phi, ax, bx, cx, gamx, ibetx, dt,
+                    refine, work, L, M, N, 0, M);
+        if(!frozen2)
+            implicit_factored_3Dy_fl(phi, ay, by, cy, gamy, ibety, dt,
+                    refine, work, L, M, N, 0, L);
+        if(!frozen3)
+            implicit_factored_3Dz_transposed_fl(phi, azT, bzT, czT, gamzT,
+                    ibetzT, dt, refine, work, L, M, N, 0, L);
+    }
+}
@@ -0,0 +1,252 @@
+#include "integration_shared.h"
+#include "tridiag.h"
+#include <stdio.h>
+#include <stdlib.h>
+
+/* Integration for four or more populations.
+ *
+ * Here phi is passed flattened, with ndim axes of shape[dd] points each. The
+ * grids for the axes are passed concatenated in grids. The full coefficient
+ * arrays would each be as large as phi, so instead the coefficients for each
+ * line are computed as it is solved.
+ */
+
+void implicit_ND(double *phi, double *grids, int *shape, double *ms,
+        int *frozen, double nu, double gamma, double h, double dt, int size,
+        int total, int ndim, int axis, int use_delj_trick, int line_start,
+        int line_end){
+    double *gam;
+    /*
+    Implicit sweep along the given axis of phi.
+
+    phi holds size = prod(shape) values, and grids holds total = sum(shape)
+    values. ms holds the migration rates into the population along axis from
+    each of the ndim populations, with ms[axis] ignored. The lines to solve
+    are numbered from 0 to size/shape[axis] in C order of their other
+    indices, and those from line_start to line_end are solved. A negative
+    line_end solves through the last line.
+
+    The boundary conditions apply on the lines where all the other
+    populations are at 0, or all at 1. The axes with nonzero frozen are
+    passed over in this, so a frozen population split off from another
+    leaves the distribution of the rest as it would be without it.
+    */
+    int ii, dd, line, idx, rem, base;
+    int stride = 1;
+    int pts = shape[axis];
+    double *xx, *x_other;
+    int *offsets = malloc(ndim * sizeof(*offsets));
+
+    double *dx = malloc((pts-1) * sizeof(*dx));
+    double *dfactor = malloc(pts * sizeof(*dfactor));
+    double *xInt = malloc((pts-1) * sizeof(*xInt));
+
+    double Mfirst, Mlast, mig, mtot;
+    double *MInt = malloc((pts-1) * sizeof(*MInt));
+    double *selInt = malloc((pts-1) * sizeof(*selInt));
+    double *V = malloc(pts * sizeof(*V));
+    double *VInt = malloc((pts-1) * sizeof(*VInt));
+
+    double *delj = malloc((pts-1) * sizeof(*delj));
+
+    double *a = malloc(pts * sizeof(*a));
+    double *b = malloc(pts * sizeof(*b));
+    double *c = malloc(pts * sizeof(*c));
+    double *r = malloc(pts * sizeof(*r));
+    double *temp = malloc(pts * sizeof(*temp));
+
+    int at_zero, at_one;
+
+    /* stride is the distance between neighboring points of a line. */
+    for(dd = axis+1; dd < ndim; dd++)
+        stride *= shape[dd];
+    offsets[0] = 0;
+    for(dd = 1; dd < ndim; dd++)
+        offsets[dd] = offsets[dd-1] + shape[dd-1];
+    xx = &grids[offsets[axis]];
+    if(line_end < 0)
+        line_end = size/pts;
+
+    compute_dx(xx, pts, dx);
+    compute_dfactor(dx, pts, dfactor);
+    compute_xInt(xx, pts, xInt);
+
+    for(ii=0; ii < pts; ii++)
+        V[ii] = Vfunc(xx[ii], nu);
+    for(ii=0; ii < pts-1; ii++){
+        VInt[ii] = Vfunc(xInt[ii], nu);
+        selInt[ii] = Mfunc1D(xInt[ii], gamma, h);
+    }
+
+    mtot = 0;
+    for(dd = 0; dd < ndim; dd++)
+        if(dd != axis)
+            mtot += ms[dd];
+
+    gam = malloc(pts * sizeof(*gam));
+    for(line = line_start; line < line_end; line++){
+        base = (line/stride)*stride*pts + line%stride;
+
+        /* The migration term is sum_j m_j*(x_j - x), so it only depends on
+         * the other coordinates through sum_j m_j*x_j. */
+        mig = 0;
+        at_zero = at_one = 1;
+        rem = base;
+        for(dd = ndim-1; dd >= 0; dd--){
+            idx = rem % shape[dd];
+            rem /= shape[dd];
+            if(dd == axis)
+                continue;
+            x_other = &grids[offsets[dd]];
+            mig += ms[dd]*x_other[idx];
+            if(frozen[dd])
+                continue;
+            at_zero = at_zero && (x_other[idx] == 0);
+            at_one = at_one && (x_other[idx] == 1);
+        }
+
+        Mfirst = mig - mtot*xx[0] + Mfunc1D(xx[0], gamma, h);
+        Mlast = mig - mtot*xx[pts-1] + Mfunc1D(xx[pts-1], gamma, h);
+        for(ii=0; ii < pts-1; ii++)
+            MInt[ii] = mig - mtot*xInt[ii] + selInt[ii];
+
+        compute_delj(dx, MInt, VInt, V, pts, delj, use_delj_trick);
+        compute_abc_nobc(dx, dfactor, delj, MInt, V, dt, pts, a, b, c);
+        for(ii = 0; ii < pts; ii++)
+            r[ii] = phi[base + ii*stride]/dt;
+
+        if(at_zero && (Mfirst <= 0))
+            b[0] += (0.5/nu - Mfirst)*2./dx[0];
+        if(at_one && (Mlast >= 0))
+            b[pts-1] += -(-0.5/nu - Mlast)*2./dx[pts-2];
+
+        tridiag_premalloc(a, b, c, r, temp, gam, pts);
+        for(ii = 0; ii < pts; ii++)
+            phi[base + ii*stride] = temp[ii];
+    }
+    free(gam);
+
+    free(offsets);
+    free(dx);
+    free(dfactor);
+    free(xInt);
+    free(MInt);
+    free(selInt);
+    free(V);
+    free(VInt);
+    free(delj);
+    free(a);
+    free(b);
+    free(c);
+    free(r);
+    free(temp);
+}
+
+/* Integration without migration.
+ *
+ * Without migration, the operator along each axis is the same for every
+ * line, apart from the boundary conditions at the corners of phi. Those
+ * apply at the start of the first line and at the end of the last. So each
+ * axis needs only three 1D sets of factors, from tridiag_factor: gam and ibet
+ * hold those for most lines, then for the first line, then for the last.
+ */
+
+static void solve_shared(double *phi, double *a, double *gam, double *ibet,
+        double rscale, int n, int m, int stride){
+    /*
+    Solve m interleaved lines that share their factors, as in
+    tridiag_factored_batch. Element j of line k is phi[j*stride + k].
+    */
+    int j, k;
+    double *row, *prev;
+
+    for(k=0; k < m; k++)
+        phi[k] = rscale*phi[k]*ibet[0];
+    for(j=1; j <= n-1; j++){
+        row = &phi[j*stride];
+        prev = &phi[(j-1)*stride];
+        for(k=0; k < m; k++)
+            row[k] = (rscale*row[k] - a[j]*prev[k])*ibet[j];
+    }
+
+    for(j=(n-2); j >= 0; j--){
+        row = &phi[j*stride];
+        prev = &phi[(j+1)*stride];
+        for(k=0; k < m; k++)
+            row[k] -= gam[j+1]*prev[k];
+    }
+}
+
+void implicit_shared(double *phi, double *a, double *gam, double *ibet,
+        double dt, int size, int n, int Q, int line_start, int line_end){
+    /*
+    Implicit sweep along an axis of phi with n points, whose lines all share
+    the coefficients a and the factors gam and ibet.
+
+    phi holds size values, and Q is the product of the lengths of the axes
+    after this one. The lines are numbered in C order of their other
+    indices, so line p*Q + q starts at phi[p*n*Q + q], and those from
+    line_start to line_end are solved. A negative line_end solves through
+    the last line.
+    */
+    int p, qlo, qhi;
+    int last = size/n - 1;
+    double rscale = 1./dt;
+
+    if(line_end < 0)
+        line_end = last + 1;
+
+    /* Each p holds a block of Q interleaved lines, solved together. */
+    for(p = line_start/Q; p*Q < line_end; p++){
+        qlo = (line_start > p*Q) ? line_start - p*Q : 0;
+        qhi = (line_end < (p+1)*Q) ? line_end - p*Q : Q;
+        if(p*Q + qlo == 0){
+            solve_shared(phi, a, &gam[n], &ibet[n], rscale, n, 1, Q);
+            qlo++;
+        }
+        if(p*Q + qhi-1 == last && qhi > qlo){
+            solve_shared(&phi[p*n*Q + qhi-1], a, &gam[2*n], &ibet[2*n],
+                    rscale, n, 1, Q);
+            qhi--;
+        }
+        if(qhi > qlo)
+            solve_shared(&phi[p*n*Q + qlo], a, gam, ibet, rscale, n,
+                    qhi - qlo, Q);
+    }
+}
+
+void integrate_shared(double *phi, double *acoeffs, double *gams,
+        double *ibets, int *dims, int *frozen, double *injects, double dt,
+        int num_steps, int size, int total, int ndim){
+    /*
+    Take num_steps implicit Euler steps of length dt, sweeping along each
+    axis with implicit_shared.
+
+    dims holds the number of points along each axis. acoeffs holds the
+    coefficients a for each axis concatenated, so total = sum(dims), and
+    gams and ibets hold the three sets of factors for each axis
+    concatenated. injects holds the mutations injected each step next
+    to the origin along each axis. The axes with nonzero frozen are not
+    swept.
+    */
+    int step, dd, offset;
+    int *strides = malloc(ndim * sizeof(*strides));
+
+    strides[ndim-1] = 1;
+    for(dd = ndim-2; dd >= 0; dd--)
+        strides[dd] = strides[dd+1]*dims[dd+1];
+
+    for(step=0; step < num_steps; step++){
+        for(dd = 0; dd < ndim; dd++)
+            phi[strides[dd]] += injects[dd];
+        offset = 0;
+        for(dd = 0; dd < ndim; dd++){
+            if(!frozen[dd])
+                implicit_shared(phi, &acoeffs[offset], &gams[3*offset],
+                        &ibets[3*offset], dt, size, dims[dd], strides[dd],
+                        0, -1);
+            offset += dims[dd];
+        }
+    }
+    free(strides);
+}
@@ -12,6 +12,12 @@ double Vfunc_beta(double x, double nu, double beta){
 double Mfunc1D(double x, double gamma, double h){
     return gamma * 2*(h + (1.-2*h)*x) * x*(1.-x);
 }
+double Vfunc_X(double x, double nu, double beta){
+    return 1./nu * x*(1.-x) * (2*beta+4.)*(beta+1.)/(9.*beta);
+}
+double Mfunc1D_X(double x, double gamma, double h){
+    return gamma * 4./3. * (0.5+h+x*(1.-2*h)) * x*(1.-x);
+}
 double Mfunc2D(double x, double y, double m, double gamma, double h){
     return m * (y-x) + gamma * 2*(h + (1.-2*h)*x) * x*(1.-x);
 }
@@ -41,10 +47,30 @@ void compute_xInt(double *xx, int N, double *xInt){
         xInt[ii] = 0.5*(xx[ii+1]+xx[ii]);
 }
 
-void compute_delj(double *dx, double *MInt, double *VInt,
+static double fitted_delj(double z){
+    /*
+    Weight of the left end of an interval for fitted fluxes, given
+    z = 2*MInt*dx/VInt. Near z = 0, the series avoids cancellation.
+    */
+    if(fabs(z) < 1e-3)
+        return 0.5 + z/12. - z*z*z/720.;
+    return 1. + 1./expm1(z) - 1./z;
+}
+
+void compute_delj(double *dx, double *MInt, double *VInt, double *V,
         int N, double *delj, int use_delj_trick){
     int ii;
-    double wj, epsj;
+    double wj, epsj, left, right;
+    if(use_delj_trick == 2){
+        for(ii=0; ii < N-1; ii++){
+            delj[ii] = fitted_delj(2*MInt[ii]*dx[ii]/VInt[ii]);
+            left = delj[ii]*V[ii];
+            right = (1-delj[ii])*V[ii+1];
+            MInt[ii] *= (left + right)/VInt[ii];
+            delj[ii] = left/(left + right);
+        }
+        return;
+    }
     if(!use_delj_trick){
         for(ii=0; ii < N-1; ii++)
             delj[ii] = 0.5;
@@ -83,3 +109,89 @@ void compute_abc_nobc(double *dx, double *dfactor,
         c[ii] = -dfactor[ii]*ctemp;
     }
 }
+
+void transpose_tiled(double *in, double *out, int rows, int cols,
+        int in_stride, int out_stride){
+    /* Working in square tiles keeps both the rows being read and the rows
+     * being written in cache.
+     */
+    int ii, jj, ii0, jj0, iimax, jjmax;
+    int tile = 32;
+
+    for(ii0 = 0; ii0 < rows; ii0 += tile){
+        iimax = ii0 + tile < rows ? ii0 + tile : rows;
+        for(jj0 = 0; jj0 < cols; jj0 += tile){
+            jjmax = jj0 + tile < cols ? jj0 + tile : cols;
+            for(ii = ii0; ii < iimax; ii++)
+                for(jj = jj0; jj < jjmax; jj++)
+                    out[jj*out_stride + ii] = in[ii*in_stride + jj];
+        }
+    }
+}
+
+void transpose_tiled_fl(float *in, float *out, int rows, int cols,
+        int in_stride, int out_stride){
+    int ii, jj, ii0, jj0, iimax, jjmax;
+    int tile = 32;
+
+    for(ii0 = 0; ii0 < rows; ii0 += tile){
+        iimax = ii0 + tile < rows ? ii0 + tile : rows;
+        for(jj0 = 0; jj0 < cols; jj0 += tile){
+            jjmax = jj0 + tile < cols ? jj0 + tile : cols;
+            for(ii = ii0; ii < iimax; ii++)
+                for(jj = jj0; jj < jjmax; jj++)
+                    out[jj*out_stride + ii] = in[ii*in_stride + jj];
+        }
+    }
+}
+
+void tridiag_split_batch(double *aM, double *bM, double *cM,
+        double *aV, double *bV, double *cV, double inv_nu, double shift,
+        double bfirst, double blast, double *r, double rscale, double *u,
+        double *gam, double *bet, int n, int m, int stride){
+    /* Element j of system k is at j*stride + k in aM, bM, cM, r, u, and gam.
+     * aV, bV, and cV are shared by all the systems.
+     */
+    int j, k, kend;
+    int row, prev;
+    double aj, bj, aVj, bVj, cVprev;
+
+    bVj = inv_nu*bV[0] + shift;
+    for(k=0; k < m; k++){
+        bet[k] = bM[k] + bVj;
+        if(k == 0)
+            bet[k] += bfirst;
+        u[k] = rscale*r[k]/bet[k];
+    }
+
+    for(j=1; j <= n-1; j++){
+        row = j*stride;
+        prev = (j-1)*stride;
+        aVj = inv_nu*aV[j];
+        bVj = inv_nu*bV[j] + shift;
+        cVprev = inv_nu*cV[j-1];
+        /* The last system's last element is done separately, to add blast. */
+        kend = (j == n-1) ? m-1 : m;
+        for(k=0; k < kend; k++){
+            gam[row+k] = (cM[prev+k] + cVprev)/bet[k];
+            aj = aM[row+k] + aVj;
+            bet[k] = bM[row+k] + bVj - aj*gam[row+k];
+            u[row+k] = (rscale*r[row+k] - aj*u[prev+k])/bet[k];
+        }
+    }
+    row = (n-1)*stride;
+    prev = (n-2)*stride;
+    k = m-1;
+    gam[row+k] = (cM[prev+k] + inv_nu*cV[n-2])/bet[k];
+    aj = aM[row+k] + inv_nu*aV[n-1];
+    bj = bM[row+k] + inv_nu*bV[n-1] + shift + blast;
+    bet[k] = bj - aj*gam[row+k];
+    u[row+k] = (rscale*r[row+k] - aj*u[prev+k])/bet[k];
+
+    for(j=(n-2); j >= 0; j--){
+        row = j*stride;
+        prev = (j+1)*stride;
+        for(k=0; k < m; k++)
+            u[row+k] -= gam[prev+k]*u[prev+k];
+    }
+}
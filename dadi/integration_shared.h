@@ -8,6 +8,9 @@ double Mfunc1D(double x, double gamma, double h);
 double Mfunc2D(double x, double y, double m, double gamma, double h);
 double Mfunc3D(double x, double y, double z, double mxy, double mxz,
         double gamma, double h);
+/* Versions of Vfunc_beta and Mfunc1D for an X chromosome. */
+double Vfunc_X(double x, double nu, double beta);
+double Mfunc1D_X(double x, double gamma, double h);
 
 /* Differences between x values.
  */
@@ -19,10 +22,16 @@ void compute_xInt(double *xx, int N, double *xInt);
  * conservation given the trapezoid rule.
  */
 void compute_dfactor(double *dx, int N, double *dfactor);
-/* Chang and Cooper's delj factor, if use_delj_trick is True. Else just returns
+/* Chang and Cooper's delj factor, if use_delj_trick is 1. Else just returns
  * an array of 0.5.
+ *
+ * If use_delj_trick is 2, the fluxes are instead exponentially fitted: they
+ * weight V*phi at the ends of each interval by Chang and Cooper's factor, so
+ * solutions of constant flux and constant 2M/V are exact at the grid points.
+ * That is done by also rescaling MInt in place, so the fluxes still have the
+ * form compute_abc_nobc expects.
  */
-void compute_delj(double *dx, double *MInt, double *VInt,
+void compute_delj(double *dx, double *MInt, double *VInt, double *V,
         int N, double *delj, int use_delj_trick);
 /* a,b,c arrays for use with tridiag, corresponding to a fully implicit
  * integration. Doing them simultaneously allows an easy but minor optimization.
@@ -30,3 +39,23 @@ void compute_delj(double *dx, double *MInt, double *VInt,
 void compute_abc_nobc(double *dx, double *dfactor, 
         double *delj, double *MInt, double *V, double dt, int N,
         double *a, double *b, double *c);
+/* Copy the rows x cols block in into out, transposed. Element (ii,jj) of the
+ * block is in[ii*in_stride + jj], and it is written to out[jj*out_stride + ii].
+ */
+void transpose_tiled(double *in, double *out, int rows, int cols,
+        int in_stride, int out_stride);
+/* Single-precision version of transpose_tiled. */
+void transpose_tiled_fl(float *in, float *out, int rows, int cols,
+        int in_stride, int out_stride);
+/* Solve m interleaved tridiagonal systems whose coefficients are split into
+ * a part from selection and migration (aM, bM, cM), which differs between
+ * the systems, and a part from drift (aV, bV, cV), which is shared by them
+ * and scaled by inv_nu. shift is added to the diagonal, and the corner
+ * boundary terms bfirst and blast to the first element of the first system
+ * and the last element of the last system. The right-hand side is rscale*r,
+ * and u may be the same array as r.
+ */
+void tridiag_split_batch(double *aM, double *bM, double *cM,
+        double *aV, double *bV, double *cV, double inv_nu, double shift,
+        double bfirst, double blast, double *r, double rscale, double *u,
+        double *gam, double *bet, int n, int m, int stride);
@@ -1,22 +1,19 @@
 #include <stdlib.h>
 #include "tridiag.h"
 
-double *gam;
+/* None of these functions keep any state between calls. Scratch space is
+ * either passed in by the caller or allocated for the call, so the
+ * integration kernels can run concurrently in different threads with the
+ * GIL released.
+ */
 
-void tridiag_malloc(int n){
-    gam = malloc(n * sizeof(*gam));
-}
-
-void tridiag_free(){
-    free(gam);
-}
-
-void tridiag_premalloc(double a[], double b[], double c[], double r[], double u[], int n){
+void tridiag_premalloc(double a[], double b[], double c[], double r[],
+        double u[], double gam[], int n){
     /*
     Based on Numerical Recipes in C tridiag function.
 
-    This version can re-use dynamically allocated memory in the global gam
-    variable.
+    This version uses the caller's scratch space gam, of n entries, so that
+    it can be re-used for repeated solution of problems of the same size.
     */
     double bet = b[0];
     int j;
@@ -34,9 +31,248 @@ void tridiag_premalloc(double a[], double b[], double c[], double r[], double u[
 }
 
 void tridiag(double a[], double b[], double c[], double r[], double u[], int n){
-    tridiag_malloc(n);
-    tridiag_premalloc(a,b,c,r,u,n);
-    tridiag_free();
+    double *gam = malloc(n * sizeof(*gam));
+    tridiag_premalloc(a,b,c,r,u,gam,n);
+    free(gam);
+}
+
+void tridiag_batch_premalloc(double a[], double b[], double c[], double r[],
+        double u[], double gam[], double bet[], int n, int m, int stride){
+    /*
+    Solve m tridiagonal systems of size n simultaneously.
+
+    Element j of system k is stored at index j*stride + k of a, b, c, r, and
+    u, so the m systems are interleaved and the inner loops below run over
+    contiguous memory. u may be the same array as r.
+
+    gam must have room for n*m entries and bet for m entries.
+    */
+    int j, k;
+    double *a_row, *b_row, *c_prev, *r_row, *u_row, *u_prev, *gam_row;
+
+    for(k=0; k < m; k++){
+        bet[k] = b[k];
+        u[k] = r[k]/bet[k];
+    }
+    for(j=1; j <= n-1; j++){
+        a_row = &a[j*stride];
+        b_row = &b[j*stride];
+        c_prev = &c[(j-1)*stride];
+        r_row = &r[j*stride];
+        u_row = &u[j*stride];
+        u_prev = &u[(j-1)*stride];
+        gam_row = &gam[j*m];
+        for(k=0; k < m; k++){
+            gam_row[k] = c_prev[k]/bet[k];
+            bet[k] = b_row[k] - a_row[k]*gam_row[k];
+            u_row[k] = (r_row[k]-a_row[k]*u_prev[k])/bet[k];
+        }
+    }
+
+    for(j=(n-2); j >= 0; j--){
+        u_row = &u[j*stride];
+        u_prev = &u[(j+1)*stride];
+        gam_row = &gam[(j+1)*m];
+        for(k=0; k < m; k++)
+            u_row[k] -= gam_row[k]*u_prev[k];
+    }
+}
+
+void tridiag_batch(double a[], double b[], double c[], double r[], double u[],
+        int L, int M, int axis){
+    /*
+    Solve the tridiagonal systems stored in the LxM arrays a, b, c, and r.
+
+    If axis is 0, each of the M columns is a system of size L. If axis is 1,
+    each of the L rows is a system of size M.
+    */
+    int ii;
+    double *gam_batch, *bet;
+
+    if(axis == 0){
+        gam_batch = malloc(L*M * sizeof(*gam_batch));
+        bet = malloc(M * sizeof(*bet));
+        tridiag_batch_premalloc(a, b, c, r, u, gam_batch, bet, L, M, M);
+        free(gam_batch);
+        free(bet);
+    }
+    else{
+        gam_batch = malloc(M * sizeof(*gam_batch));
+        for(ii=0; ii < L; ii++)
+            tridiag_premalloc(&a[ii*M], &b[ii*M], &c[ii*M], &r[ii*M],
+                    &u[ii*M], gam_batch, M);
+        free(gam_batch);
+    }
+}
+
+void tridiag_factor_batch(double a[], double b[], double c[], double shift,
+        double gam[], double ibet[], int n, int m, int stride){
+    /*
+    Factor m interleaved tridiagonal systems with diagonal b+shift.
+
+    The layout is as in tridiag_batch_premalloc, and gam and ibet are stored
+    in the same layout as a, b, and c. ibet holds the inverses of the pivots,
+    so that solving with tridiag_factored_batch involves no divisions.
+    */
+    int j, k;
+    int row, prev;
+
+    for(k=0; k < m; k++)
+        ibet[k] = 1./(b[k] + shift);
+    for(j=1; j <= n-1; j++){
+        row = j*stride;
+        prev = (j-1)*stride;
+        for(k=0; k < m; k++){
+            gam[row+k] = c[prev+k]*ibet[prev+k];
+            ibet[row+k] = 1./(b[row+k] + shift - a[row+k]*gam[row+k]);
+        }
+    }
+}
+
+void tridiag_factored_batch(double a[], double gam[], double ibet[],
+        double r[], double rscale, double u[], int n, int m, int stride){
+    /*
+    Solve m interleaved systems factored by tridiag_factor_batch, with
+    right-hand side rscale*r. u may be the same array as r.
+    */
+    int j, k;
+    int row, prev;
+
+    for(k=0; k < m; k++)
+        u[k] = rscale*r[k]*ibet[k];
+    for(j=1; j <= n-1; j++){
+        row = j*stride;
+        prev = (j-1)*stride;
+        for(k=0; k < m; k++)
+            u[row+k] = (rscale*r[row+k] - a[row+k]*u[prev+k])*ibet[row+k];
+    }
+
+    for(j=(n-2); j >= 0; j--){
+        row = j*stride;
+        prev = (j+1)*stride;
+        for(k=0; k < m; k++)
+            u[row+k] -= gam[prev+k]*u[prev+k];
+    }
+}
+
+void tridiag_factor(double a[], double b[], double c[], double gam[],
+        double ibet[], int n){
+    tridiag_factor_batch(a, b, c, 0, gam, ibet, n, 1, 1);
+}
+
+void tridiag_factored(double a[], double gam[], double ibet[], double r[],
+        double u[], int n){
+    tridiag_factored_batch(a, gam, ibet, r, 1, u, n, 1, 1);
+}
+
+void tridiag_factor_batch_fl(float a[], float b[], float c[], double shift,
+        float gam[], float ibet[], int n, int m, int stride){
+    /*
+    Single-precision version of tridiag_factor_batch. The arithmetic is done
+    in double precision, and only the stored factors are rounded.
+    */
+    int j, k;
+    int row, prev;
+    double g;
+
+    for(k=0; k < m; k++)
+        ibet[k] = (float)(1./(b[k] + shift));
+    for(j=1; j <= n-1; j++){
+        row = j*stride;
+        prev = (j-1)*stride;
+        for(k=0; k < m; k++){
+            g = (double)c[prev+k]*ibet[prev+k];
+            gam[row+k] = (float)g;
+            ibet[row+k] = (float)(1./(b[row+k] + shift - a[row+k]*g));
+        }
+    }
+}
+
+static void factored_batch_mixed(float a[], float gam[], float ibet[],
+        int stride, double r[], double u[], int n, int m){
+    /*
+    Solve m systems factored by tridiag_factor_batch_fl, in double precision.
+    Here r and u hold the systems interleaved with stride m, while the
+    factors have the given stride. u may be the same array as r.
+    */
+    int j, k;
+
+    for(k=0; k < m; k++)
+        u[k] = r[k]*ibet[k];
+    for(j=1; j <= n-1; j++)
+        for(k=0; k < m; k++)
+            u[j*m+k] = (r[j*m+k] - a[j*stride+k]*u[(j-1)*m+k])
+                *ibet[j*stride+k];
+
+    for(j=(n-2); j >= 0; j--)
+        for(k=0; k < m; k++)
+            u[j*m+k] -= gam[(j+1)*stride+k]*u[(j+1)*m+k];
+}
+
+void tridiag_factored_batch_fl(float a[], float b[], float c[], float gam[],
+        float ibet[], double shift, float r[], double rscale, float u[],
+        int refine, double work[], int n, int m, int stride){
+    /*
+    Solve m interleaved systems factored by tridiag_factor_batch_fl, with
+    right-hand side rscale*r. u may be the same array as r.
+
+    Without refinement, the solve is entirely in single precision. With it,
+    the systems are solved in blocks of up to REFINE_BLOCK, so that the
+    double-precision scratch space stays small. For each block, x holds the
+    solution and res the right-hand side and then the residual.
+    */
+    int j, k, k0, mb;
+    int row;
+    float fscale = (float)rscale;
+    double Ax;
+    double *x, *res;
+
+    if(!refine){
+        for(k=0; k < m; k++)
+            u[k] = fscale*r[k]*ibet[k];
+        for(j=1; j <= n-1; j++){
+            row = j*stride;
+            for(k=0; k < m; k++)
+                u[row+k] = (fscale*r[row+k] - a[row+k]*u[row-stride+k])
+                    *ibet[row+k];
+        }
+        for(j=(n-2); j >= 0; j--){
+            row = j*stride;
+            for(k=0; k < m; k++)
+                u[row+k] -= gam[row+stride+k]*u[row+stride+k];
+        }
+        return;
+    }
+
+    for(k0=0; k0 < m; k0 += REFINE_BLOCK){
+        mb = (m - k0 < REFINE_BLOCK) ? m - k0 : REFINE_BLOCK;
+        x = work;
+        res = &work[n*mb];
+
+        for(j=0; j < n; j++)
+            for(k=0; k < mb; k++)
+                res[j*mb+k] = rscale*r[j*stride+k0+k];
+        factored_batch_mixed(&a[k0], &gam[k0], &ibet[k0], stride, res, x,
+                n, mb);
+
+        for(j=0; j < n; j++){
+            row = j*stride + k0;
+            for(k=0; k < mb; k++){
+                Ax = (b[row+k] + shift)*x[j*mb+k];
+                if(j > 0)
+                    Ax += a[row+k]*x[(j-1)*mb+k];
+                if(j < n-1)
+                    Ax += c[row+k]*x[(j+1)*mb+k];
+                res[j*mb+k] -= Ax;
+            }
+        }
+        factored_batch_mixed(&a[k0], &gam[k0], &ibet[k0], stride, res, res,
+                n, mb);
+
+        for(j=0; j < n; j++)
+            for(k=0; k < mb; k++)
+                u[j*stride+k0+k] = (float)(x[j*mb+k] + res[j*mb+k]);
+    }
 }
 
 void tridiag_fl(float a[], float b[], float c[], float r[], float u[], int n){
@@ -3,10 +3,49 @@
 void tridiag(double a[], double b[], double c[], double r[], double u[], int n);
 void tridiag_fl(float a[], float b[], float c[], float r[], float u[], int n);
 
-void tridiag_malloc(int n);
-void tridiag_free();
-/* This version of tridiag uses previously allocated memory, for slighly *
- * improved performance with repeated solution of problems of the same size.
+/* This version of tridiag uses the caller's scratch space gam, of n entries,
+ * for slighly improved performance with repeated solution of problems of the
+ * same size.
  */
-void tridiag_premalloc(double a[], double b[], double c[], double r[], double u[], int n);
+void tridiag_premalloc(double a[], double b[], double c[], double r[],
+        double u[], double gam[], int n);
+
+/* Solve m interleaved systems of size n at once. Element j of system k is at
+ * index j*stride + k. gam must hold n*m entries and bet m entries.
+ */
+void tridiag_batch_premalloc(double a[], double b[], double c[], double r[],
+        double u[], double gam[], double bet[], int n, int m, int stride);
+/* Solve the systems along the given axis of LxM arrays. */
+void tridiag_batch(double a[], double b[], double c[], double r[], double u[],
+        int L, int M, int axis);
+
+/* Factor interleaved systems with diagonal b+shift once, so that systems
+ * with the same matrix can then be solved with only the substitution sweeps.
+ * gam and ibet have the same layout as a, b, and c.
+ */
+void tridiag_factor_batch(double a[], double b[], double c[], double shift,
+        double gam[], double ibet[], int n, int m, int stride);
+/* Solve systems factored by tridiag_factor_batch, with right-hand side
+ * rscale*r. u may be the same array as r.
+ */
+void tridiag_factored_batch(double a[], double gam[], double ibet[],
+        double r[], double rscale, double u[], int n, int m, int stride);
+void tridiag_factor(double a[], double b[], double c[], double gam[],
+        double ibet[], int n);
+void tridiag_factored(double a[], double gam[], double ibet[], double r[],
+        double u[], int n);
+
+/* Single-precision versions of tridiag_factor_batch and
+ * tridiag_factored_batch. The factors are computed in double precision and
+ * stored in single. If refine is nonzero, each solution is improved by one
+ * step of iterative refinement, with the residual of the systems with
+ * diagonal b+shift computed in double precision. work must then have room
+ * for 2*n*REFINE_BLOCK entries. Otherwise b, c, and work are not used.
+ */
+#define REFINE_BLOCK 32
+void tridiag_factor_batch_fl(float a[], float b[], float c[], double shift,
+        float gam[], float ibet[], int n, int m, int stride);
+void tridiag_factored_batch_fl(float a[], float b[], float c[], float gam[],
+        float ibet[], double shift, float r[], double rscale, float u[],
+        int refine, double work[], int n, int m, int stride);
 #endif
@@ -23,6 +23,33 @@ class AdmixtureTestCase(unittest.TestCase):
         admix_props = [[0.2,0.8],[0.9,0.1]]
         self.assertRaises(ValueError, dadi.Spectrum.from_phi, phi, [2,2], [xx,xx], het_ascertained=['xx', 'yy'])
 
+    def test_many_pop_admixture(self):
+        """
+        Test the admixture operators for any dimension against the 3D ones.
+        """
+        xx = dadi.Numerics.default_grid(15)
+        phi = dadi.PhiManip.phi_1D(xx)
+        phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        phi = two_pops(phi, xx, 0.1, nu1=0.5, nu2=2)
+        phi3 = dadi.PhiManip.phi_2D_to_3D_admix(phi, 0.3, xx,xx,xx)
+        phi3 = three_pops(phi3, xx, 0.05, nu3=0.5)
+
+        phi4 = dadi.PhiManip.phi_3D_to_4D_admix(phi3, 0.2,0.5, xx,xx,xx,xx)
+        self.assertEqual(phi4.shape, (15,15,15,15))
+        self.assert_(numpy.allclose(dadi.PhiManip.remove_pop(phi4, xx, 4),
+                                    phi3))
+
+        for popnum, admix in [(1, dadi.PhiManip.phi_3D_admix_2_and_3_into_1),
+                              (2, dadi.PhiManip.phi_3D_admix_1_and_3_into_2),
+                              (3, dadi.PhiManip.phi_3D_admix_1_and_2_into_3)]:
+            fs = [0.2, 0.3, 0.1]
+            fs[popnum-1] = 0
+            others = [f for f in fs if f]
+            expected = admix(phi3.copy(), others[0], others[1], xx,xx,xx)
+            result = dadi.PhiManip.phi_admix_into(phi3.copy(), popnum, fs,
+                                                  [xx,xx,xx])
+            self.assert_(numpy.allclose(result, expected))
+
 suite = unittest.TestLoader().loadTestsFromTestCase(AdmixtureTestCase)
 
 if __name__ == '__main__':
@@ -0,0 +1,645 @@
+import unittest
+import numpy
+import dadi
+from dadi import Integration
+
+class IntegrationTestCase(unittest.TestCase):
+    """
+    Test alternative integration strategies against the default ones.
+    """
+    xx = dadi.Numerics.default_grid(20)
+    phi1D = dadi.PhiManip.phi_1D(xx)
+    phi2D = dadi.PhiManip.phi_1D_to_2D(xx, phi1D)
+    phi3D = dadi.PhiManip.phi_2D_to_3D_split_2(xx, phi2D)
+
+    def test_threaded_sweeps(self):
+        """
+        Test that splitting sweeps among threads doesn't change results.
+        """
+        nu1_func = lambda t: 0.5 + t
+        results = []
+        for num_threads in [1,3]:
+            Integration.num_threads = num_threads
+            try:
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                            nu2=2, m12=1, m21=0.3, gamma1=1)
+                phi2t = Integration.two_pops(self.phi2D, self.xx, 0.1,
+                                             nu1=nu1_func, nu2=2, m12=1)
+                phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                              nu1=0.5, nu2=2, m12=1, m32=0.2,
+                                              gamma3=1)
+                phi3t = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                               nu1=nu1_func, m21=0.3)
+            finally:
+                Integration.num_threads = 1
+            results.append((phi2, phi2t, phi3, phi3t))
+
+        for serial, threaded in zip(*results):
+            self.assert_(numpy.allclose(serial, threaded, rtol=1e-12))
+
+    def test_concurrent_models(self):
+        """
+        Test that model evaluations in concurrent threads don't interfere.
+        """
+        import threading
+        def model(nu, results, index):
+            phi = Integration.one_pop(self.phi1D, self.xx, 0.1, nu=nu)
+            phi = dadi.PhiManip.phi_1D_to_2D(self.xx, phi)
+            phi = Integration.two_pops(phi, self.xx, 0.1, nu1=nu,
+                                       nu2=lambda t: 1 + t, m12=1, m21=2)
+            phi = dadi.PhiManip.phi_2D_to_3D_split_2(self.xx, phi)
+            results[index] = Integration.three_pops(phi, self.xx, 0.05,
+                                                    nu1=nu, m13=1, m32=0.5)
+
+        nus = [0.5, 1, 2, 0.5, 1, 2]
+        serial = [None]*len(nus)
+        for ii, nu in enumerate(nus):
+            model(nu, serial, ii)
+        Integration.clear_checkpoints()
+
+        # The repeated models share the checkpoint cache.
+        concurrent = [None]*len(nus)
+        threads = [threading.Thread(target=model, args=(nu, concurrent, ii))
+                   for ii, nu in enumerate(nus)]
+        Integration.checkpoint_cache_bytes = 2**27
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            Integration.checkpoint_cache_bytes = 0
+            Integration.clear_checkpoints()
+        for expected, result in zip(serial, concurrent):
+            self.assert_(numpy.all(result == expected))
+
+        # The adaptive timesteps, the dominance profiles, and the thread pool
+        # are shared as well, and each integration stops at equilibrium on
+        # its own.
+        def burn_in(nu, results, index):
+            phi = dadi.PhiManip.phi_1D(self.xx, gamma=2, h=0.2)
+            phi = Integration.one_pop(phi, self.xx, 20, nu=nu, gamma=2, h=0.2)
+            phi = dadi.PhiManip.phi_1D_to_2D(self.xx, phi)
+            results[index] = Integration.two_pops(phi, self.xx, 0.1, nu1=nu,
+                                                  m12=1, m21=2)
+        Integration.num_threads = 2
+        try:
+            for adaptive, shortcut in [(True, None), (False, 'stop')]:
+                Integration.use_adaptive_timesteps = adaptive
+                Integration.equilibrium_shortcut = shortcut
+                for ii, nu in enumerate(nus):
+                    burn_in(nu, serial, ii)
+                threads = [threading.Thread(target=burn_in,
+                                            args=(nu, concurrent, ii))
+                           for ii, nu in enumerate(nus)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                for expected, result in zip(serial, concurrent):
+                    self.assert_(numpy.all(result == expected))
+        finally:
+            Integration.use_adaptive_timesteps = False
+            Integration.equilibrium_shortcut = None
+            Integration.num_threads = 1
+
+    def test_epoch_drivers(self):
+        """
+        Test that the C drivers for whole epochs match stepping in Python.
+        """
+        # With multiple threads, the steps are taken in Python.
+        results = []
+        for num_threads in [1,2]:
+            Integration.num_threads = num_threads
+            try:
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                            nu2=2, gamma2=1, frozen1=True)
+                phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                              nu1=0.5, nu3=2, m13=1, m31=0.2,
+                                              gamma3=1, frozen2=True)
+            finally:
+                Integration.num_threads = 1
+            results.append((phi2, phi3))
+
+        for driver, python in zip(*results):
+            self.assert_(numpy.allclose(driver, python, rtol=1e-12))
+
+    def test_planned_steps(self):
+        """
+        Test time-dependent integrations with parameters evaluated up front.
+        """
+        # This function can't be evaluated on an array of times, and it
+        # changes the coefficients from migration partway through.
+        m12_func = lambda t: 1 if t < 0.02 else 2
+        nu1_func = lambda t: 0.5 + t
+        # With multiple threads, the steps are taken in Python.
+        results = []
+        for num_threads in [1,2]:
+            Integration.num_threads = num_threads
+            try:
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.05,
+                                            nu1=nu1_func, m12=m12_func,
+                                            gamma2=1)
+                phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                              nu1=nu1_func, m13=m12_func,
+                                              gamma3=1, frozen2=True)
+            finally:
+                Integration.num_threads = 1
+            results.append((phi2, phi3))
+
+        for driver, python in zip(*results):
+            self.assert_(numpy.allclose(driver, python, rtol=1e-12))
+
+        # Invalid parameters at any time should be caught.
+        self.assertRaises(ValueError, Integration.one_pop, self.phi1D,
+                          self.xx, 0.1, nu=lambda t: 1 - 20*t)
+
+    def test_transposed_sweeps(self):
+        """
+        Test that transposed sweeps don't change results.
+        """
+        results = []
+        for transposed in [False, True]:
+            Integration.use_transposed_sweeps = transposed
+            try:
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                            nu2=2, m12=1, m21=0.3, gamma2=1)
+                phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                              nu1=0.5, nu3=2, m13=1, m32=0.2,
+                                              gamma3=1)
+            finally:
+                Integration.use_transposed_sweeps = True
+            results.append((phi2, phi3))
+
+        for plain, transposed in zip(*results):
+            self.assert_(numpy.allclose(plain, transposed, rtol=1e-12))
+
+    def test_single_precision(self):
+        """
+        Test single-precision integrations against double precision.
+        """
+        def integrate():
+            phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                        nu2=2, m12=1, m21=0.3, gamma2=1)
+            phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05, nu1=0.5,
+                                          nu3=2, m13=1, m32=0.2, gamma3=1)
+            return phi2, phi3
+
+        double = integrate()
+        Integration.use_single_precision = True
+        try:
+            single = integrate()
+            Integration.num_threads = 2
+            threaded = integrate()
+        finally:
+            Integration.use_single_precision = False
+            Integration.num_threads = 1
+
+        for phi_double, phi_single, phi_threaded in zip(double, single,
+                                                        threaded):
+            self.assertEqual(phi_single.dtype, numpy.float64)
+            self.assert_(numpy.allclose(phi_single, phi_double, rtol=1e-4))
+            self.assert_(numpy.allclose(phi_threaded, phi_single, rtol=1e-6))
+
+    def test_split_coefficients(self):
+        """
+        Test the split coefficients of the time-dependent integrations.
+        """
+        # With constant functions for the parameters, the time-dependent
+        # integrations should match the constant-parameter integrations.
+        const = lambda val: lambda t: val
+        phi2 = Integration.two_pops(self.phi2D, self.xx, 0.05, nu1=0.5,
+                                    nu2=2, m12=1, m21=0.3, gamma1=1, h2=0.2)
+        phi2t = Integration.two_pops(self.phi2D, self.xx, 0.05,
+                                     nu1=const(0.5), nu2=2, m12=const(1),
+                                     m21=0.3, gamma1=1, h2=0.2)
+        phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05, nu1=0.5,
+                                      nu3=2, m12=1, m13=0.5, m32=0.2,
+                                      gamma3=1, h2=0.2)
+        phi3t = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                       nu1=const(0.5), nu3=2, m12=1,
+                                       m13=const(0.5), m32=0.2, gamma3=1,
+                                       h2=0.2)
+        self.assert_(numpy.allclose(phi2, phi2t, rtol=1e-10))
+        self.assert_(numpy.allclose(phi3, phi3t, rtol=1e-10))
+
+    def test_workspace(self):
+        """
+        Test that reusing the workspace doesn't change results.
+        """
+        Integration.clear_workspace()
+        phi3 = Integration.three_pops(self.phi3D, self.xx, 0.05, nu1=0.5,
+                                      nu3=2, m12=1, m32=0.2, gamma3=1)
+        work = Integration._work_arrays('z', (20,20,20), 3)
+        # Dirty the arrays, which should then be reset.
+        for arr in work:
+            arr.fill(numpy.nan)
+        again = Integration.three_pops(self.phi3D, self.xx, 0.05, nu1=0.5,
+                                       nu3=2, m12=1, m32=0.2, gamma3=1)
+        self.assert_(Integration._work_arrays('z', (20,20,20), 3) is work)
+        self.assert_(numpy.all(phi3 == again))
+
+    def test_adaptive_timesteps(self):
+        """
+        Test adaptive timesteps on a long equilibration.
+        """
+        phi = Integration.one_pop(self.phi1D, self.xx, 10, nu=2, gamma=1)
+        fixed_steps = len(Integration.last_timesteps)
+
+        Integration.use_adaptive_timesteps = True
+        try:
+            adaptive = Integration.one_pop(self.phi1D, self.xx, 10, nu=2,
+                                           gamma=1)
+            adaptive_steps = Integration.last_timesteps
+
+            # The same timesteps should be used on other grids, so that
+            # extrapolation works.
+            xx = dadi.Numerics.default_grid(30)
+            Integration.one_pop(dadi.PhiManip.phi_1D(xx), xx, 10, nu=2,
+                                gamma=1)
+            self.assertEqual(Integration.last_timesteps, adaptive_steps)
+
+            # Timesteps chosen under one time scheme aren't reused for
+            # another.
+            Integration.time_scheme = 'expm'
+            Integration.one_pop(self.phi1D, self.xx, 1, nu=0.5, gamma=1)
+            expm_steps = Integration.last_timesteps
+            Integration.time_scheme = 'euler'
+            euler = Integration.one_pop(self.phi1D, self.xx, 1, nu=0.5,
+                                        gamma=1)
+            self.assertNotEqual(Integration.last_timesteps, expm_steps)
+        finally:
+            Integration.use_adaptive_timesteps = False
+            Integration.time_scheme = 'euler'
+
+        expected = Integration.one_pop(self.phi1D, self.xx, 1, nu=0.5, gamma=1)
+        self.assert_(numpy.allclose(euler, expected, rtol=2e-2))
+        self.assert_(len(adaptive_steps) < fixed_steps/10)
+        self.assertAlmostEqual(sum(dt for t,dt in adaptive_steps), 10)
+        self.assert_(numpy.allclose(phi, adaptive, rtol=1e-2))
+
+    def test_crank_nicolson(self):
+        """
+        Test that Crank-Nicolson is more accurate than implicit Euler.
+        """
+        def integrate(time_scheme, timescale_factor):
+            Integration.time_scheme = time_scheme
+            Integration.timescale_factor = timescale_factor
+            try:
+                phi1 = Integration.one_pop(self.phi1D, self.xx, 0.2, nu=0.2,
+                                           gamma=2)
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                            nu2=3, m12=1, m21=0.3, gamma1=1)
+            finally:
+                Integration.time_scheme = 'euler'
+                Integration.timescale_factor = 1e-3
+            fs1 = dadi.Spectrum.from_phi(phi1, (10,), (self.xx,))
+            fs2 = dadi.Spectrum.from_phi(phi2, (6,6), (self.xx,self.xx))
+            return fs1, fs2
+
+        exact = integrate('cn', 1e-5)
+        euler = integrate('euler', 1e-2)
+        cn = integrate('cn', 1e-2)
+        for fs_exact, fs_euler, fs_cn in zip(exact, euler, cn):
+            err_euler = numpy.ma.max(abs(fs_euler - fs_exact)/fs_exact)
+            err_cn = numpy.ma.max(abs(fs_cn - fs_exact)/fs_exact)
+            self.assert_(err_cn < err_euler/4)
+
+    def test_expm(self):
+        """
+        Test the exact-in-time propagator against fine timesteps.
+        """
+        def integrate(time_scheme, timescale_factor):
+            Integration.time_scheme = time_scheme
+            Integration.timescale_factor = timescale_factor
+            try:
+                phi1 = Integration.one_pop(self.phi1D, self.xx, 0.2, nu=0.2,
+                                           gamma=2)
+                phi1_X = Integration.one_pop_X(self.phi1D, self.xx, 0.2,
+                                               nu=0.2, gamma=2, beta=2)
+                phi2 = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=0.5,
+                                            nu2=3, m12=1, m21=0.3, gamma1=1)
+            finally:
+                Integration.time_scheme = 'euler'
+                Integration.timescale_factor = 1e-3
+            return phi1, phi1_X, phi2
+
+        expm = integrate('expm', 1e-3)
+        self.assertEqual(len(Integration.last_timesteps), 1)
+        # Even these fine timesteps leave errors of order 1e-4 in phi at the
+        # corner of the two-population grid, so the spectra are compared.
+        for phi_expm, phi_cn in zip(expm, integrate('cn', 1e-5)):
+            ns = (10,)*phi_cn.ndim
+            xxs = (self.xx,)*phi_cn.ndim
+            fs_expm = dadi.Spectrum.from_phi(phi_expm, ns, xxs)
+            fs_cn = dadi.Spectrum.from_phi(phi_cn, ns, xxs)
+            self.assert_(numpy.ma.allclose(fs_expm, fs_cn, rtol=1e-6))
+
+        # For long epochs, the result is the equilibrium.
+        Integration.time_scheme = 'expm'
+        try:
+            phi = Integration.one_pop(self.phi1D, self.xx, 100)
+        finally:
+            Integration.time_scheme = 'euler'
+        self.assert_(numpy.allclose(phi, self.phi1D, rtol=1e-3))
+
+    def test_four_and_five_pops(self):
+        """
+        Test four_pops and five_pops against integrations with one fewer
+        population.
+        """
+        # A population split off and frozen only carries along the others,
+        # so integrating it out should give the lower-dimensional result.
+        phi3 = Integration.three_pops(self.phi3D, self.xx, 0.02, nu1=0.5,
+                                      nu3=2, m13=1, m32=0.2, gamma3=1)
+        phi4 = dadi.PhiManip.phi_3D_to_4D_split_3(self.xx, self.phi3D)
+        phi4 = Integration.four_pops(phi4, self.xx, 0.02, nu1=0.5, nu3=2,
+                                     m13=1, m32=0.2, gamma3=1, frozen4=True)
+        self.assertEqual(phi4.shape, (20,20,20,20))
+        self.assert_(numpy.allclose(dadi.PhiManip.remove_pop(phi4, self.xx, 4),
+                                    phi3, rtol=1e-8))
+
+        xx = dadi.Numerics.default_grid(8)
+        phi4 = dadi.PhiManip.phi_3D_to_4D_split_1(
+                xx, dadi.PhiManip.phi_2D_to_3D_split_2(
+                    xx, dadi.PhiManip.phi_1D_to_2D(
+                        xx, dadi.PhiManip.phi_1D(xx))))
+        nu2_func = lambda t: 0.5 + t
+        phi4t = Integration.four_pops(phi4, xx, 0.02, nu2=nu2_func, m12=1,
+                                      m41=0.5, gamma4=1)
+        phi5 = dadi.PhiManip.phi_4D_to_5D_split_2(xx, phi4)
+        phi5 = Integration.five_pops(phi5, xx, 0.02, nu2=nu2_func, m12=1,
+                                     m41=0.5, gamma4=1, frozen5=True)
+        self.assert_(numpy.allclose(dadi.PhiManip.remove_pop(phi5, xx, 5),
+                                    phi4t, rtol=1e-8))
+
+        self.assertRaises(ValueError, Integration.four_pops, phi4, xx, 0.02,
+                          m14=1, frozen4=True)
+
+    def test_one_pop_X(self):
+        """
+        Test time-dependent X chromosome integrations.
+        """
+        const = lambda val: lambda t: val
+        phi = dadi.PhiManip.phi_1D_X(self.xx, gamma=1, h=0.2, beta=2)
+        phi_c = Integration.one_pop_X(phi, self.xx, 0.1, nu=0.5, gamma=1,
+                                      h=0.2, beta=2, alpha=3)
+        phi_t = Integration.one_pop_X(phi, self.xx, 0.1, nu=const(0.5),
+                                      gamma=1, h=const(0.2), beta=2, alpha=3)
+        self.assert_(numpy.allclose(phi_c, phi_t, rtol=1e-10))
+
+        phi_g = Integration.one_pop_X(phi, self.xx, 0.1,
+                                      nu=lambda t: 0.5 + 20*t, gamma=1,
+                                      h=0.2, beta=2, alpha=3)
+        self.assert_(not numpy.allclose(phi_g, phi_c))
+
+        self.assertRaises(ValueError, Integration.one_pop_X, phi, self.xx,
+                          0.1, nu=lambda t: 1 - 20*t)
+
+    def test_checkpoints(self):
+        """
+        Test reuse of the results of identical integrations.
+        """
+        Integration.clear_checkpoints()
+        Integration.checkpoint_cache_bytes = 2**27
+        try:
+            nu1_func = lambda t: 0.5 + t
+            phi1 = Integration.one_pop(self.phi1D, self.xx, 0.1, nu=2,
+                                       gamma=1)
+            phi2 = dadi.PhiManip.phi_1D_to_2D(self.xx, phi1)
+            phi2 = Integration.two_pops(phi2, self.xx, 0.05, nu1=nu1_func,
+                                        m12=1)
+            self.assertEqual(len(Integration._checkpoints), 2)
+
+            # Changing only the last epoch reuses the first.
+            again1 = Integration.one_pop(self.phi1D, self.xx, 0.1, nu=2,
+                                         gamma=1)
+            self.assert_(numpy.all(again1 == phi1))
+            self.assertEqual(len(Integration._checkpoints), 2)
+            again2 = dadi.PhiManip.phi_1D_to_2D(self.xx, again1)
+            again2 = Integration.two_pops(again2, self.xx, 0.05,
+                                          nu1=lambda t: 0.5 + 2*t, m12=1)
+            self.assertEqual(len(Integration._checkpoints), 3)
+            self.assert_(not numpy.allclose(again2, phi2))
+
+            # Stored results are protected from changes to those returned.
+            again1 *= 2
+            again1 = Integration.one_pop(self.phi1D, self.xx, 0.1, nu=2,
+                                         gamma=1)
+            self.assert_(numpy.all(again1 == phi1))
+
+            # The least recently used results are dropped to respect the
+            # bound.
+            Integration.checkpoint_cache_bytes = 2*phi2.nbytes
+            Integration.one_pop(self.phi1D, self.xx, 0.1, nu=2, gamma=1)
+            Integration.two_pops(phi2, self.xx, 0.01, nu1=0.5)
+            self.assert_(sum(arr.nbytes for arr, t in
+                             Integration._checkpoints.values())
+                         <= Integration.checkpoint_cache_bytes)
+            self.assertEqual(len(Integration._checkpoints), 2)
+        finally:
+            Integration.checkpoint_cache_bytes = 0
+            Integration.clear_checkpoints()
+
+    def test_equilibrium_shortcut(self):
+        """
+        Test stopping integrations early once phi is at equilibrium.
+        """
+        Integration.clear_checkpoints()
+        full1 = Integration.one_pop(self.phi1D, self.xx, 20, nu=2, gamma=-1)
+        self.assertEqual(Integration.last_equilibrium, None)
+        phi2 = dadi.PhiManip.phi_1D_to_2D(self.xx, full1)
+        full2 = Integration.two_pops(phi2, self.xx, 40, nu1=2, m12=1, m21=1)
+
+        Integration.checkpoint_cache_bytes = 2**27
+        try:
+            for shortcut in ['solve', 'stop']:
+                Integration.equilibrium_shortcut = shortcut
+                phi1 = Integration.one_pop(self.phi1D, self.xx, 20, nu=2,
+                                           gamma=-1)
+                self.assert_(Integration.last_equilibrium < 20)
+                self.assert_(numpy.allclose(phi1, full1, rtol=1e-4))
+
+                # Results from the cache report the shortcut too.
+                Integration.last_equilibrium = None
+                Integration.one_pop(self.phi1D, self.xx, 20, nu=2, gamma=-1)
+                self.assert_(Integration.last_equilibrium < 20)
+
+            # Integrations that do not reach equilibrium take every step.
+            Integration.one_pop(self.phi1D, self.xx, 0.1, nu=2)
+            self.assertEqual(Integration.last_equilibrium, None)
+            Integration.one_pop(self.phi1D, self.xx, 20, nu=lambda t: 2)
+            self.assertEqual(Integration.last_equilibrium, None)
+
+            # For two populations, 'solve' acts as 'stop'.
+            Integration.equilibrium_shortcut = 'solve'
+            phi2 = Integration.two_pops(phi2, self.xx, 40, nu1=2, m12=1,
+                                        m21=1)
+            self.assert_(Integration.last_equilibrium < 40)
+            self.assert_(numpy.allclose(phi2, full2, rtol=1e-4))
+        finally:
+            Integration.equilibrium_shortcut = None
+            Integration.checkpoint_cache_bytes = 0
+            Integration.clear_checkpoints()
+
+    def test_batches(self):
+        """
+        Test batched integrations against integrating each member in turn.
+        """
+        # With these parameters, every member has the same standard
+        # timestep, so the results should agree to rounding.
+        nus, hs = [0.5, 1, 2], [0.2, 0.5, 0.8]
+        phis = Integration.one_pop_batch(numpy.array([self.phi1D]*3),
+                                         self.xx, 0.1, nu=nus, gamma=4, h=hs)
+        for phi, nu, h in zip(phis, nus, hs):
+            expected = Integration.one_pop(self.phi1D, self.xx, 0.1, nu=nu,
+                                           gamma=4, h=h)
+            self.assert_(numpy.allclose(phi, expected, rtol=1e-8))
+
+        m12s = [1, 2, 0.5]
+        phis = Integration.two_pops_batch(numpy.array([self.phi2D]*3),
+                                          self.xx, 0.1, nu1=nus, nu2=0.5,
+                                          m12=m12s, m21=2, gamma2=-1)
+        for phi, nu, m12 in zip(phis, nus, m12s):
+            expected = Integration.two_pops(self.phi2D, self.xx, 0.1, nu1=nu,
+                                            nu2=0.5, m12=m12, m21=2,
+                                            gamma2=-1)
+            self.assert_(numpy.allclose(phi, expected, rtol=1e-8))
+
+        phis = Integration.three_pops_batch(numpy.array([self.phi3D]*3),
+                                            self.xx, 0.05, nu3=nus, m13=2,
+                                            m32=m12s, gamma1=1, h1=hs)
+        for phi, nu, m32, h in zip(phis, nus, m12s, hs):
+            expected = Integration.three_pops(self.phi3D, self.xx, 0.05,
+                                              nu3=nu, m13=2, m32=m32,
+                                              gamma1=1, h1=h)
+            self.assert_(numpy.allclose(phi, expected, rtol=1e-8))
+
+        phis2 = numpy.array([self.phi2D]*3)
+        self.assertRaises(ValueError, Integration.two_pops_batch, phis2,
+                          self.xx, 0.1, nu1=lambda t: 1)
+        self.assertRaises(ValueError, Integration.two_pops_batch, phis2,
+                          self.xx, 0.1, nu1=[1, 2])
+        self.assertRaises(ValueError, Integration.two_pops_batch, phis2,
+                          self.xx, 0.1, m12=[1, -1, 1])
+        self.assertRaises(ValueError, Integration.two_pops_batch, self.phi2D,
+                          self.xx, 0.1)
+
+    def test_low_memory(self):
+        """
+        Test three_pops without precomputed operators.
+        """
+        kwargs = {'nu1':0.5, 'nu3':2, 'm12':1, 'm13':2, 'm31':0.5,
+                  'gamma1':1, 'h3':0.2}
+        expected = Integration.three_pops(self.phi3D, self.xx, 0.1, **kwargs)
+        frozen = Integration.three_pops(self.phi3D, self.xx, 0.1, nu1=0.5,
+                                        m13=2, m31=0.5, frozen2=True)
+        Integration.low_memory_threshold = 0
+        try:
+            phi = Integration.three_pops(self.phi3D, self.xx, 0.1, **kwargs)
+            self.assert_(numpy.allclose(phi, expected, rtol=1e-10))
+            phi = Integration.three_pops(self.phi3D, self.xx, 0.1, nu1=0.5,
+                                         m13=2, m31=0.5, frozen2=True)
+            self.assert_(numpy.allclose(phi, frozen, rtol=1e-10))
+
+            Integration.num_threads = 2
+            phi = Integration.three_pops(self.phi3D, self.xx, 0.1, **kwargs)
+            self.assert_(numpy.allclose(phi, expected, rtol=1e-10))
+        finally:
+            Integration.low_memory_threshold = 2**28
+            Integration.num_threads = 1
+
+    def test_shared_operators(self):
+        """
+        Test that sharing operators without migration doesn't change results.
+        """
+        xx, yy, zz = dadi.Numerics.default_grid([20,14,17])
+        phi2 = dadi.PhiManip.phi_1D_to_2D([xx,yy], self.phi1D)
+        phi3 = dadi.PhiManip.phi_2D_to_3D_split_2([xx,yy,zz], phi2)
+        results = []
+        for shared in [False, True]:
+            Integration.use_shared_operators = shared
+            try:
+                phi = [Integration.two_pops(phi2, [xx,yy], 0.1, nu1=0.5,
+                                            nu2=2, gamma1=-2, h1=0.3),
+                       Integration.two_pops(phi2, [xx,yy], 0.1, nu1=0.5,
+                                            gamma2=1, frozen1=True),
+                       Integration.three_pops(phi3, [xx,yy,zz], 0.05,
+                                              nu1=0.5, nu3=2, gamma3=1),
+                       Integration.three_pops(phi3, [xx,yy,zz], 0.05,
+                                              nu3=2, frozen2=True)]
+                Integration.num_threads = 2
+                phi.append(Integration.three_pops(phi3, [xx,yy,zz], 0.05,
+                                                  nu1=0.5, nu3=2, gamma3=1))
+            finally:
+                Integration.use_shared_operators = True
+                Integration.num_threads = 1
+            results.append(phi)
+
+        for plain, shared in zip(*results):
+            self.assert_(numpy.allclose(plain, shared, rtol=1e-10))
+
+    def test_fitted_fluxes(self):
+        """
+        Test that fitted fluxes give more accurate equilibria on coarse grids.
+        """
+        ns = (20,)
+        fine = dadi.Numerics.default_grid(200)
+        expected = dadi.Spectrum.from_phi(dadi.PhiManip.phi_1D(fine, gamma=2),
+                                          ns, (fine,), fitted=True)
+
+        errors = []
+        for fitted in [False, True]:
+            Integration.use_fitted_fluxes = fitted
+            try:
+                phi_c = Integration.one_pop(self.phi1D, self.xx, 20, gamma=2)
+                phi_t = Integration.one_pop(self.phi1D, self.xx, 20,
+                                            nu=lambda t: 1, gamma=2)
+            finally:
+                Integration.use_fitted_fluxes = False
+            self.assert_(numpy.allclose(phi_c, phi_t, rtol=1e-6))
+            fs = dadi.Spectrum.from_phi(phi_c, ns, (self.xx,), fitted=fitted)
+            errors.append(abs(fs/expected - 1).max())
+        self.assert_(errors[1] < errors[0]/10)
+
+    def test_grid_shapes(self):
+        """
+        Test integrations with a different grid for each population.
+        """
+        xx, yy, zz = dadi.Numerics.default_grid([20,14,17])
+        phi2 = dadi.PhiManip.phi_1D_to_2D([xx,yy], self.phi1D)
+        self.assertEqual(phi2.shape, (20,14))
+        phi3 = dadi.PhiManip.phi_2D_to_3D_split_2([xx,yy,zz], phi2)
+        self.assertEqual(phi3.shape, (20,14,17))
+
+        const = lambda val: lambda t: val
+        two = Integration.two_pops(phi2, [xx,yy], 0.05, nu1=0.5, nu2=2,
+                                   m12=1, m21=0.3, gamma1=1)
+        two_t = Integration.two_pops(phi2, [xx,yy], 0.05, nu1=const(0.5),
+                                     nu2=2, m12=1, m21=0.3, gamma1=1)
+        self.assertEqual(two.shape, (20,14))
+        self.assert_(numpy.allclose(two, two_t, rtol=1e-10))
+
+        three = Integration.three_pops(phi3, [xx,yy,zz], 0.05, nu1=0.5,
+                                       nu3=2, m13=1, m32=0.2, gamma3=1)
+        three_t = Integration.three_pops(phi3, [xx,yy,zz], 0.05,
+                                         nu1=const(0.5), nu3=2, m13=1,
+                                         m32=0.2, gamma3=1)
+        self.assert_(numpy.allclose(three, three_t, rtol=1e-10))
+
+        # A frozen fourth population on yet another grid is carried along.
+        aa = dadi.Numerics.default_grid(11)
+        phi4 = dadi.PhiManip.phi_3D_to_4D_split_3([xx,yy,zz,aa], phi3)
+        phi4 = Integration.four_pops(phi4, [xx,yy,zz,aa], 0.05, nu1=0.5,
+                                     nu3=2, m13=1, m32=0.2, gamma3=1,
+                                     frozen4=True)
+        self.assertEqual(phi4.shape, (20,14,17,11))
+        self.assert_(numpy.allclose(dadi.PhiManip.remove_pop(phi4, aa, 4),
+                                    three, rtol=1e-8))
+
+        self.assertRaises(ValueError, Integration.four_pops, phi4, xx, 0.05)
+
+suite = unittest.TestLoader().loadTestsFromTestCase(IntegrationTestCase)
+
+if __name__ == '__main__':
+    unittest.main()
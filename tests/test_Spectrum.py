@@ -416,4 +416,85 @@ class SpectrumTestCase(unittest.TestCase):
         self.assert_(numpy.all(pf1.mask == pf2.mask))
         self.assert_(numpy.allclose(pf1.data, pf2.data))
 
+    def test_from_phi_ND(self):
+        """
+        Test from_phi for any dimension against the 3D methods.
+        """
+        xx = dadi.Numerics.default_grid(15)
+        phi = dadi.PhiManip.phi_1D(xx)
+        phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        phi = dadi.Integration.two_pops(phi, xx, 0.1, nu1=0.5, nu2=2, m12=1)
+        phi = dadi.PhiManip.phi_2D_to_3D_split_2(xx, phi)
+        phi = dadi.Integration.three_pops(phi, xx, 0.05, nu3=0.5, m13=1)
+        ns = (4,5,6)
+
+        for kwargs in [{}, {'force_direct':True}, {'het_ascertained':'yy'}]:
+            fs = dadi.Spectrum.from_phi(phi, ns, (xx,xx,xx), **kwargs)
+            fs_ND = dadi.Spectrum._from_phi_ND(ns, (xx,xx,xx), phi,
+                                               **kwargs)
+            self.assert_(numpy.all(fs.mask == fs_ND.mask))
+            self.assert_(numpy.allclose(fs.data, fs_ND.data))
+
+        # Summing over the samples from a fourth population should give the
+        # 3D spectrum.
+        phi4 = dadi.PhiManip.phi_3D_to_4D_split_3(xx, phi)
+        fs4 = dadi.Spectrum.from_phi(phi4, ns + (3,), (xx,xx,xx,xx))
+        self.assertEqual(fs4.shape, (5,6,7,4))
+        fs = dadi.Spectrum.from_phi(phi, ns, (xx,xx,xx))
+        self.assert_(numpy.allclose(fs4.data.sum(axis=3), fs.data))
+
+    def test_from_phi_batch(self):
+        """
+        Test from_phi_batch against from_phi for each member.
+        """
+        xx = dadi.Numerics.default_grid(15)
+        phi = dadi.PhiManip.phi_1D(xx)
+        phi = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        phis = numpy.array([phi, 2*phi, phi**2])
+        ns = (4,6)
+
+        for kwargs in [{}, {'force_direct':True}, {'het_ascertained':'xx'}]:
+            fss = dadi.Spectrum.from_phi_batch(phis, ns, (xx,xx),
+                                               pop_ids=['A','B'], **kwargs)
+            self.assertEqual(len(fss), 3)
+            for fs_batch, phi in zip(fss, phis):
+                fs = dadi.Spectrum.from_phi(phi, ns, (xx,xx), **kwargs)
+                self.assert_(numpy.all(fs.mask == fs_batch.mask))
+                self.assert_(numpy.allclose(fs.data, fs_batch.data))
+                self.assertEqual(fs_batch.pop_ids, ['A','B'])
+                self.assertEqual(fs_batch.extrap_x, fs.extrap_x)
+
+        self.assertRaises(ValueError, dadi.Spectrum.from_phi_batch, phi, ns,
+                          (xx,xx))
+
+    def test_from_phi_fitted(self):
+        """
+        Test the sampling of phi that matches fitted fluxes.
+        """
+        xx = dadi.Numerics.default_grid(20)
+        phi = dadi.PhiManip.phi_1D(xx)
+        fs = dadi.Spectrum.from_phi(phi, (10,), (xx,), fitted=True)
+        phi2 = dadi.PhiManip.phi_1D_to_2D(xx, phi)
+        fs2 = dadi.Spectrum.from_phi(phi2, (4,6), (xx,xx), fitted=True)
+        fs2_ND = dadi.Spectrum._from_phi_ND((4,6), (xx,xx), phi2, fitted=True)
+        fs2_batch, = dadi.Spectrum.from_phi_batch(phi2[numpy.newaxis], (4,6),
+                                                  (xx,xx), fitted=True)
+
+        # Away from the boundaries, the neutral phi is 1/x, which x*(1-x)*phi
+        # interpolates exactly.
+        self.assert_(numpy.allclose(fs[1:-1], 1./numpy.arange(1,10),
+                                    rtol=1e-10))
+        self.assert_(numpy.allclose(fs2.data, fs2_ND.data))
+        self.assert_(numpy.allclose(fs2.data, fs2_batch.data))
+
+        # By default, the sampling follows Integration.use_fitted_fluxes.
+        self.assert_(not numpy.allclose(dadi.Spectrum.from_phi(phi, (10,),
+                                                               (xx,)), fs))
+        dadi.Integration.use_fitted_fluxes = True
+        try:
+            self.assert_(numpy.all(dadi.Spectrum.from_phi(phi, (10,), (xx,))
+                                   == fs))
+        finally:
+            dadi.Integration.use_fitted_fluxes = False
+
 suite = unittest.TestLoader().loadTestsFromTestCase(SpectrumTestCase)
@@ -43,4 +43,40 @@ class TridiagonalTestCase(unittest.TestCase):
 
         self.assert_(numpy.allclose(self.r, rcheck, atol=1e-3))
 
+    def test_tridiag_batch(self):
+        """
+        Test batched tridiagonal routine, along both axes
+        """
+        # Stack several variants of our system into 2D arrays.
+        nsys = 7
+        scales = 1 + numpy.arange(nsys)
+        a = self.a[:,numpy.newaxis] * scales
+        b = self.b[:,numpy.newaxis] * scales + 1
+        c = self.c[:,numpy.newaxis] * scales
+        r = self.r[:,numpy.newaxis] * numpy.ones(nsys)
+
+        for axis in [0,1]:
+            if axis == 1:
+                a,b,c,r = a.T, b.T, c.T, r.T
+            u = dadi.tridiag.tridiag_batch(a,b,c,r,axis)
+            for ii in range(nsys):
+                if axis == 0:
+                    ucheck = dadi.tridiag.tridiag(a[:,ii],b[:,ii],c[:,ii],
+                                                  r[:,ii])
+                    self.assert_(numpy.allclose(u[:,ii], ucheck, rtol=1e-12))
+                else:
+                    ucheck = dadi.tridiag.tridiag(a[ii],b[ii],c[ii],r[ii])
+                    self.assert_(numpy.allclose(u[ii], ucheck, rtol=1e-12))
+
+    def test_tridiag_factored(self):
+        """
+        Test solving with a pre-factored tridiagonal system
+        """
+        b = self.b + 1
+        gam, ibet = dadi.tridiag.tridiag_factor(self.a, b, self.c)
+        for r in [self.r, 2*self.r[::-1]]:
+            u = dadi.tridiag.tridiag_factored(self.a, gam, ibet, r)
+            ucheck = dadi.tridiag.tridiag(self.a, b, self.c, r)
+            self.assert_(numpy.allclose(u, ucheck, rtol=1e-12))
+
 suite = unittest.TestLoader().loadTestsFromTestCase(TridiagonalTestCase)
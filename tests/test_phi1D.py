@@ -37,6 +37,33 @@ class phi1DTestCase(unittest.TestCase):
         """
         dadi.PhiManip.phi_1D(self.xx, gamma=1, h=0.3)
 
+    def test_dominance_integrals(self):
+        """
+        Test phi with dominance against integration by quad.
+        """
+        import scipy.integrate
+        for gamma, h in [(1, 0.3), (-50, 0.1), (100, 0.8), (-5, 2)]:
+            phi = dadi.PhiManip.phi_1D(self.xx, gamma=gamma, h=h)
+            integrand = lambda xi: numpy.exp(-4*gamma*h*xi
+                                             - 2*gamma*(1-2*h)*xi**2)
+            # The integrals can be tiny, so only a relative tolerance is
+            # meaningful.
+            quad = lambda lower: scipy.integrate.quad(integrand, lower, 1,
+                                                      epsabs=0,
+                                                      epsrel=1e-12)[0]
+            int0 = quad(0)
+            for x, val in zip(self.xx[1:-1], phi[1:-1]):
+                expected = numpy.exp(4*gamma*h*x + 2*gamma*(1-2*h)*x**2)\
+                        * quad(x)/int0 / (x*(1-x))
+                self.assertAlmostEqual(val/expected, 1, places=6)
+            self.assertAlmostEqual(phi[-1]*int0, 1, places=6)
+
+        # The cached profile is not changed by later calls.
+        phi = dadi.PhiManip.phi_1D(self.xx, gamma=1, h=0.3)
+        dadi.PhiManip.phi_1D(self.xx, nu=2, gamma=1, h=0.3)[:] = 0
+        self.assert_(numpy.all(dadi.PhiManip.phi_1D(self.xx, gamma=1, h=0.3)
+                               == phi))
+
 suite = unittest.TestLoader().loadTestsFromTestCase(phi1DTestCase)
 
 if __name__ == '__main__':